@@ -0,0 +1,185 @@
+import logging
+import os
+import pickle
+import sys
+from datetime import datetime
+
+import numpy as np
+from sklearn.model_selection import train_test_split
+
+from driver.test import load_dataframes, load_modules, classify
+from io_.db import Database
+from io_.fs import write_text
+from modules.test_outcome_module import TestOutcomeModule
+from modules.test_performed_module import TestPerformedModule
+from root import from_root
+from util.candidates import decode_candidates
+from util.logger import set_params
+from util.preprocessor import preprocess, remove_symbols, replace_numbers, \
+    replace_organisms, labels_to_lowercase
+from util.timer import time_call
+
+
+TP_SQL = from_root("sql\\train\\test_performed.sql")
+TO_SQL = from_root("sql\\train\\test_outcome.sql")
+
+REPEATS = 3
+
+# the fraction of the training data held out to measure accuracy on
+TEST_FRACTION = 0.2
+
+SAVE_TO = from_root("results\\benchmark")
+
+
+def main():
+    db = Database.get_instance()
+    tp_df = db.extract(TP_SQL)
+
+    write_text(os.path.join(SAVE_TO, "preprocess.txt"),
+               benchmark_preprocess(tp_df))
+
+    write_text(os.path.join(SAVE_TO, "candidates.txt"),
+               benchmark_candidates(load_modules(),
+                                    load_dataframes(db, decode=False)))
+
+    to_df = db.extract(TO_SQL)
+    write_text(os.path.join(SAVE_TO, "hashing.txt"),
+               benchmark_hashing(TestPerformedModule, "test_performed", tp_df)
+               + benchmark_hashing(TestOutcomeModule, "test_outcome", to_df))
+
+
+def benchmark_preprocess(df):
+    """
+    Compares the runtime of the vectorized preprocess function against the
+    original row-by-row implementation, checking that both produce identical
+    output.
+    :param df: the DataFrame to preprocess
+    - required columns: {"result_full_description", "candidates"}
+    :return: a string summarizing the runtimes
+    """
+    text = f"Rows: {df.shape[0]}\n"
+
+    for organisms in [False, True]:
+        expected = rowwise_preprocess(df, organisms=organisms)
+        actual = preprocess(df, organisms=organisms)
+        if not expected.equals(actual):
+            raise AssertionError(
+                f"preprocess output differs (organisms={organisms})")
+
+        rowwise_time = time_call(
+            lambda: rowwise_preprocess(df, organisms=organisms), REPEATS)
+        vectorized_time = time_call(
+            lambda: preprocess(df, organisms=organisms), REPEATS)
+
+        text += f"organisms={organisms}: "\
+                + f"row-by-row {rowwise_time:.3f}s, "\
+                + f"vectorized {vectorized_time:.3f}s, "\
+                + f"speedup {rowwise_time / vectorized_time:.2f}x\n"
+
+    return text
+
+
+def benchmark_candidates(modules, dfs):
+    """
+    Compares the runtime of classifying the driver/test.py DataFrames with and
+    without decoding their MetaMap candidates once up front.
+    :param modules: a Dict of modules obtained from driver.test.load_modules
+    :param dfs: the test performed, test outcome, level 1 and level 2
+    DataFrames, with undecoded candidates
+    :return: a string summarizing the runtimes
+    """
+    def classify_decoded():
+        classify(modules, *[decode_candidates(df) for df in dfs])
+
+    plain_time = time_call(lambda: classify(modules, *dfs), REPEATS)
+    decoded_time = time_call(classify_decoded, REPEATS)
+
+    return f"Rows: {sum(df.shape[0] for df in dfs)}\n"\
+           + f"Parsing candidates per module: {plain_time:.3f}s\n"\
+           + f"Decoding candidates once: {decoded_time:.3f}s\n"\
+           + f"Speedup: {plain_time / decoded_time:.2f}x\n"
+
+
+def benchmark_hashing(module_class, output, df):
+    """
+    Compares the given module with vocabulary-based count features against
+    the same module with hashing features: retraining and classification
+    runtimes, accuracy on held-out rows, and pickled vectorizer size.
+    :param module_class: TestPerformedModule or TestOutcomeModule
+    :param output: the name of the column containing the labels
+    :param df: the DataFrame of training data to split into training and
+    held-out rows
+    - required columns: columns required by module_class().retrain, and
+      {"test_key", "result_key"}
+    :return: a string summarizing the comparison
+    """
+    df_train, df_test = train_test_split(
+        df, test_size=TEST_FRACTION, random_state=0)
+    y_true = labels_to_lowercase(df_test)[output].values
+
+    text = f"{module_class.__name__}: {df_train.shape[0]} training rows, "\
+           + f"{df_test.shape[0]} held-out rows\n"
+
+    for features in ["count", "hashing"]:
+        module = module_class(features=features)
+        retrain_time = time_call(lambda: module.retrain(df_train), 1)
+        classify_time = time_call(lambda: module.classify(df_test), REPEATS)
+
+        y_pred = module.classify(df_test)[f"{output}_pred"].values
+        accuracy = np.mean(y_pred == y_true)
+        size = len(pickle.dumps(module.vectorizer))
+
+        text += f"{features}: retrain {retrain_time:.3f}s, "\
+                + f"classify {classify_time:.3f}s, "\
+                + f"accuracy {accuracy:.4f}, "\
+                + f"vectorizer {size} bytes "\
+                + f"({module.classifier.__class__.__name__})\n"
+
+    return text
+
+
+def rowwise_preprocess(df, organisms=False):
+    """
+    The original row-by-row implementation of util.preprocessor.preprocess,
+    kept as the baseline for benchmarking.
+    :param df: the DataFrame to preprocess
+    - required columns: {"result_full_description", "candidates" (if organisms
+      is True)}
+    :param organisms: whether to replace organism names in the
+    result_full_descriptions with "_ORGANISM_"
+    :return: the preprocessed DataFrame
+    """
+    df = df.copy()
+
+    df["result_full_description"] = df["result_full_description"].apply(
+        lambda rfd: replace_numbers(remove_symbols(rfd.lower()))
+    )
+
+    if organisms:
+        def helper(row):
+            return replace_organisms(
+                row["result_full_description"],
+                row["candidates"]
+            )
+
+        df["result_full_description"] = df.apply(helper, axis=1)
+
+    df = labels_to_lowercase(df)
+    return df
+
+
+if __name__ == "__main__":
+    print("Started executing script.\n")
+    start_time = datetime.now()
+
+    logger = logging.getLogger(__name__)
+    set_params(logger, from_root("log\\benchmark.log"))
+
+    try:
+        main()
+    except Exception as e:
+        logger.exception("benchmark.py: Fatal error")
+        sys.exit(1)
+
+    print(f"\nExecution time: {datetime.now() - start_time}")
+    print("Finished executing script.")
@@ -1,11 +1,17 @@
+import json
 import logging
+import os
 import sys
 from datetime import datetime
 
 from io_.db import Database
+from io_.fs import read_json, write_json
 from root import from_root
+from util.annotation_cache import AnnotationCache
+from util.get_keys import get_keys
 from util.logger import set_params
-from util.tagger import annotate
+from util.metamap_server import MetaMapServer
+from util.tagger import annotate, ERRORS, MEMORY_ERROR
 
 
 SQL_FILEPATH = from_root("sql\\needs_tagging.sql")
@@ -14,13 +20,107 @@ SCHEMA = "dbo"
 
 OBSERVATIONS = False
 
+# number of MetaMap API connections to open in the Java server
+POOL_SIZE = 4
+
+CACHE_FILEPATH = from_root("cache\\metamap.sqlite")
+
+# number of rows extracted, annotated and inserted into dbo.metamap at a time
+CHUNK_SIZE = 5000
+
+# progress and failed rows of previous runs. Inserted chunks are excluded by
+# needs_tagging.sql, so a restarted run continues after the last inserted
+# chunk; rows that failed with one of SKIP_ERRORS are not retried.
+CHECKPOINT_FILEPATH = from_root("cache\\metamap_checkpoint.json")
+SKIP_ERRORS = {MEMORY_ERROR}
+
 
 def main():
     db = Database.get_instance()
-    df = db.extract(SQL_FILEPATH)
 
-    annotations = annotate(df, observations=OBSERVATIONS)
-    db.insert(annotations, TABLE, SCHEMA)
+    checkpoint = load_checkpoint()
+    n_rows = 0
+
+    # attaches to the Java server started by driver/metamap_server.py, if it
+    # is running
+    with MetaMapServer(pool_size=POOL_SIZE) as server,\
+            AnnotationCache(CACHE_FILEPATH) as cache:
+        # needs_tagging.sql reads dbo.metamap without locks, so the chunks
+        # inserted while the query is still streaming cannot block it
+        for df in db.extract_chunks(SQL_FILEPATH, CHUNK_SIZE):
+            chunk = skip_failed(df, checkpoint)
+            annotations = annotate(chunk, observations=OBSERVATIONS,
+                                   server=server, cache=cache)
+            insert_chunk(db, annotations, checkpoint)
+
+            n_rows += df.shape[0]
+            print(f"Finished tagging {n_rows} rows")
+
+
+def load_checkpoint():
+    """
+    Returns the checkpoint saved by previous runs, or a new checkpoint if there
+    is none.
+    :return: a Dict with keys "tagged" (the number of rows inserted so far) and
+    "failed" (a Dict mapping the JSON-serialized keys of each failed row to
+    its error label)
+    """
+    if os.path.exists(CHECKPOINT_FILEPATH):
+        return read_json(CHECKPOINT_FILEPATH)
+    return {"tagged": 0, "failed": {}}
+
+
+def skip_failed(df, checkpoint):
+    """
+    Removes the rows that previously failed with one of SKIP_ERRORS from the
+    given DataFrame.
+    :param df: the DataFrame of rows that need tagging
+    :param checkpoint: the checkpoint returned by load_checkpoint
+    :return: the rows that should be tagged in this run
+    """
+    skipped = {
+        row_keys for row_keys, error in checkpoint["failed"].items()
+        if error in SKIP_ERRORS
+    }
+    if not skipped:
+        return df
+
+    keys = get_keys(OBSERVATIONS)
+    mask = [
+        json.dumps(row_keys) not in skipped
+        for row_keys in df[keys].values.tolist()
+    ]
+    print(f"Skipping {df.shape[0] - sum(mask)} rows that failed previously")
+    return df[mask]
+
+
+def insert_chunk(db, annotations, checkpoint):
+    """
+    Inserts the successfully annotated rows of the given chunk into
+    dbo.metamap, then records the chunk's failed rows in the checkpoint and
+    saves it.
+    :param db: the Database to insert to
+    :param annotations: the DataFrame returned by annotate for the chunk
+    :param checkpoint: the checkpoint returned by load_checkpoint
+    :return: None
+    """
+    failed = annotations["tags"].isin(ERRORS)
+    db.insert(annotations[~failed], TABLE, SCHEMA)
+
+    keys = get_keys(OBSERVATIONS)
+    for row_keys, error in zip(annotations[keys].values.tolist(),
+                               annotations["tags"]):
+        if error in ERRORS:
+            checkpoint["failed"][json.dumps(row_keys)] = error
+        else:
+            checkpoint["failed"].pop(json.dumps(row_keys), None)
+
+    checkpoint["tagged"] += int((~failed).sum())
+    write_json(CHECKPOINT_FILEPATH, checkpoint)
+
+    if failed.any():
+        print(f"Failed to tag {failed.sum()} rows: "
+              f"{annotations.loc[failed, 'tags'].value_counts().to_dict()}")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,43 @@
+import logging
+import sys
+import time
+from datetime import datetime
+
+from root import from_root
+from util.logger import set_params
+from util.metamap_server import MetaMapServer
+
+
+HEALTH_CHECK_INTERVAL = 60
+
+
+# Keeps a MetaMapBuild.jar JVM running, so that driver/metamap.py and other
+# callers of util.tagger.annotate attach to it instead of paying JVM and MetaMap
+# startup on every run. The JVM's health is checked every HEALTH_CHECK_INTERVAL
+# seconds, and the JVM is restarted if it died. Stop with Ctrl+C.
+def main():
+    with MetaMapServer(pool_size=0) as server:
+        print(f"Java server is running on port {server.port}")
+        try:
+            while True:
+                time.sleep(HEALTH_CHECK_INTERVAL)
+                server.check()
+        except KeyboardInterrupt:
+            print("Stopping Java server")
+
+
+if __name__ == "__main__":
+    print("Started executing script.\n")
+    start_time = datetime.now()
+
+    logger = logging.getLogger(__name__)
+    set_params(logger, from_root("log\\metamap_server.log"))
+
+    try:
+        main()
+    except Exception as e:
+        logger.exception("metamap_server.py: Fatal error")
+        sys.exit(1)
+
+    print(f"\nExecution time: {datetime.now() - start_time}")
+    print("Finished executing script.")
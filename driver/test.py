@@ -1,16 +1,80 @@
+import hashlib
 import logging
 import sys
 from datetime import datetime
 
+import pandas as pd
+
 from io_.db import Database
-from io_.fs import write_df
+from io_.fs import read_text, write_df
 from modules.level_1_ml_module import Level1MLModule
 from modules.level_1_symbolic_module import Level1SymbolicModule
 from modules.level_2_module import Level2Module
 from modules.test_outcome_module import TestOutcomeModule
 from modules.test_performed_module import TestPerformedModule
 from root import from_root
+from util.candidates import decode_candidates
+from util.get_keys import get_keys
 from util.logger import set_params
+from util.artifact import read_attributes
+from util.manifest import get_fingerprint
+from util.pipeline import Pipeline
+from util.result_cache import ResultCache
+from util.sharding import get_n_workers
+
+
+MODULE_FILES = {
+    "tp": "pkl\\test_performed_module.pkl",
+    "to": "pkl\\test_outcome_module.pkl",
+    "l1ml": "pkl\\level_1_ml_module.pkl",
+    "l1s": "pkl\\level_1_symbolic_module.pkl",
+    "l2": "pkl\\level_2_module.pkl",
+    "tp_org_false": "pkl\\test_performed_organisms_false_module.pkl",
+    "to_org_false": "pkl\\test_outcome_organisms_false_module.pkl"
+}
+
+# artifact directories of the machine learning modules (see util.artifact),
+# which are loaded instead of their pickle files if they were saved from the
+# current pickle files
+MODULE_ARTIFACTS = {
+    "tp": "artifacts\\test_performed_module",
+    "to": "artifacts\\test_outcome_module",
+    "l1ml": "artifacts\\level_1_ml_module",
+    "tp_org_false": "artifacts\\test_performed_organisms_false_module",
+    "to_org_false": "artifacts\\test_outcome_organisms_false_module"
+}
+
+# the number of worker processes to classify with: modules that do not depend
+# on each other run concurrently in a Pipeline (see classify_parallel); -1 uses
+# one per CPU, and 1 classifies sequentially in this process
+WORKERS = -1
+
+# the number of worker processes each machine learning module classifies
+# shards of its rows with when classifying sequentially (see util.sharding);
+# -1 uses one per CPU, and 1 classifies in this process. Sharding splits the
+# rows of one module across workers rather than running different modules at
+# once, so the Pipeline's workers do not shard.
+SHARD_WORKERS = -1
+
+KEYS = get_keys(observations=False)
+
+TEST_SQL = [
+    from_root("sql\\test\\test_performed.sql"),
+    from_root("sql\\test\\test_outcome.sql"),
+    from_root("sql\\test\\level_1.sql"),
+    from_root("sql\\test\\level_2.sql")
+]
+
+# the task each TEST_SQL query selects rows for, as recorded in dbo.scored
+TASKS = ["test_performed", "test_outcome", "level_1", "level_2"]
+
+# whether to only classify the rows that the current model version has not
+# scored yet, instead of every row returned by TEST_SQL. Scored rows are
+# recorded in dbo.scored, which is created if it does not exist
+# (sql/create_scored.sql).
+INCREMENTAL = False
+INCREMENTAL_SQL = from_root("sql\\incremental.sql")
+CREATE_SCORED_SQL = from_root("sql\\create_scored.sql")
 
 
 def main():
@@ -19,58 +83,220 @@ def main():
 
     db = Database.get_instance()
 
-    tp_df = db.extract(from_root("sql\\test\\test_performed.sql"))
-    to_df = db.extract(from_root("sql\\test\\test_outcome.sql"))
-    l1_df = db.extract(from_root("sql\\test\\level_1.sql"))
-    l2_df = db.extract(from_root("sql\\test\\level_2.sql"))
+    model_version = None
+    if INCREMENTAL:
+        db.execute(CREATE_SCORED_SQL)
+        model_version = get_model_version()
+        print(f"Loading rows not scored by model version {model_version}")
+
+    tp_df, to_df, l1_df, l2_df = load_dataframes(
+        db, model_version=model_version)
 
     print("Finished loading the DataFrames.")
 
     # ==========================================================================
-    # Load modules
-
-    tp_module = TestPerformedModule.load_from_file(
-        from_root("pkl\\test_performed_module.pkl"))
-
-    to_module = TestOutcomeModule.load_from_file(
-        from_root("pkl\\test_outcome_module.pkl"))
-
-    l1ml_module = Level1MLModule.load_from_file(
-        from_root("pkl\\level_1_ml_module.pkl"))
-
-    l1s_module = Level1SymbolicModule(to_module).load_from_file(
-        from_root("pkl\\level_1_symbolic_module.pkl"))
+    # Classify the DataFrames
 
-    l2_module = Level2Module(l1ml_module).load_from_file(
-        from_root("pkl\\level_2_module.pkl"))
+    n_workers = get_n_workers(WORKERS)
+    if n_workers > 1:
+        results, org_false_results, retall_results\
+            = classify_parallel(tp_df, to_df, l1_df, l2_df, n_workers)
+    else:
+        modules = load_modules()
 
-    tp_module_org_false = TestPerformedModule.load_from_file(
-        from_root("pkl\\test_performed_organisms_false_module.pkl"))
+        print("Finished loading modules.")
 
-    to_module_org_false = TestOutcomeModule.load_from_file(
-        from_root("pkl\\test_outcome_organisms_false_module.pkl"))
+        results, org_false_results, retall_results\
+            = classify(modules, tp_df, to_df, l1_df, l2_df, SHARD_WORKERS)
 
-    print("Finished loading modules.")
+    print("Finished classifying the DataFrames.")
 
     # ==========================================================================
-    # Classify the DataFrames
+    # Write final prediction results to CSV and database
+
+    write_df(from_root("results\\predictions.csv"), results)
+    write_df(from_root("results\\predictions_org_false.csv"), org_false_results)
+    write_df(from_root("results\\predictions_retall.csv"), retall_results)
 
-    tp_results = tp_module.classify(tp_df)
-    to_results = to_module.classify(to_df)
-    l1ml_results = l1ml_module.classify(l1_df)
-    l1s_results = l1s_module.classify(l1_df)
-    l2_results = l2_module.classify(l2_df)
+    db.insert(results, "predictions", "dbo")
 
-    tp_org_false_results = tp_module_org_false.classify(tp_df)
-    to_org_false_results = to_module_org_false.classify(to_df)
+    if INCREMENTAL:
+        db.insert(get_scored(model_version, [tp_df, to_df, l1_df, l2_df]),
+                  "scored", "dbo")
 
-    l1s_retall_results = l1s_module.classify(l1_df, return_all=True)
-    l2_retall_results = l2_module.classify(l2_df, return_all=True)
+    print("Finished writing results to CSV and database.")
 
-    print("Finished classifying the DataFrames.")
 
-    # ==========================================================================
-    # Write final prediction results to CSV and database
+def load_dataframes(db, decode=True, model_version=None):
+    """
+    Extracts the DataFrames to classify from the database.
+    :param db: the Database to extract from
+    :param decode: whether to parse the MetaMap candidates of each DataFrame
+    once up front, so that the modules share the decoded candidates instead of
+    each parsing the JSON strings again
+    :param model_version: the model version returned by get_model_version to
+    extract only the rows that it has not scored yet for each DataFrame's task
+    (with an additional "description_hash" column), or None to extract every
+    row
+    :return: the test performed, test outcome, level 1 and level 2 DataFrames
+    """
+    if model_version is None:
+        dfs = [db.extract(sql_filepath) for sql_filepath in TEST_SQL]
+    else:
+        template = read_text(INCREMENTAL_SQL)
+        dfs = [
+            db.query(template.replace("{query}", read_text(sql_filepath)),
+                     params={"model_version": model_version, "task": task})
+            for sql_filepath, task in zip(TEST_SQL, TASKS)
+        ]
+
+    if decode:
+        dfs = [decode_candidates(df) for df in dfs]
+
+    return dfs
+
+
+def get_model_version():
+    """
+    Returns the version of the trained modules: a hash of the fingerprints
+    recorded in their manifests (see util.manifest), which changes whenever
+    any module is retrained. These are the fingerprints of what load_module
+    loads, since an artifact directory is only loaded if it was saved from the
+    module's current pickle file (see _load_ml_module).
+    :return: a 16-character hexadecimal string
+    """
+    digest = hashlib.sha256()
+    for name in sorted(MODULE_FILES):
+        digest.update(get_fingerprint(from_root(MODULE_FILES[name])).encode())
+    return digest.hexdigest()[:16]
+
+
+def get_scored(model_version, dfs):
+    """
+    Returns the rows of dbo.scored recording that the given DataFrames have
+    been scored for their tasks by the given model version.
+    :param model_version: the model version returned by get_model_version
+    :param dfs: the DataFrames returned by load_dataframes for model_version,
+    in the order of TASKS
+    :return: a DataFrame with one row per task and key
+    - columns: {"test_key", "result_key", "task", "model_version",
+      "description_hash"}
+    """
+    scored = []
+    for df, task in zip(dfs, TASKS):
+        task_scored = df.loc[:, KEYS + ["description_hash"]]\
+            .drop_duplicates(subset=KEYS)
+        task_scored.insert(len(KEYS), "task", task)
+        scored.append(task_scored)
+
+    scored = pd.concat(scored, ignore_index=True)
+    scored.insert(len(KEYS) + 1, "model_version", model_version)
+    return scored
+
+
+def load_modules():
+    """
+    Loads the trained modules from their artifact directories or pickle files
+    (see load_module).
+    :return: a Dict mapping module names to the loaded modules
+    """
+    return {name: load_module(name) for name in MODULE_FILES}
+
+
+_loaded_modules = {}
+
+
+def load_module(name):
+    """
+    Loads the trained module with the given name from its artifact directory
+    or pickle file, along with the modules it refers to. Each module is only
+    loaded once per process.
+    :param name: a key of MODULE_FILES
+    :return: the loaded module
+    """
+    if name in _loaded_modules:
+        return _loaded_modules[name]
+
+    filepath = from_root(MODULE_FILES[name])
+
+    if name in ["tp", "tp_org_false"]:
+        module = _load_ml_module(TestPerformedModule, name, filepath)
+    elif name in ["to", "to_org_false"]:
+        module = _load_ml_module(TestOutcomeModule, name, filepath)
+    elif name == "l1ml":
+        module = _load_ml_module(Level1MLModule, name, filepath)
+    elif name == "l1s":
+        module = Level1SymbolicModule(load_module("to")).load_from_file(
+            filepath)
+    elif name == "l2":
+        module = Level2Module(load_module("l1ml")).load_from_file(filepath)
+    else:
+        raise ValueError(f"Unknown module {name}.")
+
+    _loaded_modules[name] = module
+    return module
+
+
+def _load_ml_module(module_class, name, filepath):
+    """
+    Loads the machine learning module with the given name from its artifact
+    directory if the artifact was saved from the given pickle file as it is
+    now, or from the pickle file otherwise (e.g.: the module was retrained or
+    updated and only saved to its pickle file since).
+    :param module_class: the class of the module
+    :param name: a key of MODULE_ARTIFACTS
+    :param filepath: the absolute path to the module's pickle file
+    :return: the loaded module
+    """
+    dirpath = from_root(MODULE_ARTIFACTS[name])
+    attributes = read_attributes(dirpath)
+
+    if attributes is not None:
+        if attributes.get("fingerprint") == get_fingerprint(filepath):
+            return module_class.load_from_artifact(dirpath)
+        print(f"{module_class.__name__}: The artifact at {dirpath} was not "
+              f"saved from {filepath}; loading the pickle file instead")
+
+    return module_class.load_from_file(filepath)
+
+
+def classify(modules, tp_df, to_df, l1_df, l2_df, n_jobs=1):
+    """
+    Classifies the given DataFrames with the given modules. Modules that refer
+    to other modules reuse those modules' results through a shared ResultCache
+    instead of classifying the same rows again.
+    :param modules: a Dict of modules obtained from load_modules
+    :param tp_df: the DataFrame to predict test_performed for
+    :param to_df: the DataFrame to predict test_outcome for
+    :param l1_df: the DataFrame to predict level_1 for
+    :param l2_df: the DataFrame to predict level_2 for
+    :param n_jobs: the number of worker processes the machine learning modules
+    classify shards of their rows with (see util.sharding)
+    :return: the merged prediction results;
+             the merged results of the organisms=False modules;
+             the merged results of the return_all=True classifications
+    """
+    cache = ResultCache()
+
+    # classify the rows the symbolic modules need upstream results for along
+    # with the ML modules' own rows, so that they are classified in shards too
+    tp_results = modules["tp"].classify(tp_df, cache=cache, n_jobs=n_jobs)
+    to_results = _restrict(modules["to"].classify(
+        _union(to_df, l1_df), cache=cache, n_jobs=n_jobs), to_df)
+    l1ml_results = _restrict(modules["l1ml"].classify(
+        _union(l1_df, l2_df), cache=cache, n_jobs=n_jobs), l1_df)
+    l1s_results = modules["l1s"].classify(l1_df, cache=cache)
+    l2_results = modules["l2"].classify(l2_df, cache=cache)
+
+    tp_org_false_results = modules["tp_org_false"].classify(
+        tp_df, cache=cache, n_jobs=n_jobs)
+    to_org_false_results = modules["to_org_false"].classify(
+        to_df, cache=cache, n_jobs=n_jobs)
+
+    l1s_retall_results = modules["l1s"].classify(
+        l1_df, return_all=True, cache=cache)
+    l2_retall_results = modules["l2"].classify(
+        l2_df, return_all=True, cache=cache)
 
     results = tp_results\
         .merge(to_results, how="outer", on=["test_key", "result_key"])\
@@ -84,13 +310,110 @@ def main():
     retall_results = l1s_retall_results\
         .merge(l2_retall_results, how="outer", on=["test_key", "result_key"])
 
-    write_df(from_root("results\\predictions.csv"), results)
-    write_df(from_root("results\\predictions_org_false.csv"), org_false_results)
-    write_df(from_root("results\\predictions_retall.csv"), retall_results)
+    return results, org_false_results, retall_results
+
+
+def classify_parallel(tp_df, to_df, l1_df, l2_df, max_workers):
+    """
+    Classifies the given DataFrames like classify, running modules that do not
+    depend on each other concurrently in a process pool:
+    - TestOutcomeModule -> Level1SymbolicModule
+    - Level1MLModule -> Level2Module
+    - TestPerformedModule and the organisms=False modules on their own
+    Each worker loads the modules it needs (see load_module).
+    :param tp_df: the DataFrame to predict test_performed for
+    :param to_df: the DataFrame to predict test_outcome for
+    :param l1_df: the DataFrame to predict level_1 for
+    :param l2_df: the DataFrame to predict level_2 for
+    :param max_workers: the maximum number of worker processes
+    :return: the merged prediction results;
+             the merged results of the organisms=False modules;
+             the merged results of the return_all=True classifications
+    """
+    # Level1SymbolicModule needs test outcomes for the level 1 rows, and
+    # Level2Module needs level 1 predictions for the level 2 rows
+    to_all_df = _union(to_df, l1_df)
+    l1_all_df = _union(l1_df, l2_df)
+
+    pipeline = Pipeline()\
+        .add("tp", _classify_task, "tp", tp_df)\
+        .add("to", _classify_task, "to", to_all_df)\
+        .add("l1ml", _classify_task, "l1ml", l1_all_df)\
+        .add("tp_org_false", _classify_task, "tp_org_false", tp_df)\
+        .add("to_org_false", _classify_task, "to_org_false", to_df)\
+        .add("l1s", _classify_task, "l1s", l1_df, depends_on=["to"])\
+        .add("l2", _classify_task, "l2", l2_df, depends_on=["l1ml"])
+
+    results = pipeline.run(max_workers=max_workers)
+
+    tp_results, _ = results["tp"]
+    to_results = _restrict(results["to"][0], to_df)
+    l1ml_results = _restrict(results["l1ml"][0], l1_df)
+    l1s_results, l1s_retall_results = results["l1s"]
+    l2_results, l2_retall_results = results["l2"]
+    tp_org_false_results, _ = results["tp_org_false"]
+    to_org_false_results, _ = results["to_org_false"]
+
+    merged_results = tp_results\
+        .merge(to_results, how="outer", on=KEYS)\
+        .merge(l1ml_results, how="outer", on=KEYS)\
+        .merge(l1s_results, how="outer", on=KEYS)\
+        .merge(l2_results, how="outer", on=KEYS)
 
-    db.insert(results, "predictions", "dbo")
+    org_false_results = tp_org_false_results\
+        .merge(to_org_false_results, how="outer", on=KEYS)
 
-    print("Finished writing results to CSV and database.")
+    retall_results = l1s_retall_results\
+        .merge(l2_retall_results, how="outer", on=KEYS)
+
+    return merged_results, org_false_results, retall_results
+
+
+def _classify_task(name, df, upstream=None):
+    """
+    Classifies the given DataFrame with the module with the given name. Runs in
+    a Pipeline worker process.
+    :param name: a key of MODULE_FILES
+    :param df: the DataFrame to classify
+    :param upstream: the results of the task the module depends on, if any
+    :return: the classification results;
+             the return_all=True classification results for symbolic modules,
+             or None
+    """
+    module = load_module(name)
+
+    if upstream is None:
+        return module.classify(df), None
+
+    cache = ResultCache()
+    referred_module = module.to_module if name == "l1s" else module.l1_module
+    cache.put(referred_module, upstream[0])
+
+    return module.classify(df, cache=cache),\
+        module.classify(df, return_all=True, cache=cache)
+
+
+def _union(df_1, df_2):
+    """
+    Returns the rows of both given DataFrames, dropping rows of the second
+    DataFrame whose keys are in the first.
+    :param df_1: a DataFrame to classify
+    :param df_2: another DataFrame to classify
+    :return: a DataFrame with one row per key
+    """
+    return pd.concat([df_1, df_2], ignore_index=True, sort=False)\
+        .drop_duplicates(subset=KEYS)
+
+
+def _restrict(results, df):
+    """
+    Returns the given classification results for the rows of the given
+    DataFrame, in the DataFrame's order.
+    :param results: a DataFrame containing classification results
+    :param df: the DataFrame whose rows to keep
+    :return: the restricted classification results
+    """
+    return pd.merge(df.loc[:, KEYS], results, how="inner", on=KEYS)
 
 
 if __name__ == "__main__":
@@ -12,6 +12,10 @@ from io_.db import Database
 from util.logger import set_params
 
 
+# the number of worker processes to cross-validate candidate classifiers with
+WORKERS = 4
+
+
 def main():
     db = Database.get_instance()
 
@@ -21,13 +25,16 @@ def main():
     tp_df = db.extract(from_root("sql\\train\\test_performed.sql"))
 
     tp_module = TestPerformedModule()
-    tp_module.retrain(tp_df)
+    tp_module.retrain(tp_df, n_jobs=WORKERS)
     tp_module.save_to_file(from_root("pkl\\test_performed_module.pkl"))
+    tp_module.save_to_artifact(from_root("artifacts\\test_performed_module"))
 
     tp_module_org_false = TestPerformedModule(organisms=False)
-    tp_module_org_false.retrain(tp_df)
+    tp_module_org_false.retrain(tp_df, n_jobs=WORKERS)
     tp_module_org_false.save_to_file(
         from_root("pkl\\test_performed_organisms_false_module.pkl"))
+    tp_module_org_false.save_to_artifact(
+        from_root("artifacts\\test_performed_organisms_false_module"))
 
     # ==========================================================================
     # Test outcome
@@ -35,13 +42,16 @@ def main():
     to_df = db.extract(from_root("sql\\train\\test_outcome.sql"))
 
     to_module = TestOutcomeModule()
-    to_module.retrain(to_df)
+    to_module.retrain(to_df, n_jobs=WORKERS)
     to_module.save_to_file(from_root("pkl\\test_outcome_module.pkl"))
+    to_module.save_to_artifact(from_root("artifacts\\test_outcome_module"))
 
     to_module_org_false = TestOutcomeModule(organisms=False)
-    to_module_org_false.retrain(to_df)
+    to_module_org_false.retrain(to_df, n_jobs=WORKERS)
     to_module_org_false.save_to_file(
         from_root("pkl\\test_outcome_organisms_false_module.pkl"))
+    to_module_org_false.save_to_artifact(
+        from_root("artifacts\\test_outcome_organisms_false_module"))
 
     # ==========================================================================
     # Level 1
@@ -50,8 +60,9 @@ def main():
 
     # Machine learning
     l1ml_module = Level1MLModule()
-    l1ml_module.retrain(l1_df)
+    l1ml_module.retrain(l1_df, n_jobs=WORKERS)
     l1ml_module.save_to_file(from_root("pkl\\level_1_ml_module.pkl"))
+    l1ml_module.save_to_artifact(from_root("artifacts\\level_1_ml_module"))
 
     # Symbolic
     l1s_module = Level1SymbolicModule(to_module)
@@ -11,6 +11,7 @@ from modules.test_performed_module import TestPerformedModule
 from root import from_root
 from io_.db import Database
 from util.logger import set_params
+from util.vectorizer import FeatureCache
 from util.verifier import verify_module
 
 
@@ -35,8 +36,10 @@ def main():
 
 
 def verify_test_performed(db):
+    cache = FeatureCache()
+
     def tp_module_factory():
-        return TestPerformedModule(organisms=ORGANISMS)
+        return TestPerformedModule(organisms=ORGANISMS, feature_cache=cache)
 
     tp_df = db.extract(TP_SQL)
     verify_module(tp_module_factory, tp_df, "test_performed",
@@ -44,8 +47,10 @@ def verify_test_performed(db):
 
 
 def verify_test_outcome(db):
+    cache = FeatureCache()
+
     def to_module_factory():
-        return TestOutcomeModule(organisms=ORGANISMS)
+        return TestOutcomeModule(organisms=ORGANISMS, feature_cache=cache)
 
     to_df = db.extract(TO_SQL)
     verify_module(to_module_factory, to_df, "test_outcome",
@@ -53,8 +58,10 @@ def verify_test_outcome(db):
 
 
 def verify_level_1_ml(db):
+    cache = FeatureCache()
+
     def l1ml_module_factory():
-        return Level1MLModule()
+        return Level1MLModule(feature_cache=cache)
 
     l1_df = db.extract(L1_SQL)
     verify_module(l1ml_module_factory, l1_df, "level_1",
@@ -1,38 +1,115 @@
+import os
+from datetime import datetime
+
 import pandas as pd
 import sqlalchemy
+from sqlalchemy import event
+from sqlalchemy.exc import CompileError, DisconnectionError,\
+    NotSupportedError, ProgrammingError
+
+from io_.fs import read_json, read_text
+from root import from_root
+
+
+# optional JSON file with the keyword arguments of Database.__init__
+CONFIG_FILEPATH = from_root("config\\database.json")
+
+# environment variable that overrides the configured database URL
+URL_VARIABLE = "PIPELINE_DATABASE_URL"
+
+
+# the maximum number of bound parameters in one statement, per SQL dialect
+MAX_PARAMETERS = {
+    "mssql": 2100,
+    "sqlite": 999,
+    "postgresql": 32767,
+    "mysql": 65535
+}
+DEFAULT_MAX_PARAMETERS = 999
 
-from io_.fs import read_text
+# dialects whose drivers already run executemany efficiently (in process for
+# SQLite; batched by SQLAlchemy for psycopg2)
+EXECUTEMANY_DIALECTS = {"sqlite", "postgresql"}
+
+# the number of rows sent per executemany call by the fast_executemany path
+BULK_CHUNKSIZE = 10000
 
 
 class Database:
     _instance = None
+    _instance_pid = None
 
     @staticmethod
     def get_instance():
         """
-        Returns the Database object representing the current database
-        connection, creating a new database connection if none exists.
+        Returns the Database object representing the current process's
+        database connection pool, creating it from the configuration (see
+        from_config) if none exists. Each process gets its own Database, so
+        worker processes never share connections with their parent.
         :return: a Database object representing the current database connection
         """
-        if Database._instance is None:
-            Database._instance = Database()
+        if Database._instance is None\
+                or Database._instance_pid != os.getpid():
+            Database._instance = Database.from_config()
+            Database._instance_pid = os.getpid()
         return Database._instance
 
-    def __init__(self, server="SDDBSBI002", database="DSSG"):
+    @staticmethod
+    def from_config(filepath=CONFIG_FILEPATH):
         """
-        Creates a new database connection to the given server and database.
-        This class follows the singleton pattern. Do not manually call
-        __init__; instead, call the static get_instance method.
-        :param server: the name of the server to connect to
-        :param database: the name of the database to connect to
+        Returns a new Database configured by the JSON file at the given path,
+        if it exists. The file may contain any of the keyword arguments of
+        __init__ (e.g.: {"url": "sqlite:///test.db", "pool_size": 2}). The
+        URL_VARIABLE environment variable, if set, overrides the URL.
+        :param filepath: the absolute path to the JSON configuration file
+        :return: a new Database
+        """
+        config = read_json(filepath) if os.path.exists(filepath) else {}
+        if os.environ.get(URL_VARIABLE):
+            config["url"] = os.environ[URL_VARIABLE]
+        return Database(**config)
+
+    def __init__(self, server="SDDBSBI002", database="DSSG", url=None,
+                 pool_size=5, pool_pre_ping=True, fast_executemany=None):
         """
+        Creates a new database connection pool to the given server and
+        database, or to the given URL. Call the static get_instance method to
+        get the current process's configured Database; construct a Database
+        directly only to connect elsewhere (e.g.: a local SQLite database).
+        :param server: the name of the SQL Server to connect to, if url is None
+        :param database: the name of the database to connect to, if url is None
+        :param url: the SQLAlchemy URL of the database to connect to, or None
+        to connect to the given SQL Server database
+        :param pool_size: the number of connections to keep open in the pool
+        :param pool_pre_ping: whether to test each connection before using it,
+        replacing connections that the server has closed
+        :param fast_executemany: whether pyodbc sends each executemany batch
+        in one round trip; None enables it for pyodbc URLs
+        """
+        if url is None:
+            # "trusted_connection=yes" tells SQL Server to use Windows
+            # Authentication
+            url = f"mssql+pyodbc://{server}/{database}"\
+                  + "?driver=ODBC+Driver+13+for+SQL+Server"\
+                  + "&trusted_connection=yes"
+
+        url = sqlalchemy.engine.make_url(url)
+        options = {"pool_pre_ping": pool_pre_ping}
+
+        if url.get_backend_name() != "sqlite":
+            # SQLite's default pools do not take a size
+            options["pool_size"] = pool_size
 
-        # "trusted_connection=yes" tells SQL Server to use Windows
-        # Authentication
-        url = f"mssql+pyodbc://{server}/{database}"\
-              + "?driver=ODBC+Driver+13+for+SQL+Server"\
-              + "&trusted_connection=yes"
-        self.engine = sqlalchemy.create_engine(url)
+        if fast_executemany is None:
+            fast_executemany = url.get_driver_name() == "pyodbc"
+        if fast_executemany:
+            options["fast_executemany"] = True
+
+        self.engine = sqlalchemy.create_engine(url, **options)
+        _make_pool_process_safe(self.engine)
+
+        if url.get_backend_name() == "sqlite":
+            _use_write_ahead_log(self.engine)
 
     def extract(self, sql_filepath):
         """
@@ -43,13 +120,69 @@ class Database:
         :return: a DataFrame containing the results of executing the SQL query
         """
         sql = read_text(sql_filepath)
-        df = pd.read_sql(sql, self.engine)
+        df = self.query(sql)
         return df
 
-    def insert(self, df, table, schema):
+    def query(self, sql, params=None):
+        """
+        Executes the given SQL query, returning the results in a DataFrame.
+        :param sql: the SQL query to execute
+        :param params: a Dict of values for the query's named parameters
+        (e.g.: {"model_version": "1a2b"} for ":model_version"), or None if the
+        query has no parameters
+        :return: a DataFrame containing the results of executing the SQL query
+        """
+        if params is None:
+            return pd.read_sql(sql, self.engine)
+        return pd.read_sql(sqlalchemy.text(sql), self.engine, params=params)
+
+    def execute(self, sql_filepath):
+        """
+        Executes the SQL statement saved at the given SQL file in a single
+        transaction, discarding any results.
+        :param sql_filepath: the absolute path to the SQL file containing the
+        SQL statement to execute
+        :return: None
+        """
+        sql = read_text(sql_filepath)
+        with self.engine.begin() as connection:
+            connection.execute(sqlalchemy.text(sql))
+
+    def extract_chunks(self, sql_filepath, chunksize=10000):
+        """
+        Executes the SQL query saved at the given SQL file, yielding the results
+        in DataFrames of at most chunksize rows. Rows are streamed from the
+        database as the chunks are consumed, so the full results are never held
+        in memory at once. The query's connection and read transaction stay
+        open until the last chunk has been consumed (or the generator is
+        closed). Other connections can still write to the same database while
+        the chunks are consumed: SQLite databases are put in write-ahead log
+        mode for this (see _use_write_ahead_log).
+        :param sql_filepath: the absolute path to the SQL file containing the
+        SQL query to execute
+        :param chunksize: the maximum number of rows per chunk
+        :return: a generator of DataFrames containing the results of executing
+        the SQL query
+        """
+        sql = read_text(sql_filepath)
+        with self.engine.connect() as connection:
+            connection = connection.execution_options(stream_results=True)
+            for df in pd.read_sql(sql, connection, chunksize=chunksize):
+                yield df
+
+    def insert(self, df, table, schema, bulk=True):
         """
         Inserts the given DataFrame into the database table with the given name
-        and schema. Rows are inserted in batches of 1000 at a time.
+        and schema in a single transaction, and prints the insertion rate.
+        - In bulk mode, rows are sent with the fastest method the database
+          dialect supports: executemany with BULK_CHUNKSIZE rows per call if
+          the engine uses pyodbc's fast_executemany or the driver batches
+          executemany itself (see EXECUTEMANY_DIALECTS); otherwise multi-row
+          INSERT ... VALUES statements with as many rows as the dialect's
+          parameter limit allows, falling back to executemany if the dialect
+          cannot compile them or the database rejects their syntax. Any other
+          error (e.g.: a lock timeout or a lost connection) is raised.
+        - Otherwise, rows are inserted in batches of 1000 at a time.
         Precondition: The DataFrame and database table have the same columns
         (table columns with DEFAULT constraints may optionally be missing from
         the DataFrame.) This method has undefined behaviour if this precondition
@@ -57,7 +190,125 @@ class Database:
         :param df: the DataFrame to insert
         :param table: the name of the database table to insert to
         :param schema: the name of the database table to insert to
+        :param bulk: whether to use bulk mode
         :return: None
         """
-        df.to_sql(table, self.engine, schema=schema,
-                  if_exists="append", index=False, chunksize=1000)
+        start_time = datetime.now()
+        dialect = self.engine.dialect
+
+        if not bulk:
+            self._to_sql(df, table, schema, chunksize=1000)
+        elif getattr(dialect, "fast_executemany", False)\
+                or dialect.name in EXECUTEMANY_DIALECTS:
+            self._to_sql(df, table, schema, chunksize=BULK_CHUNKSIZE)
+        else:
+            max_parameters = MAX_PARAMETERS.get(
+                dialect.name, DEFAULT_MAX_PARAMETERS)
+            chunksize = max(1, (max_parameters - 1) // max(1, df.shape[1]))
+
+            try:
+                self._to_sql(df, table, schema, chunksize=chunksize,
+                             method="multi")
+            except (CompileError, NotSupportedError, ProgrammingError) as e:
+                # the transaction was rolled back, so no rows were inserted
+                print(f"Multi-row insert failed ({e.__class__.__name__}); "
+                      f"falling back to executemany")
+                self._to_sql(df, table, schema, chunksize=1000)
+
+        seconds = (datetime.now() - start_time).total_seconds()
+        print(f"Inserted {df.shape[0]} rows into {table} in {seconds:.1f}s "
+              f"({df.shape[0] / max(seconds, 1e-6):.0f} rows/s)")
+
+    def insert_chunks(self, chunks, table, schema, bulk=True):
+        """
+        Inserts the given DataFrames into the database table with the given
+        name and schema as they arrive, one transaction per chunk (see insert),
+        so that only one chunk is held in memory at a time. Composes with
+        extract_chunks and the modules' classify_iter methods, e.g.:
+            db.insert_chunks(
+                module.classify_iter(db.extract_chunks(sql_filepath)),
+                "predictions", "dbo")
+        Each chunk is inserted on its own connection while the extraction's
+        connection is still reading, which SQL Server and PostgreSQL allow.
+        SQLite only allows it in write-ahead log mode, which Database enables
+        for file databases; an in-memory SQLite database cannot use it, so
+        extract from and insert into separate databases there.
+        Precondition: each DataFrame has the same columns as the database table
+        (see insert).
+        :param chunks: an Iterable of DataFrames to insert
+        :param table: the name of the database table to insert to
+        :param schema: the name of the database table to insert to
+        :param bulk: whether to use bulk mode (see insert)
+        :return: the total number of rows inserted
+        """
+        start_time = datetime.now()
+        n_rows = 0
+
+        for df in chunks:
+            if df.shape[0] > 0:
+                self.insert(df, table, schema, bulk=bulk)
+                n_rows += df.shape[0]
+
+        seconds = (datetime.now() - start_time).total_seconds()
+        print(f"Inserted {n_rows} rows into {table} in total in {seconds:.1f}s "
+              f"({n_rows / max(seconds, 1e-6):.0f} rows/s, including the time "
+              f"spent producing the chunks)")
+        return n_rows
+
+    def _to_sql(self, df, table, schema, chunksize, method=None):
+        """
+        Appends the given DataFrame to the given database table with
+        DataFrame.to_sql, in a single transaction that is rolled back if any
+        chunk fails.
+        :param df: the DataFrame to insert
+        :param table: the name of the database table to insert to
+        :param schema: the name of the database table to insert to
+        :param chunksize: the number of rows to insert per statement or
+        executemany call
+        :param method: the to_sql insertion method (None for executemany,
+        "multi" for multi-row VALUES)
+        :return: None
+        """
+        with self.engine.begin() as connection:
+            df.to_sql(table, connection, schema=schema, if_exists="append",
+                      index=False, chunksize=chunksize, method=method)
+
+
+def _use_write_ahead_log(engine):
+    """
+    Puts the given SQLite engine's database in write-ahead log mode whenever a
+    connection is opened. In the default rollback journal mode, a connection
+    that is still reading (e.g.: the generator returned by extract_chunks)
+    keeps other connections from committing writes to the database, which
+    then fail with "database is locked"; in write-ahead log mode, readers and
+    a writer do not block each other. The mode is stored in the database file.
+    In-memory databases ignore it.
+    :param engine: a SQLAlchemy engine connected to a SQLite database
+    :return: None
+    """
+    @event.listens_for(engine, "connect")
+    def connect(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.close()
+
+
+def _make_pool_process_safe(engine):
+    """
+    Makes the given engine's connection pool safe to use after a fork: a
+    connection that was opened in another process is discarded instead of
+    being shared with that process.
+    :param engine: a SQLAlchemy engine
+    :return: None
+    """
+    @event.listens_for(engine, "connect")
+    def connect(dbapi_connection, connection_record):
+        connection_record.info["pid"] = os.getpid()
+
+    @event.listens_for(engine, "checkout")
+    def checkout(dbapi_connection, connection_record, connection_proxy):
+        if connection_record.info["pid"] != os.getpid():
+            connection_record.dbapi_connection = None
+            connection_proxy.dbapi_connection = None
+            raise DisconnectionError(
+                "Connection belongs to another process; reconnecting")
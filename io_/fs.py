@@ -1,3 +1,4 @@
+import json
 import os
 
 
@@ -25,6 +26,33 @@ def write_text(filepath, text):
         file.write(text)
 
 
+def read_json(filepath):
+    """
+    Reads the JSON file at the given file path, returning its deserialized
+    contents.
+    :param filepath: the absolute path to the JSON file to read
+    :return: the deserialized contents of the JSON file
+    """
+    with open(filepath, "r") as file:
+        return json.load(file)
+
+
+def write_json(filepath, obj):
+    """
+    Writes the given object to the JSON file at the given path, overwriting the
+    file if it already exists. The file is replaced atomically, so it is never
+    left half-written.
+    :param filepath: the absolute path to the JSON file to write to
+    :param obj: the JSON-serializable object to write
+    :return: None
+    """
+    os.makedirs(os.path.dirname(filepath), exist_ok=True)
+    temp_filepath = filepath + ".tmp"
+    with open(temp_filepath, "w") as file:
+        json.dump(obj, file)
+    os.replace(temp_filepath, filepath)
+
+
 def write_df(filepath, df):
     """
     Writes the given DataFrame to the CSV file at the given path, overwriting
@@ -1,6 +1,7 @@
 import json
 import os
 import pickle
+from functools import partial
 
 import numpy as np
 import pandas as pd
@@ -12,33 +13,64 @@ from sklearn.linear_model import LogisticRegression
 from sklearn.svm import LinearSVC
 from sklearn.tree import DecisionTreeClassifier
 
+from util.artifact import load_artifact, save_artifact
 from util.classifier import best_classifier, get_confidences
+from util.dedup import factorize, print_dedup
 from util.get_keys import get_keys
+from util.manifest import get_fingerprint, read_manifest, write_manifest
+from util.online import get_online_classifier, start_online, update_online
 from util.preprocessor import preprocess
-from util.vectorizer import vectorize
+from util.result_cache import invalidate
+from util.sharding import classify_sharded
+from util.vectorizer import FeatureCache, get_hashing_vectorizer,\
+    get_n_features, transform, vectorize
 
 
 class Level1MLModule:
-    def __init__(self):
+    def __init__(self, feature_cache=None, online=False):
         """
         Returns a new, untrained Level1MLModule.
+        :param feature_cache: a FeatureCache to share tokenized descriptions
+        with other modules and retrains, or None to use a new FeatureCache for
+        each retrain
+        :param online: whether to train an SGDClassifier on hashing features
+        that update can fold newly labelled rows into, instead of selecting
+        the best classifier
         """
         self.vectorizer = None
         self.classifier = None
         self.scale = None
+        self.feature_cache = feature_cache
+        self.online = online
+        self.online_state = None
+        self.train_size = None
+        # the artifact directory this module's state was loaded from or last
+        # saved to, if it has not changed since (see util.sharding)
+        self.artifact_dirpath = None
+        # the fingerprint of the pickle file this module's state was loaded
+        # from or last saved to, if it has not changed since (see
+        # util.manifest)
+        self.fingerprint = None
 
-    def retrain(self, raw_df):
+    def retrain(self, raw_df, n_jobs=1, strategy="exhaustive"):
         """
         Retrains this Level1MLModule on the given data. Raises a ValueError if
         the given DataFrame is empty.
         - Preprocesses the result_full_descriptions and labels in the given
           DataFrame
-        - Fits the vectorizer to the given result_full_descriptions
+        - Fits the vectorizer to the given result_full_descriptions (unless
+          self.online is True)
         - Selects the best classifier by using a 5-fold cross-validation process
+          (or successive halving over the folds, if strategy is "halving"), or
+          uses an SGDClassifier if self.online is True
         - Trains the selected classifier on the given data
         :param raw_df: a DataFrame containing the raw training data extracted
         from the database
         - required columns: {"result_full_description", "level_1"}
+        :param n_jobs: the number of worker processes to run the
+        cross-validation process with; -1 uses one worker per CPU
+        :param strategy: the model selection strategy, "exhaustive" or
+        "halving" (see util.classifier.best_classifier)
         :return: None
         """
         if raw_df.empty:
@@ -48,24 +80,85 @@ class Level1MLModule:
 
         df = preprocess(raw_df)
 
-        self.vectorizer = self._get_vectorizer(df)
-        self.classifier = best_classifier(
-            df, "level_1", self._get_vectorizer,
-            self._get_candidate_classifiers()
-        )()
+        cache = self.feature_cache
+        if cache is None:
+            cache = FeatureCache()
 
-        X = self.vectorizer.transform(df["result_full_description"])
+        if self.online:
+            self.vectorizer = self._get_vectorizer(df, features="hashing")
+            self.classifier = get_online_classifier()
+        else:
+            self.vectorizer = self._get_vectorizer(df, cache)
+            self.classifier = best_classifier(
+                df, "level_1", partial(self._get_vectorizer, cache=cache),
+                self._get_candidate_classifiers(), n_jobs=n_jobs,
+                strategy=strategy, feature_cache=cache
+            )()
+
+        X = transform(self.vectorizer, df["result_full_description"], cache)
         y = df["level_1"]
 
-        self.classifier.fit(X, y)
+        if self.online:
+            # also measures the baseline accuracy that update compares to
+            self.online_state = start_online(self.classifier, X, y)
+        else:
+            self.classifier.fit(X, y)
+            self.online_state = None
+
         if isinstance(self.classifier, LinearSVC):
             confidences, _ = get_confidences(self.classifier, X, scale=1)
             self.scale = np.max(confidences)
 
+        self.train_size = raw_df.shape[0]
+        self.artifact_dirpath = None
+        self.fingerprint = None
+        invalidate(self)
+
         print("Level1MLModule: Finished retraining")
 
+    def update(self, raw_df):
+        """
+        Folds the given newly labelled data into this Level1MLModule, without
+        retraining it from scratch. Raises a ValueError if this Level1MLModule
+        was not retrained with online=True (modules loaded with
+        load_from_artifact cannot be updated either).
+        - Preprocesses the result_full_descriptions and labels in the given
+          DataFrame
+        - Updates the classifier with one pass of stochastic gradient descent
+          over the given data, in the fixed hashing feature space
+        - Checks whether a full retrain is needed (see
+          util.online.update_online)
+        Save the updated module with save_to_file, passing its artifact
+        directory too if it has one.
+        :param raw_df: a DataFrame containing the newly labelled data
+        - required columns: the columns required by retrain
+        :return: True iff a full retrain is recommended
+        """
+        if self.online_state is None:
+            raise ValueError(
+                "Level1MLModule was not trained for online updates.")
+
+        if raw_df.empty:
+            return False
+
+        df = preprocess(raw_df)
+
+        X = transform(self.vectorizer, df["result_full_description"])
+        y = df["level_1"].values
+
+        needs_retrain = update_online(
+            self.classifier, self.online_state, X, y, "Level1MLModule")
+
+        if self.train_size is not None:
+            self.train_size += raw_df.shape[0]
+        self.artifact_dirpath = None
+        self.fingerprint = None
+        invalidate(self)
+
+        return needs_retrain
+
     @staticmethod
-    def _get_vectorizer(df_train):
+    def _get_vectorizer(df_train, cache=None, features="count"):
         """
         Returns a new, fitted CountVectorizer with parameters optimized for
         predicting level_1.
@@ -75,11 +168,19 @@ class Level1MLModule:
         :param df_train: a DataFrame containing the preprocessed training data
         to fit the vectorizer on
         - required columns: {"result_full_description", "level_1"}
-        :return: a new, fitted CountVectorizer
+        :param cache: a FeatureCache to tokenize the training data with, or
+        None
+        :param features: "count", or "hashing" to return a HashingVectorizer
+        over the same n-grams, without feature selection, instead (see
+        util.vectorizer)
+        :return: a new, fitted CountVectorizer (or HashingVectorizer)
         """
+        if features == "hashing":
+            return get_hashing_vectorizer(ngram_range=(1, 3))
+
         vectorizer = CountVectorizer(ngram_range=(1, 3))
         X_train, _, _ = vectorize(
-            vectorizer, df_train["result_full_description"])
+            vectorizer, df_train["result_full_description"], cache)
         y_train = df_train["level_1"]
 
         selection = SelectKBest(chi2, 200)
@@ -110,7 +211,7 @@ class Level1MLModule:
             LinearSVC
         ]
 
-    def classify(self, raw_df, observations=False):
+    def classify(self, raw_df, observations=False, cache=None, n_jobs=1):
         """
         Classifies the given data. Raises a ValueError if this Level1MLModule
         has not been trained.
@@ -120,6 +221,11 @@ class Level1MLModule:
           observations is True), "result_full_description"}
         :param observations: True if the data is given at the observation level,
         False if the data is given at the test level
+        :param cache: a ResultCache to reuse this module's results from, if
+        some of the rows have already been classified during this run
+        :param n_jobs: the number of worker processes to classify shards of the
+        rows in (see util.sharding.classify_sharded); leave this parameter
+        default to classify the rows in this process
         :return: a DataFrame containing the classification results
         - columns: {"test_key", "result_key", "obs_seq_nbr" (if observations is
           True), "level_1_ml_pred", 'level_1_ml_classifier",
@@ -128,6 +234,42 @@ class Level1MLModule:
         if not self._is_trained():
             raise ValueError("Level1MLModule is not trained.")
 
+        def classify_rows(df):
+            if n_jobs == 1:
+                return self._classify(df, observations)
+            return classify_sharded(self, df, observations, n_jobs)
+
+        if cache is not None:
+            return cache.get(self, raw_df, observations, classify_rows)
+        return classify_rows(raw_df)
+
+    def classify_iter(self, chunks, observations=False):
+        """
+        Classifies the given chunks of data one at a time, like classify,
+        yielding the results of each chunk before reading the next one, so that
+        only one chunk and its results are held in memory at a time. Raises a
+        ValueError if this Level1MLModule has not been trained.
+        :param chunks: an Iterable of DataFrames containing the raw test data
+        (e.g.: the chunks returned by io_.db.Database.extract_chunks)
+        - required columns: the columns required by classify
+        :param observations: True if the data is given at the observation level,
+        False if the data is given at the test level
+        :return: a generator of DataFrames containing the classification
+        results of each chunk
+        - columns: the columns returned by classify
+        """
+        for chunk in chunks:
+            yield self.classify(chunk, observations)
+
+    def _classify(self, raw_df, observations):
+        """
+        Classifies the given data.
+        Precondition: this Level1MLModule has been trained.
+        :param raw_df: a DataFrame containing the raw test data
+        :param observations: True if the data is given at the observation level,
+        False if the data is given at the test level
+        :return: a DataFrame containing the classification results
+        """
         keys = get_keys(observations)
 
         if raw_df.shape[0] == 0:
@@ -140,11 +282,19 @@ class Level1MLModule:
 
         df = preprocess(raw_df)
 
-        X = self.vectorizer.transform(df["result_full_description"])
+        # preprocessing collapses many rows to the same text, and the
+        # features of a row only depend on its text, so each distinct
+        # description is vectorized and classified once
+        codes, first_rows = factorize(df["result_full_description"])
+        print_dedup("Level1MLModule", df.shape[0], len(first_rows),
+                    "descriptions")
+
+        X = self.vectorizer.transform(
+            df["result_full_description"].values[first_rows])
         y_pred = self.classifier.predict(X)
 
         result = df.loc[:, keys]
-        result["level_1_ml_pred"] = y_pred
+        result["level_1_ml_pred"] = y_pred[codes]
 
         result["level_1_ml_classifier"] = json.dumps({
             "type": self.classifier.__class__.__name__,
@@ -153,8 +303,9 @@ class Level1MLModule:
 
         confidence, confidence_type\
             = get_confidences(self.classifier, X, self.scale)
-        result["level_1_ml_confidence"] = confidence
-        result["level_1_ml_confidence_type"] = confidence_type
+        result["level_1_ml_confidence"] = np.asarray(confidence)[codes]
+        result["level_1_ml_confidence_type"]\
+            = np.asarray(confidence_type, dtype=object)[codes]
 
         return result
 
@@ -172,6 +323,7 @@ class Level1MLModule:
         """
         Returns a new Level1MLModule whose internal state is loaded from the
         pickle file at the given path.
+        The training data size is restored from the file's manifest, if any.
         :param filepath: the absolute path to the pickle file to load state from
         :return: a new Level1MLModule, loaded from the pickle file
         """
@@ -182,13 +334,34 @@ class Level1MLModule:
             _self.classifier = pickle.load(file)
             _self.scale = pickle.load(file)
 
+            try:
+                _self.online_state = pickle.load(file)
+            except EOFError:
+                # saved before online updates were supported
+                _self.online_state = None
+
+        _self.online = _self.online_state is not None
+
+        manifest = read_manifest(filepath)
+        if manifest is not None:
+            _self.train_size = manifest["train_size"]
+
+        _self.fingerprint = get_fingerprint(filepath)
+
         return _self
 
-    def save_to_file(self, filepath):
+    def save_to_file(self, filepath, artifact_dirpath=None):
         """
         Saves the state of this Level1MLModule to the pickle file at the given
         path, overwriting the file if it already exists.
+        A manifest describing the saved module is written next to the file
+        (see util.manifest).
+        driver/test.py only loads an artifact directory saved from the current
+        pickle file, so a module that was updated since its artifact was saved
+        should be saved with the artifact's path too, to rewrite the artifact.
         :param filepath: the absolute path to the pickle file to write to
+        :param artifact_dirpath: the absolute path to the artifact directory to
+        rewrite from the saved state (see save_to_artifact), or None
         :return: None
         """
         os.makedirs(os.path.dirname(filepath), exist_ok=True)
@@ -196,3 +369,49 @@ class Level1MLModule:
             pickle.dump(self.vectorizer, file)
             pickle.dump(self.classifier, file)
             pickle.dump(self.scale, file)
+            pickle.dump(self.online_state, file)
+
+        manifest = write_manifest(
+            filepath, self, train_size=self.train_size,
+            classifier=self.classifier.__class__.__name__,
+            vocabulary_size=get_n_features(self.vectorizer))
+        self.fingerprint = manifest["sha256"]
+
+        if artifact_dirpath is not None:
+            self.save_to_artifact(artifact_dirpath)
+
+    @staticmethod
+    def load_from_artifact(dirpath):
+        """
+        Returns a new Level1MLModule loaded from the artifact directory at the
+        given path. The vectorizer's vocabulary and a linear classifier's
+        coefficients are memory-mapped rather than unpickled, so loading is
+        fast and worker processes share them (see util.artifact).
+        :param dirpath: the absolute path to the artifact directory written by
+        save_to_artifact
+        :return: a new Level1MLModule, loaded from the artifact directory
+        """
+        _self = Level1MLModule()
+
+        _self.vectorizer, _self.classifier, attributes\
+            = load_artifact(dirpath)
+        _self.scale = attributes["scale"]
+        _self.train_size = attributes["train_size"]
+        _self.fingerprint = attributes.get("fingerprint")
+        _self.artifact_dirpath = dirpath
+
+        return _self
+
+    def save_to_artifact(self, dirpath):
+        """
+        Saves the state of this Level1MLModule to the artifact directory at the
+        given path, overwriting the files of any existing artifact there.
+        :param dirpath: the absolute path to the artifact directory to write to
+        :return: None
+        """
+        save_artifact(dirpath, self.vectorizer, self.classifier, {
+            "scale": None if self.scale is None else float(self.scale),
+            "train_size": self.train_size,
+            "fingerprint": self.fingerprint
+        })
+        self.artifact_dirpath = dirpath
@@ -2,12 +2,17 @@ import json
 import os
 import pickle
 
+import numpy as np
 import pandas as pd
 
-from util.classifier import load_candidates
+from util.candidates import DECODED, decode_candidates
+from util.dedup import factorize, print_dedup
 from util.get_keys import get_keys
 from util.get_one import get_one
+from util.manifest import read_manifest, write_manifest
 from util.preprocessor import labels_to_lowercase
+from util.result_cache import invalidate
+from util.trie import WordTrie
 
 
 class Level1SymbolicModule:
@@ -19,6 +24,7 @@ class Level1SymbolicModule:
         """
         self.to_module = to_module
         self.dictionary = None
+        self.train_size = None
 
     def retrain(self, raw_df):
         """
@@ -31,6 +37,7 @@ class Level1SymbolicModule:
           each organism into this Level1SymbolicModule's dictionary individually
         - Corrects "influzena' to "influenza" in this Level1SymbolicModule's
           dictionary
+        - Indexes the dictionary in a WordTrie for prefix lookups
         :param raw_df: a DataFrame containing the raw training data extracted
         from the database
         - required columns: {"level_1"}
@@ -43,32 +50,41 @@ class Level1SymbolicModule:
 
         df = labels_to_lowercase(raw_df)
 
-        self.dictionary = set()
+        dictionary = set()
         for raw_label in df["level_1"]:
             labels = raw_label.split(" or ")
-            self.dictionary.update(labels)
+            dictionary.update(labels)
 
-        if "influzena" in self.dictionary:
-            self.dictionary.remove("influzena")
-            self.dictionary.add("influenza")
+        if "influzena" in dictionary:
+            dictionary.remove("influzena")
+            dictionary.add("influenza")
 
-        if "*not found" in self.dictionary:
-            self.dictionary.remove("*not found")
+        if "*not found" in dictionary:
+            dictionary.remove("*not found")
+
+        self.dictionary = WordTrie(dictionary)
+
+        self.train_size = raw_df.shape[0]
+        invalidate(self)
 
         print("Level1SymbolicModule: Finished retraining")
 
-    def classify(self, raw_df, observations=False, return_all=False):
+    def classify(self, raw_df, observations=False, return_all=False,
+                 cache=None):
         """
         Classifies the given data. Raises a ValueError if this
         Level1SymbolicModule has not been trained.
         :param raw_df: a DataFrame containing the raw test data extracted from
         the database
         - required columns: {"test_key", "result_key", "obs_seq_nbr" (if
-          observations is True), "candidates"}
+          observations is True), "candidates" or "candidates_decoded"}
         :param observations: True if the data is given at the observation level,
         False if the data is given at the test level
         :param return_all: True to return all candidate organisms tagged by
         MetaMap, False to return only the most likely candidate organism
+        :param cache: a ResultCache to reuse the results of this module and the
+        modules it refers to from, if some of the rows have already been
+        classified during this run
         :return: a DataFrame containing the classification results
         - columns: {"test_key", "result_key", "obs_seq_nbr" (if observations is
           True), "level_1_symbolic_pred"}
@@ -76,46 +92,113 @@ class Level1SymbolicModule:
         if not self._is_trained():
             raise ValueError("Level1SymbolicModule is not trained.")
 
+        if cache is not None:
+            return cache.get(
+                self, raw_df, observations,
+                lambda df: self._classify(df, observations, return_all, cache),
+                variant=return_all
+            )
+        return self._classify(raw_df, observations, return_all, None)
+
+    def classify_iter(self, chunks, observations=False, return_all=False):
+        """
+        Classifies the given chunks of data one at a time, like classify,
+        yielding the results of each chunk before reading the next one, so that
+        only one chunk and its results are held in memory at a time. The module
+        this Level1SymbolicModule refers to classifies each chunk as it arrives
+        too. Raises a ValueError if this Level1SymbolicModule has not been
+        trained.
+        :param chunks: an Iterable of DataFrames containing the raw test data
+        (e.g.: the chunks returned by io_.db.Database.extract_chunks)
+        - required columns: the columns required by classify
+        :param observations: True if the data is given at the observation level,
+        False if the data is given at the test level
+        :param return_all: True to return all candidate organisms tagged by
+        MetaMap, False to return only the most likely candidate organism
+        :return: a generator of DataFrames containing the classification
+        results of each chunk
+        - columns: the columns returned by classify
+        """
+        for chunk in chunks:
+            yield self.classify(chunk, observations, return_all)
+
+    def _classify(self, raw_df, observations, return_all, cache):
+        """
+        Classifies the given data.
+        Precondition: this Level1SymbolicModule has been trained.
+        :param raw_df: a DataFrame containing the raw test data
+        :param observations: True if the data is given at the observation level,
+        False if the data is given at the test level
+        :param return_all: True to return all candidate organisms tagged by
+        MetaMap, False to return only the most likely candidate organism
+        :param cache: a ResultCache to reuse the results of the modules this
+        Level1SymbolicModule refers to from, or None
+        :return: a DataFrame containing the classification results
+        """
         keys = get_keys(observations)
 
         if self.to_module is None:
             df = raw_df
         else:
-            to_results = self.to_module.classify(raw_df, observations)
+            to_results = self.to_module.classify(
+                raw_df, observations, cache=cache)
             df = pd.merge(raw_df, to_results, how="inner", on=keys)
 
-        df["level_1_symbolic_pred"] = df.apply(
-            lambda row: self._classify_row(row, return_all),
-            axis=1
-        )
+        df = decode_candidates(df)
+        df["level_1_symbolic_pred"] = self._classify_batch(df, return_all)
 
         result = df.loc[:, keys + ["level_1_symbolic_pred"]]
         return result
 
-    def _classify_row(self, row, return_all):
+    def _classify_batch(self, df, return_all):
         """
-        Classifies the given row.
+        Classifies the rows of the given DataFrame. Rows whose test outcome is
+        predicted to be negative are labelled "*not found" all at once; only
+        the remaining rows are looked up in the dictionary, once per distinct
+        set of candidates.
         Precondition: this Level1SymbolicModule has been trained.
-        :param row: the data row to classify
+        :param df: the data to classify
         - required columns: {"test_outcome_pred" (if self.to_module is not
-          None), "candidates"}
+          None), "candidates_decoded"}
         :param return_all: True to return all candidate organisms tagged by
         MetaMap, False to return only the most likely candidate organism
-        :return: the classification (the most likely organism if return_all is
-        False, or a string representation of the List of all candidate organisms
-        tagged by MetaMap)
+        :return: an array whose ith element is the classification of the ith row
         """
+        predictions = np.full(df.shape[0], "*not found", dtype=object)
+
         # check test outcome
-        if self.to_module is not None:
-            if row["test_outcome_pred"] == "negative":
-                return "*not found"
+        if self.to_module is None:
+            rows = np.arange(df.shape[0])
+        else:
+            rows = np.flatnonzero(
+                (df["test_outcome_pred"] != "negative").values)
 
-        # preprocess candidates
-        candidates = load_candidates(row["candidates"])
-        candidates = [candidate.lower() for candidate in candidates]
+        all_candidates = df[DECODED].values[rows]
+        codes, first_rows = factorize(all_candidates)
+        print_dedup("Level1SymbolicModule", len(rows), len(first_rows),
+                    "candidate sets")
 
-        # ----------------------------------------------------------------------
-        # predict
+        unique_predictions = np.array([
+            self._classify_candidates(all_candidates[row].names, return_all)
+            for row in first_rows
+        ], dtype=object)
+        predictions[rows] = unique_predictions[codes]
+
+        return predictions
+
+    def _classify_candidates(self, names, return_all):
+        """
+        Classifies a row whose test outcome is not predicted to be negative.
+        Precondition: this Level1SymbolicModule has been trained.
+        :param names: the lowercase preferred organism names MetaMap tagged in
+        the row
+        :param return_all: True to return all candidate organisms tagged by
+        MetaMap, False to return only the most likely candidate organism
+        :return: the classification (the most likely organism if return_all is
+        False, or a string representation of the List of all candidate organisms
+        tagged by MetaMap)
+        """
+        candidates = list(names)
 
         if return_all:
             return json.dumps(candidates)
@@ -124,11 +207,9 @@ class Level1SymbolicModule:
             return "*not found"
 
         for candidate in candidates:
-            words = candidate.split()
-            for i in range(len(words), 1 - 1, -1):
-                level_1 = " ".join(words[:i])
-                if level_1 in self.dictionary:
-                    return "influzena" if level_1 == "influenza" else level_1
+            level_1 = self.dictionary.longest_prefix(candidate.split())
+            if level_1 is not None:
+                return "influzena" if level_1 == "influenza" else level_1
 
         return get_one(candidates)
 
@@ -144,19 +225,31 @@ class Level1SymbolicModule:
         """
         Loads the dictionary stored in the pickle file at the given path into
         this Level1SymbolicModule, overwriting this Level1SymbolicModule's
-        current dictionary.
+        current dictionary. Dictionaries saved as plain Sets are indexed in a
+        WordTrie.
         :param filepath: the absolute path to the pickle file to load the
         dictionary from
         :return: this Level1SymbolicModule
         """
         with open(filepath, "rb") as file:
             self.dictionary = pickle.load(file)
+
+        if not isinstance(self.dictionary, WordTrie):
+            self.dictionary = WordTrie(self.dictionary)
+
+        manifest = read_manifest(filepath)
+        if manifest is not None:
+            self.train_size = manifest["train_size"]
+
+        invalidate(self)
         return self
 
     def save_to_file(self, filepath):
         """
         Saves this Level1SymbolicModule's dictionary to the pickle file at the
         given path, overwriting the file if it already exists.
+        A manifest describing the saved dictionary is written next to the
+        file (see util.manifest).
         :param filepath: the absolute path to the pickle file to save the
         dictionary to
         :return: None
@@ -164,3 +257,6 @@ class Level1SymbolicModule:
         os.makedirs(os.path.dirname(filepath), exist_ok=True)
         with open(filepath, "wb") as file:
             pickle.dump(self.dictionary, file)
+
+        write_manifest(filepath, self, train_size=self.train_size,
+                       vocabulary_size=len(self.dictionary))
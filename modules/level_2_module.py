@@ -2,12 +2,17 @@ import json
 import os
 import pickle
 
+import numpy as np
 import pandas as pd
 
-from util.classifier import load_candidates
+from util.candidates import DECODED, decode_candidates
+from util.dedup import factorize, print_dedup
 from util.get_keys import get_keys
 from util.get_one import get_one
+from util.manifest import read_manifest, write_manifest
 from util.preprocessor import labels_to_lowercase
+from util.result_cache import invalidate
+from util.trie import WordTrie
 
 
 class Level2Module:
@@ -19,6 +24,7 @@ class Level2Module:
         """
         self.l1_module = l1_module
         self.dictionary = None
+        self.train_size = None
 
     def retrain(self, raw_df):
         """
@@ -27,9 +33,9 @@ class Level2Module:
         - Converts all labels in the given DataFrame to lowercase
         - Populates this Level2Module's dictionary's keys with all level_1
           labels in the given DataFrame, excluding "*not found"
-        - Maps each level_1 label in this Level2Module's dictionary to a List of
-          level_2 labels that have appeared in the given DataFrame along with
-          the level_1 label
+        - Maps each level_1 label in this Level2Module's dictionary to a
+          WordTrie of level_2 labels that have appeared in the given DataFrame
+          along with the level_1 label
         :param raw_df: a DataFrame containing the raw training data extracted
         from the database
         - required columns: {"level_1", "level_2"}
@@ -42,36 +48,48 @@ class Level2Module:
 
         df = labels_to_lowercase(raw_df)
 
-        self.dictionary = {}
+        dictionary = {}
         for index, row in df.iterrows():
             raw_l1_label = row["level_1"]
             l1_labels = raw_l1_label.split(" or ")
 
             l2_label = row["level_2"]
 
-            if raw_l1_label not in self.dictionary:
-                self.dictionary[raw_l1_label] = set()
-            self.dictionary[raw_l1_label].add(l2_label)
+            if raw_l1_label not in dictionary:
+                dictionary[raw_l1_label] = set()
+            dictionary[raw_l1_label].add(l2_label)
 
             for l1_label in l1_labels:
-                if l1_label not in self.dictionary:
-                    self.dictionary[l1_label] = set()
-                self.dictionary[l1_label].add(l2_label)
+                if l1_label not in dictionary:
+                    dictionary[l1_label] = set()
+                dictionary[l1_label].add(l2_label)
+
+        self.dictionary = {
+            l1_label: WordTrie(l2_labels)
+            for l1_label, l2_labels in dictionary.items()
+        }
+
+        self.train_size = raw_df.shape[0]
+        invalidate(self)
 
         print("Level2Module: Finished retraining")
 
-    def classify(self, raw_df, observations=False, return_all=False):
+    def classify(self, raw_df, observations=False, return_all=False,
+                 cache=None):
         """
         Classifies the given data. Raises a ValueError if this Level2Module has
         not been trained.
         :param raw_df: a DataFrame containing the raw test data extracted from
         the database
         - required columns: {"test_key", "result_key", "obs_seq_nbr" (if
-          observations is True), "candidates"}
+          observations is True), "candidates" or "candidates_decoded"}
         :param observations: True if the data is given at the observation level,
         False if the data is given at the test level
         :param return_all: True to return all candidate organisms tagged by
         MetaMap, False to return only the most likely candidate organism
+        :param cache: a ResultCache to reuse the results of this module and the
+        modules it refers to from, if some of the rows have already been
+        classified during this run
         :return: a DataFrame containing the classification results
         - columns: {"test_key", "result_key", "obs_seq_nbr" (if observations is
           True), "level_2_pred"}
@@ -79,9 +97,52 @@ class Level2Module:
         if not self._is_trained():
             raise ValueError("Level2Module is not trained.")
 
+        if cache is not None:
+            return cache.get(
+                self, raw_df, observations,
+                lambda df: self._classify(df, observations, return_all, cache),
+                variant=return_all
+            )
+        return self._classify(raw_df, observations, return_all, None)
+
+    def classify_iter(self, chunks, observations=False, return_all=False):
+        """
+        Classifies the given chunks of data one at a time, like classify,
+        yielding the results of each chunk before reading the next one, so that
+        only one chunk and its results are held in memory at a time. The module
+        this Level2Module refers to classifies each chunk as it arrives too.
+        Raises a ValueError if this Level2Module has not been trained.
+        :param chunks: an Iterable of DataFrames containing the raw test data
+        (e.g.: the chunks returned by io_.db.Database.extract_chunks)
+        - required columns: the columns required by classify
+        :param observations: True if the data is given at the observation level,
+        False if the data is given at the test level
+        :param return_all: True to return all candidate organisms tagged by
+        MetaMap, False to return only the most likely candidate organism
+        :return: a generator of DataFrames containing the classification
+        results of each chunk
+        - columns: the columns returned by classify
+        """
+        for chunk in chunks:
+            yield self.classify(chunk, observations, return_all)
+
+    def _classify(self, raw_df, observations, return_all, cache):
+        """
+        Classifies the given data.
+        Precondition: this Level2Module has been trained.
+        :param raw_df: a DataFrame containing the raw test data
+        :param observations: True if the data is given at the observation level,
+        False if the data is given at the test level
+        :param return_all: True to return all candidate organisms tagged by
+        MetaMap, False to return only the most likely candidate organism
+        :param cache: a ResultCache to reuse the results of the modules this
+        Level2Module refers to from, or None
+        :return: a DataFrame containing the classification results
+        """
         keys = get_keys(observations)
 
-        l1_results = self.l1_module.classify(raw_df, observations)
+        l1_results = self.l1_module.classify(
+            raw_df, observations, cache=cache)
         if "level_1_symbolic_pred" in l1_results:
             l1_results.rename(
                 columns={"level_1_symbolic_pred": "level_1_pred"}, inplace=True)
@@ -90,40 +151,65 @@ class Level2Module:
                 columns={"level_1_ml_pred": "level_1_pred"}, inplace=True)
 
         df = pd.merge(raw_df, l1_results, how="inner", on=keys)
+        df = decode_candidates(df)
 
-        df["level_2_pred"] = df.apply(
-            lambda row: self._classify_row(row, return_all),
-            axis=1
-        )
+        df["level_2_pred"] = self._classify_batch(df, return_all)
 
         result = df.loc[:, keys + ["level_2_pred"]]
         return result
 
-    def _classify_row(self, row, return_all):
+    def _classify_batch(self, df, return_all):
         """
-        Classifies the given row.
+        Classifies the rows of the given DataFrame. Rows whose level_1 is
+        "*not found" or not in the dictionary are labelled all at once; only
+        the remaining rows are looked up in the dictionary, once per distinct
+        pair of level_1 and candidates.
         Precondition: this Level2Module has been trained.
-        :param row: the data row to classify
-        - required columns: {"level_1_pred", "candidates"}
+        :param df: the data to classify
+        - required columns: {"level_1_pred", "candidates_decoded"}
         :param return_all: True to return all candidate organisms tagged by
         MetaMap, False to return only the most likely candidate organism
-        :return: the classification (the most likely organism if return_all is
-        False, or a string representation of the List of all candidate organisms
-        tagged by MetaMap)
+        :return: an array whose ith element is the classification of the ith row
         """
+        level_1s = df["level_1_pred"]
+
         # check level 1
-        level_1 = row["level_1_pred"]
-        if level_1 == "*not found":
-            return "*not found"
-        elif level_1 not in self.dictionary:
-            return "*no further diff"
+        not_found = (level_1s == "*not found").values
+        known = level_1s.isin(list(self.dictionary)).values
+
+        predictions = np.full(df.shape[0], "*no further diff", dtype=object)
+        predictions[not_found] = "*not found"
+
+        rows = np.flatnonzero(known & ~not_found)
+        level_1s = level_1s.values[rows]
+        all_candidates = df[DECODED].values[rows]
+        codes, first_rows = factorize(level_1s, all_candidates)
+        print_dedup("Level2Module", len(rows), len(first_rows),
+                    "(level_1, candidates) pairs")
 
-        # preprocess candidates
-        candidates = load_candidates(row["candidates"])
-        candidates = [candidate.lower() for candidate in candidates]
+        unique_predictions = np.array([
+            self._classify_candidates(
+                level_1s[row], all_candidates[row].names, return_all)
+            for row in first_rows
+        ], dtype=object)
+        predictions[rows] = unique_predictions[codes]
 
-        # ----------------------------------------------------------------------
-        # predict
+        return predictions
+
+    def _classify_candidates(self, level_1, names, return_all):
+        """
+        Classifies a row whose level_1 is in the dictionary.
+        Precondition: this Level2Module has been trained.
+        :param level_1: the row's predicted level_1
+        :param names: the lowercase preferred organism names MetaMap tagged in
+        the row
+        :param return_all: True to return all candidate organisms tagged by
+        MetaMap, False to return only the most likely candidate organism
+        :return: the classification (the most likely organism if return_all is
+        False, or a string representation of the List of all candidate organisms
+        tagged by MetaMap)
+        """
+        candidates = list(names)
 
         if return_all:
             return json.dumps(candidates)
@@ -132,11 +218,9 @@ class Level2Module:
             return "*not further diff"
 
         for candidate in candidates:
-            words = candidate.split()
-            for i in range(len(words), 1 - 1, -1):
-                level_2 = " ".join(words[:i])
-                if level_2 in self.dictionary[level_1]:
-                    return level_2
+            level_2 = self.dictionary[level_1].longest_prefix(candidate.split())
+            if level_2 is not None:
+                return level_2
 
         return get_one(candidates)
 
@@ -152,18 +236,33 @@ class Level2Module:
         """
         Loads the dictionary stored in the pickle file at the given path into
         this Level2Module, overwriting this Level2Module's current dictionary.
+        Level_2 labels saved as plain Sets are indexed in WordTries.
         :param filepath: the absolute path to the pickle file to load the
         dictionary from
         :return: this Level2Module
         """
         with open(filepath, "rb") as file:
             self.dictionary = pickle.load(file)
+
+        self.dictionary = {
+            l1_label: l2_labels if isinstance(l2_labels, WordTrie)
+            else WordTrie(l2_labels)
+            for l1_label, l2_labels in self.dictionary.items()
+        }
+
+        manifest = read_manifest(filepath)
+        if manifest is not None:
+            self.train_size = manifest["train_size"]
+
+        invalidate(self)
         return self
 
     def save_to_file(self, filepath):
         """
         Saves this Level2Module's dictionary to the pickle file at the given
         path, overwriting the file if it already exists.
+        A manifest describing the saved dictionary is written next to the
+        file (see util.manifest).
         :param filepath: the absolute path to the pickle file to save the
         dictionary to
         :return: None
@@ -171,3 +270,6 @@ class Level2Module:
         os.makedirs(os.path.dirname(filepath), exist_ok=True)
         with open(filepath, "wb") as file:
             pickle.dump(self.dictionary, file)
+
+        write_manifest(filepath, self, train_size=self.train_size,
+                       vocabulary_size=len(self.dictionary))
@@ -0,0 +1,26 @@
+-- Creates dbo.scored, which records the rows that driver/test.py has scored
+-- for each task (the sql/test query that returned them), with the key column
+-- types of the lab table.
+IF OBJECT_ID('dbo.scored', 'U') IS NULL
+BEGIN
+    SELECT TOP 0 test_key, result_key,
+        CAST(NULL AS VARCHAR(32)) AS task,
+        CAST(NULL AS VARCHAR(64)) AS model_version,
+        CAST(NULL AS VARBINARY(32)) AS description_hash
+    INTO dbo.scored
+    FROM lab.dim_test_result_output_v1;
+
+    CREATE INDEX ix_scored
+        ON dbo.scored (task, test_key, result_key, model_version);
+END
+-- Adds the task column to a dbo.scored created without it. Its existing rows
+-- have no task, so every task scores them once more.
+ELSE IF COL_LENGTH('dbo.scored', 'task') IS NULL
+BEGIN
+    DROP INDEX ix_scored ON dbo.scored;
+    ALTER TABLE dbo.scored ADD task VARCHAR(32) NULL;
+
+    -- the new column can only be referred to in a separate batch
+    EXEC('CREATE INDEX ix_scored
+        ON dbo.scored (task, test_key, result_key, model_version)');
+END
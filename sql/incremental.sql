@@ -0,0 +1,18 @@
+-- Wraps one of the sql/test queries so that it only returns the rows that have
+-- not been scored for the given task by the given model version since their
+-- result_full_description last changed (see dbo.scored).
+SELECT base.*,
+    HASHBYTES('SHA2_256', base.result_full_description) AS description_hash
+FROM (
+{query}
+) AS base
+WHERE NOT EXISTS (
+    SELECT 1
+    FROM dbo.scored AS S
+    WHERE S.task = :task
+        AND S.test_key = base.test_key
+        AND S.result_key = base.result_key
+        AND S.model_version = :model_version
+        AND S.description_hash
+            = HASHBYTES('SHA2_256', base.result_full_description)
+)
@@ -0,0 +1,2 @@
+SELECT DISTINCT candidates
+FROM dbo.metamap
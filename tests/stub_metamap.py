@@ -0,0 +1,237 @@
+import json
+from unittest import mock
+
+from py4j.protocol import Py4JJavaError, Py4JNetworkError
+
+
+# the organisms the stub MetaMap recognizes: matched text -> (preferred name,
+# CUI, semantic type)
+LEXICON = {
+    "mycobacteria": ("Genus Mycobacterium", "C0026192", "bact"),
+    "influenza": ("Influenza virus", "C0021400", "virs"),
+    "staphylococcus": ("Genus staphylococcus", "C0038170", "bact"),
+    "streptococcus": ("Streptococcus, β-hemolytic", "C0318110", "bact")
+}
+
+
+class StubJavaServer:
+    def __init__(self, batch_positions=True):
+        """
+        Returns a stand-in for the MetaMapBuild.jar JVM, for testing
+        util.metamap_server and util.tagger without Java or MetaMap. Use
+        patch() to make util.metamap_server connect to it instead of a real
+        py4j gateway.
+        :param batch_positions: whether positions are counted from the start
+        of the whole request, rather than from the start of each citation, when
+        several citations are sent in one request
+        """
+        self.batch_positions = batch_positions
+        self.gateways = []
+        self.errors = {}   # maps description substrings to exceptions
+        self.requests = []   # the texts sent to processCitationsFromString
+
+    def patch(self):
+        """
+        Returns a context manager that replaces py4j's JavaGateway in
+        util.metamap_server with this StubJavaServer's gateways.
+        :return: a context manager
+        """
+        return mock.patch("util.metamap_server.JavaGateway",
+                          side_effect=self.connect)
+
+    def connect(self, gateway_parameters=None):
+        """
+        Returns a new StubGateway to this StubJavaServer.
+        :param gateway_parameters: ignored
+        :return: a new StubGateway
+        """
+        gateway = StubGateway(self)
+        self.gateways.append(gateway)
+        return gateway
+
+    def fail(self, substring, message=None):
+        """
+        Makes requests whose text contains the given substring fail, with a
+        Py4JJavaError carrying the given message, or with a Py4JNetworkError if
+        no message is given.
+        :param substring: the substring of the descriptions to fail on
+        :param message: the Java exception message, or None
+        :return: None
+        """
+        if message is None:
+            self.errors[substring] = Py4JNetworkError("Stub network error")
+        else:
+            self.errors[substring] = Py4JJavaError(
+                "Stub Java error", StubJavaException(message))
+
+    def annotate(self, text):
+        """
+        Returns the stub MetaMap results of the given request text, split into
+        citations at blank lines.
+        :param text: the text sent to processCitationsFromString
+        :return: a StubList of Dicts mapping "tags" and "candidates" to JSON
+        strings
+        """
+        self.requests.append(text)
+        for substring, error in self.errors.items():
+            if substring in text:
+                raise error
+
+        results = []
+        offset = 0
+        for citation in text.split("\n\n"):
+            base = offset if self.batch_positions else 0
+            results.append(_annotate_citation(citation, base))
+            offset += len(citation) + 2
+
+        return StubList(results)
+
+
+class StubGateway:
+    def __init__(self, server):
+        """
+        Returns a new stand-in for a py4j JavaGateway connected to the given
+        StubJavaServer.
+        :param server: the StubJavaServer
+        """
+        self.server = server
+        self.alive = True
+        self.jvm = mock.Mock()
+        self.jvm.System.currentTimeMillis.side_effect = self._current_time
+        self.jvm.connect.MetamapMain.side_effect = lambda: StubMetamapMain(self)
+
+    def kill(self):
+        """
+        Simulates the JVM behind this StubGateway going away.
+        :return: None
+        """
+        self.alive = False
+
+    def check(self):
+        """
+        Raises a Py4JNetworkError if the JVM behind this StubGateway is gone.
+        :return: None
+        """
+        if not self.alive:
+            raise Py4JNetworkError("Stub JVM is gone")
+
+    def shutdown(self):
+        self.kill()
+
+    def close(self):
+        pass
+
+    def _current_time(self):
+        self.check()
+        return 0
+
+
+class StubMetamapMain:
+    def __init__(self, gateway):
+        """
+        Returns a new stand-in for a connect.MetamapMain object with a
+        connected MetaMap API session.
+        :param gateway: the StubGateway the object lives behind
+        """
+        self.gateway = gateway
+        self.connected = True
+        self.api = StubApi(self)
+
+    def getApi(self):
+        self.gateway.check()
+        return self.api
+
+    def isConnectAPI(self):
+        self.gateway.check()
+        return "true" if self.connected else "false"
+
+    def formatOneResultToString(self, result, output_type):
+        self.gateway.check()
+        return result[output_type]
+
+
+class StubApi:
+    def __init__(self, metamap):
+        """
+        Returns a new stand-in for a MetaMapApi session.
+        :param metamap: the StubMetamapMain holding the session
+        """
+        self.metamap = metamap
+        self.options = None
+
+    def setOptions(self, options):
+        self.metamap.gateway.check()
+        self.options = options
+
+    def disconnect(self):
+        self.metamap.gateway.check()
+        self.metamap.connected = False
+
+    def processCitationsFromString(self, text):
+        self.metamap.gateway.check()
+        return self.metamap.gateway.server.annotate(text)
+
+
+class StubJavaException:
+    def __init__(self, message):
+        """
+        Returns a new stand-in for the Java exception of a Py4JJavaError.
+        :param message: the exception message
+        """
+        self.message = message
+        self._target_id = "o0"
+
+    def getMessage(self):
+        return self.message
+
+
+class StubList:
+    def __init__(self, items):
+        """
+        Returns a new stand-in for a java.util.List.
+        :param items: the List's elements
+        """
+        self.items = items
+
+    def size(self):
+        return len(self.items)
+
+    def get(self, index):
+        return self.items[index]
+
+
+def _annotate_citation(citation, base):
+    """
+    Returns the stub MetaMap annotations of the given citation: every
+    occurrence of a LEXICON word is tagged, with its position counted from the
+    given base. The JSON is written with spaces and unescaped non-ASCII
+    characters, unlike compact json.dumps output, so that tests notice if the
+    strings are reformatted.
+    :param citation: the citation text
+    :param base: the position of the citation's first character
+    :return: a Dict mapping "tags" and "candidates" to JSON strings
+    """
+    tags = {}
+    candidates = {}
+
+    lowercase = citation.lower()
+    for word, (name, cui, semantic_type) in LEXICON.items():
+        start = lowercase.find(word)
+        if start < 0:
+            continue
+
+        tags[word] = {
+            "CUI": cui,
+            "semanticTypes": [semantic_type],
+            "position": [{"x": base + start, "y": len(word)}]
+        }
+        candidates[name] = {
+            "CUI": cui,
+            "matched": [word],
+            "position": [base + start]
+        }
+
+    return {
+        "tags": json.dumps(tags, ensure_ascii=False),
+        "candidates": json.dumps(candidates, ensure_ascii=False)
+    }
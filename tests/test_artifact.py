@@ -0,0 +1,65 @@
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+from sklearn.feature_extraction.text import CountVectorizer
+from sklearn.linear_model import LogisticRegression
+
+from util.artifact import load_artifact, save_artifact
+from util.vectorizer import MappedVectorizer
+
+
+DOCUMENTS = [
+    "culture _NUMBER_ | mycobacteria isolated",
+    "no growth | no growth",
+    "influenza a detected",
+    "",
+    "averyveryverylongwordthatisnotinthevocabulary growth"
+]
+LABELS = ["positive", "negative", "positive", "negative", "negative"]
+
+
+class MappedVectorizerTest(unittest.TestCase):
+    def assert_same_transform(self, vectorizer, mapped, documents):
+        expected = vectorizer.transform(documents)
+        actual = mapped.transform(documents)
+
+        self.assertEqual(actual.shape, expected.shape)
+        self.assertEqual(actual.dtype, expected.dtype)
+        self.assertEqual((actual != expected).nnz, 0)
+
+    def test_fitted_vocabulary(self):
+        vectorizer = CountVectorizer(ngram_range=(1, 2)).fit(DOCUMENTS)
+        mapped = MappedVectorizer.from_count_vectorizer(vectorizer)
+
+        self.assert_same_transform(vectorizer, mapped, DOCUMENTS)
+        self.assertEqual(mapped.get_feature_names(),
+                         vectorizer.get_feature_names())
+
+    def test_unsorted_fixed_vocabulary(self):
+        vectorizer = CountVectorizer(
+            vocabulary=["no", "growth", "influenza a", "a"],
+            ngram_range=(1, 2), binary=True)
+        mapped = MappedVectorizer.from_count_vectorizer(vectorizer)
+
+        self.assert_same_transform(vectorizer, mapped, DOCUMENTS)
+
+    def test_artifact_vocabulary_is_memory_mapped(self):
+        dirpath = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, dirpath)
+
+        vectorizer = CountVectorizer().fit(DOCUMENTS)
+        classifier = LogisticRegression().fit(
+            vectorizer.transform(DOCUMENTS), LABELS)
+        save_artifact(dirpath, vectorizer, classifier, {})
+
+        mapped, _, _ = load_artifact(dirpath)
+
+        self.assertIsInstance(mapped, MappedVectorizer)
+        self.assertIsInstance(mapped.terms, np.memmap)
+        self.assert_same_transform(vectorizer, mapped, DOCUMENTS)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,32 @@
+import json
+import unittest
+from unittest import mock
+
+from util.candidates import decode, load_matchings
+from util.classifier import load_candidates
+
+
+CANDIDATES = json.dumps({
+    "Genus Mycobacterium": {"matched": ["Mycobacteria"]},
+    "Bacteria": {"matched": ["bacteria", "Mycobacterium TB"]}
+})
+
+
+class DecodeTest(unittest.TestCase):
+    def test_json_is_parsed_once(self):
+        with mock.patch("util.candidates.json.loads",
+                        wraps=json.loads) as loads:
+            candidates = decode(CANDIDATES)
+
+        loads.assert_called_once_with(CANDIDATES)
+        self.assertEqual(
+            candidates.names,
+            tuple(name.lower() for name in load_candidates(CANDIDATES)))
+        self.assertEqual(candidates.matchings,
+                         tuple(load_matchings(CANDIDATES)))
+        self.assertEqual(candidates.matchings,
+                         ("mycobacterium tb", "mycobacteria", "bacteria"))
+
+
+if __name__ == "__main__":
+    unittest.main()
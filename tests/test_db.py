@@ -0,0 +1,140 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+import pandas as pd
+import sqlalchemy
+from sqlalchemy.exc import CompileError, IntegrityError, OperationalError
+
+from io_.db import BULK_CHUNKSIZE, Database
+
+
+class InsertTest(unittest.TestCase):
+    def setUp(self):
+        dirpath = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, dirpath)
+
+        self.db = Database(url="sqlite:///"
+                               + os.path.join(dirpath, "test.db"))
+        self.addCleanup(self.db.engine.dispose)
+
+        with self.db.engine.begin() as connection:
+            connection.execute(sqlalchemy.text(
+                "CREATE TABLE predictions (test_key INTEGER PRIMARY KEY, "
+                "pred TEXT NOT NULL)"))
+
+    def make_df(self, n_rows):
+        return pd.DataFrame({
+            "test_key": range(n_rows),
+            "pred": [f"pred {i}" for i in range(n_rows)]
+        })
+
+    def read(self):
+        return self.db.query("SELECT * FROM predictions ORDER BY test_key")
+
+    def test_executemany_path(self):
+        df = self.make_df(2500)
+
+        with mock.patch.object(self.db, "_to_sql",
+                               wraps=self.db._to_sql) as to_sql:
+            self.db.insert(df, "predictions", "main")
+
+        to_sql.assert_called_once_with(
+            df, "predictions", "main", chunksize=BULK_CHUNKSIZE)
+        pd.testing.assert_frame_equal(self.read(), df)
+
+    def test_multi_row_values_path(self):
+        # a generic engine: a dialect whose driver does not batch executemany
+        df = self.make_df(2500)
+
+        with mock.patch("io_.db.EXECUTEMANY_DIALECTS", set()),\
+                mock.patch.object(self.db, "_to_sql",
+                                  wraps=self.db._to_sql) as to_sql:
+            self.db.insert(df, "predictions", "main")
+
+        # SQLite allows 999 parameters per statement, so 499 rows of 2
+        to_sql.assert_called_once_with(
+            df, "predictions", "main", chunksize=499, method="multi")
+        pd.testing.assert_frame_equal(self.read(), df)
+
+    def test_unsupported_multi_row_values_fall_back(self):
+        df = self.make_df(2500)
+        to_sql = self.db._to_sql
+
+        def reject_multi(df, table, schema, chunksize, method=None):
+            if method == "multi":
+                raise CompileError("multi-row VALUES are not supported")
+            return to_sql(df, table, schema, chunksize, method)
+
+        with mock.patch("io_.db.EXECUTEMANY_DIALECTS", set()),\
+                mock.patch.object(self.db, "_to_sql",
+                                  side_effect=reject_multi) as patched:
+            self.db.insert(df, "predictions", "main")
+
+        self.assertEqual(patched.call_count, 2)
+        self.assertEqual(patched.call_args, mock.call(
+            df, "predictions", "main", chunksize=1000))
+        pd.testing.assert_frame_equal(self.read(), df)
+
+    def test_operational_errors_do_not_fall_back(self):
+        df = self.make_df(10)
+        error = OperationalError("INSERT", {}, Exception("database is locked"))
+
+        with mock.patch("io_.db.EXECUTEMANY_DIALECTS", set()),\
+                mock.patch.object(self.db, "_to_sql",
+                                  side_effect=error) as to_sql:
+            with self.assertRaises(OperationalError):
+                self.db.insert(df, "predictions", "main")
+
+        to_sql.assert_called_once()
+
+    def test_failed_insert_is_rolled_back(self):
+        # the duplicate key is in the third chunk of every path
+        df = self.make_df(25000)
+        df.loc[24000, "test_key"] = 0
+
+        for executemany_dialects, bulk in [({"sqlite"}, True), (set(), True),
+                                           ({"sqlite"}, False)]:
+            with mock.patch("io_.db.EXECUTEMANY_DIALECTS",
+                            executemany_dialects):
+                with self.assertRaises(IntegrityError):
+                    self.db.insert(df, "predictions", "main", bulk=bulk)
+
+            self.assertEqual(self.read().shape[0], 0)
+
+
+class InsertChunksTest(unittest.TestCase):
+    def setUp(self):
+        self.dirpath = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dirpath)
+
+        self.db = Database(url="sqlite:///"
+                               + os.path.join(self.dirpath, "test.db"))
+        self.addCleanup(self.db.engine.dispose)
+
+        self.df = pd.DataFrame({
+            "test_key": range(1000),
+            "pred": [f"pred {i}" for i in range(1000)]
+        })
+        self.df.to_sql("source", self.db.engine, index=False)
+        self.df.head(0).to_sql("predictions", self.db.engine, index=False)
+
+    def test_stream_within_one_database(self):
+        sql_filepath = os.path.join(self.dirpath, "source.sql")
+        with open(sql_filepath, "w") as file:
+            file.write("SELECT * FROM source ORDER BY test_key")
+
+        n_rows = self.db.insert_chunks(
+            self.db.extract_chunks(sql_filepath, chunksize=37),
+            "predictions", "main")
+
+        self.assertEqual(n_rows, 1000)
+        pd.testing.assert_frame_equal(
+            self.db.query("SELECT * FROM predictions ORDER BY test_key"),
+            self.df)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,36 @@
+import unittest
+
+import numpy as np
+
+from util.dedup import factorize
+
+
+class FactorizeTest(unittest.TestCase):
+    def assert_factorized(self, columns, expected_codes, expected_first_rows):
+        codes, first_rows = factorize(*columns)
+
+        np.testing.assert_array_equal(codes, expected_codes)
+        np.testing.assert_array_equal(first_rows, expected_first_rows)
+        # every row maps back to the first row with the same values
+        for column in columns:
+            column = np.asarray(column, dtype=object)
+            for row, code in enumerate(codes):
+                self.assertIs(column[first_rows[code]], column[row])
+
+    def test_one_column(self):
+        self.assert_factorized([["b", "a", "b", "c", "a"]],
+                               [0, 1, 0, 2, 1], [0, 1, 3])
+
+    def test_missing_values(self):
+        self.assert_factorized([["a", None, "b", "a", None]],
+                               [0, 1, 2, 0, 1], [0, 1, 2])
+
+    def test_several_columns(self):
+        self.assert_factorized(
+            [["x", "x", "y", "x", None, None],
+             ["a", None, "a", "a", None, "a"]],
+            [0, 1, 2, 0, 3, 4], [0, 1, 2, 4, 5])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,289 @@
+import hashlib
+import multiprocessing
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+import pandas as pd
+import sqlalchemy
+from sklearn.feature_extraction.text import CountVectorizer
+from sklearn.linear_model import LogisticRegression
+from sqlalchemy import event
+
+from driver import test as driver
+from io_.db import Database
+from modules.test_performed_module import TestPerformedModule
+from util.get_keys import get_keys
+
+
+KEYS = get_keys(observations=False)
+
+
+class StubMLModule:
+    def __init__(self, column):
+        """
+        Returns a stand-in for a trained machine learning module, predicting
+        the uppercase description in the given column.
+        :param column: the name of the prediction column
+        """
+        self.column = column
+
+    def classify(self, raw_df, observations=False, cache=None, n_jobs=1):
+        if cache is not None:
+            return cache.get(self, raw_df, observations, self._classify)
+        return self._classify(raw_df)
+
+    def _classify(self, raw_df):
+        result = raw_df.loc[:, KEYS]
+        result[self.column] = raw_df["result_full_description"].str.upper()
+        return result
+
+
+class StubSymbolicModule:
+    def __init__(self, column, upstream, upstream_attribute):
+        """
+        Returns a stand-in for a Level1SymbolicModule or Level2Module, whose
+        predictions are derived from the results of the module it refers to.
+        :param column: the name of the prediction column
+        :param upstream: the StubMLModule this module refers to
+        :param upstream_attribute: the name of the attribute holding upstream
+        ("to_module" or "l1_module")
+        """
+        self.column = column
+        self.upstream = upstream
+        setattr(self, upstream_attribute, upstream)
+
+    def classify(self, raw_df, observations=False, return_all=False,
+                 cache=None):
+        upstream = pd.merge(raw_df.loc[:, KEYS],
+                            self.upstream.classify(raw_df, cache=cache),
+                            how="inner", on=KEYS)
+
+        column = self.column + ("_all" if return_all else "")
+        result = upstream.loc[:, KEYS]
+        result[column] = upstream[self.upstream.column] + " -> " + column
+        return result
+
+
+def make_modules():
+    to = StubMLModule("test_outcome_pred")
+    l1ml = StubMLModule("level_1_ml_pred")
+    return {
+        "tp": StubMLModule("test_performed_pred"),
+        "to": to,
+        "l1ml": l1ml,
+        "l1s": StubSymbolicModule("level_1_symbolic_pred", to, "to_module"),
+        "l2": StubSymbolicModule("level_2_pred", l1ml, "l1_module"),
+        "tp_org_false": StubMLModule("test_performed_org_false_pred"),
+        "to_org_false": StubMLModule("test_outcome_org_false_pred")
+    }
+
+
+def make_df(start, stop):
+    return pd.DataFrame({
+        "test_key": [i // 2 for i in range(start, stop)],
+        "result_key": list(range(start, stop)),
+        "result_full_description": [f"description {i}"
+                                    for i in range(start, stop)]
+    })
+
+
+class ClassifyParallelTest(unittest.TestCase):
+    @unittest.skipUnless(multiprocessing.get_start_method() == "fork",
+                         "worker processes must inherit the stub modules")
+    def test_same_results_as_classify(self):
+        # overlapping DataFrames, as returned by the test queries
+        dfs = [make_df(0, 40), make_df(10, 50), make_df(30, 70),
+               make_df(60, 90)]
+        modules = make_modules()
+
+        expected = driver.classify(modules, *dfs)
+
+        # the Pipeline's worker processes inherit the loaded modules
+        with mock.patch.dict(driver._loaded_modules, modules):
+            actual = driver.classify_parallel(*dfs, max_workers=2)
+
+        for actual_results, expected_results in zip(actual, expected):
+            pd.testing.assert_frame_equal(actual_results, expected_results)
+
+
+class IncrementalTest(unittest.TestCase):
+    def setUp(self):
+        dirpath = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, dirpath)
+
+        self.db = Database(url="sqlite:///" + os.path.join(dirpath, "test.db"))
+        self.addCleanup(self.db.engine.dispose)
+
+        # a SQLite stand-in for the dbo schema and T-SQL's HASHBYTES
+        dbo_filepath = os.path.join(dirpath, "dbo.db")
+
+        @event.listens_for(self.db.engine, "connect")
+        def connect(dbapi_connection, connection_record):
+            dbapi_connection.execute(
+                "ATTACH DATABASE ? AS dbo", (dbo_filepath,))
+            dbapi_connection.create_function(
+                "HASHBYTES", 2,
+                lambda algorithm, text: hashlib.sha256(text.encode()).digest())
+
+        with self.db.engine.begin() as connection:
+            connection.execute(sqlalchemy.text(
+                "CREATE TABLE results (test_key INTEGER, result_key INTEGER, "
+                "result_full_description TEXT, task TEXT)"))
+            connection.execute(sqlalchemy.text(
+                "CREATE TABLE dbo.scored (test_key INTEGER, "
+                "result_key INTEGER, task TEXT, model_version TEXT, "
+                "description_hash BLOB)"))
+
+        # each test query returns the rows whose label for its task is missing
+        test_sql = []
+        for task in driver.TASKS:
+            sql_filepath = os.path.join(dirpath, task + ".sql")
+            with open(sql_filepath, "w") as file:
+                file.write("SELECT test_key, result_key, "
+                           "result_full_description FROM results "
+                           f"WHERE task = '{task}'")
+            test_sql.append(sql_filepath)
+
+        # the driver's paths are Windows paths
+        incremental_sql = os.path.join(
+            os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+            "sql", "incremental.sql")
+
+        for name, value in [("TEST_SQL", test_sql),
+                            ("INCREMENTAL_SQL", incremental_sql)]:
+            patcher = mock.patch.object(driver, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def add_rows(self, task, result_keys, description="culture"):
+        pd.DataFrame({
+            "test_key": [key // 2 for key in result_keys],
+            "result_key": result_keys,
+            "result_full_description": description,
+            "task": task
+        }).to_sql("results", self.db.engine, if_exists="append", index=False)
+
+    def score(self, model_version):
+        """
+        Loads the rows the given model version has not scored, and records
+        them as scored, like driver/test.py in incremental mode.
+        :return: the result_keys of each loaded DataFrame
+        """
+        dfs = driver.load_dataframes(
+            self.db, decode=False, model_version=model_version)
+        self.db.insert(driver.get_scored(model_version, dfs), "scored", "dbo")
+        return [sorted(df["result_key"]) for df in dfs]
+
+    def test_rows_are_scored_once_per_task(self):
+        self.add_rows("test_performed", [0, 1, 2])
+        self.add_rows("test_outcome", [0, 1])
+
+        self.assertEqual(self.score("v1"), [[0, 1, 2], [0, 1], [], []])
+        self.assertEqual(self.score("v1"), [[], [], [], []])
+
+        # rows already scored for another task are still scored for theirs
+        self.add_rows("level_1", [0, 2])
+        self.add_rows("test_outcome", [2])
+        self.assertEqual(self.score("v1"), [[], [2], [0, 2], []])
+
+    def test_new_model_version_or_description_rescores(self):
+        self.add_rows("level_2", [0, 1])
+        self.score("v1")
+
+        self.assertEqual(self.score("v2"), [[], [], [], [0, 1]])
+
+        self.add_rows("level_2", [5], description="no growth")
+        with self.db.engine.begin() as connection:
+            connection.execute(sqlalchemy.text(
+                "UPDATE results SET result_full_description = 'changed' "
+                "WHERE result_key = 1"))
+        self.assertEqual(self.score("v2"), [[], [], [], [1, 5]])
+
+    def test_scored_rows(self):
+        dfs = [
+            pd.DataFrame({"test_key": [0, 0, 0], "result_key": [0, 1, 1],
+                          "description_hash": [b"a", b"b", b"b"]}),
+            pd.DataFrame({"test_key": [0], "result_key": [0],
+                          "description_hash": [b"a"]}),
+            pd.DataFrame(columns=["test_key", "result_key",
+                                  "description_hash"]),
+            pd.DataFrame({"test_key": [1], "result_key": [2],
+                          "description_hash": [b"c"]})
+        ]
+
+        scored = driver.get_scored("v1", dfs)
+
+        self.assertEqual(list(scored.columns), [
+            "test_key", "result_key", "task", "model_version",
+            "description_hash"])
+        self.assertEqual(
+            list(scored.itertuples(index=False, name=None)), [
+                (0, 0, "test_performed", "v1", b"a"),
+                (0, 1, "test_performed", "v1", b"b"),
+                (0, 0, "test_outcome", "v1", b"a"),
+                (1, 2, "level_2", "v1", b"c")
+            ])
+
+
+class LoadMLModuleTest(unittest.TestCase):
+    DOCUMENTS = ["culture _NUMBER_ | no growth", "not performed",
+                 "influenza a detected", "specimen not received"]
+    LABELS = ["performed", "not performed", "performed", "not performed"]
+
+    def setUp(self):
+        dirpath = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, dirpath)
+
+        self.filepath = os.path.join(dirpath, "test_performed_module.pkl")
+        self.dirpath = os.path.join(dirpath, "test_performed_module")
+
+        patcher = mock.patch.dict(driver.MODULE_ARTIFACTS, {"tp": self.dirpath})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.module = TestPerformedModule()
+        self.module.vectorizer = CountVectorizer().fit(self.DOCUMENTS)
+        self.module.classifier = LogisticRegression().fit(
+            self.module.vectorizer.transform(self.DOCUMENTS), self.LABELS)
+
+    def load(self):
+        return driver._load_ml_module(TestPerformedModule, "tp", self.filepath)
+
+    def test_artifact_saved_from_pickle_is_loaded(self):
+        self.module.save_to_file(self.filepath)
+        self.module.save_to_artifact(self.dirpath)
+
+        module = self.load()
+
+        self.assertEqual(module.artifact_dirpath, self.dirpath)
+        self.assertEqual(module.fingerprint, driver.get_fingerprint(
+            self.filepath))
+
+    def test_pickle_saved_after_artifact_is_loaded(self):
+        self.module.save_to_file(self.filepath)
+        self.module.save_to_artifact(self.dirpath)
+
+        # e.g.: the module was retrained or updated
+        self.module.classifier = LogisticRegression(C=0.5).fit(
+            self.module.vectorizer.transform(self.DOCUMENTS), self.LABELS)
+        self.module.save_to_file(self.filepath)
+
+        module = self.load()
+
+        self.assertIsNone(module.artifact_dirpath)
+        self.assertEqual(module.classifier.C, 0.5)
+        self.assertEqual(module.fingerprint, driver.get_fingerprint(
+            self.filepath))
+
+    def test_artifact_not_saved_from_a_pickle_is_ignored(self):
+        self.module.save_to_artifact(self.dirpath)
+        self.module.save_to_file(self.filepath)
+
+        self.assertIsNone(self.load().artifact_dirpath)
+
+
+if __name__ == "__main__":
+    unittest.main()
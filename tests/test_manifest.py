@@ -0,0 +1,36 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from util.manifest import get_fingerprint, hash_file, write_manifest
+
+
+class FingerprintTest(unittest.TestCase):
+    def setUp(self):
+        dirpath = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, dirpath)
+        self.filepath = os.path.join(dirpath, "module.pkl")
+
+    def write(self, content, mtime_ns):
+        with open(self.filepath, "wb") as file:
+            file.write(content)
+        os.utime(self.filepath, ns=(mtime_ns, mtime_ns))
+
+    def test_fingerprint_is_taken_from_manifest(self):
+        self.write(b"model 1", 10 ** 18)
+        manifest = write_manifest(self.filepath, self)
+
+        self.assertEqual(get_fingerprint(self.filepath), manifest["sha256"])
+
+    def test_replaced_file_of_same_size_is_rehashed(self):
+        self.write(b"model 1", 10 ** 18)
+        write_manifest(self.filepath, self)
+        self.write(b"model 2", 10 ** 18 + 1)
+
+        self.assertEqual(get_fingerprint(self.filepath),
+                         hash_file(self.filepath))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,127 @@
+import unittest
+from unittest import mock
+
+from tests.stub_metamap import StubJavaServer
+from util.metamap_server import MetaMapServer
+
+
+class MetaMapServerTest(unittest.TestCase):
+    def setUp(self):
+        self.java = StubJavaServer()
+        patcher = self.java.patch()
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.server = MetaMapServer(pool_size=2, spawn=False)
+        self.server.start()
+        self.addCleanup(self.server.close)
+
+    def test_start_opens_pool(self):
+        self.assertEqual(len(self.java.gateways), 1)
+        self.assertEqual(len(self.server._all_connections), 2)
+
+        for connection in self.server._all_connections:
+            self.assertIs(connection.gateway, self.java.gateways[0])
+            self.assertTrue(connection.is_healthy())
+
+    def test_unhealthy_connection_is_reopened(self):
+        with self.server.connection() as connection:
+            connection.set_options("-y")
+            connection.metamap.connected = False
+            dead_metamap = connection.metamap
+
+        # the connection went back to the end of the queue
+        with self.server.connection():
+            pass
+
+        with self.server.connection() as connection:
+            self.assertIsNot(connection.metamap, dead_metamap)
+            self.assertTrue(connection.is_healthy())
+            self.assertEqual(connection.api.options, "-y -c")
+
+        # the JVM was still reachable, so it was not reconnected to
+        self.assertEqual(len(self.java.gateways), 1)
+
+    def test_dead_jvm_is_reconnected(self):
+        self.java.gateways[0].kill()
+
+        with self.server.connection() as connection:
+            self.assertTrue(connection.is_healthy())
+            self.assertIs(connection.gateway, self.java.gateways[1])
+
+        with self.server.connection() as connection:
+            self.assertIs(connection.gateway, self.java.gateways[1])
+
+        self.assertEqual(len(self.java.gateways), 2)
+
+    def test_no_jvm_without_spawn(self):
+        dead_gateway = self.java.connect()
+        dead_gateway.kill()
+
+        server = MetaMapServer(spawn=False)
+        with mock.patch("util.metamap_server.JavaGateway",
+                        return_value=dead_gateway):
+            with self.assertRaises(Exception):
+                server.start()
+
+
+class ProcessBatchTest(unittest.TestCase):
+    DESCRIPTIONS = [
+        "AFB culture: mycobacteria isolated",
+        "no growth",
+        "Influenza A detected; staphylococcus aureus",
+        "",
+        "swab\n\nmycobacteria",
+        "influenza b not detected",
+        "Streptococcus isolated"
+    ]
+
+    def annotate(self, descriptions, batch_positions):
+        """
+        Annotates the given descriptions in one batch and one at a time with a
+        stub MetaMap that counts positions in the given way.
+        :return: the batched annotations; the one-at-a-time annotations; the
+        number of requests sent for the batch
+        """
+        java = StubJavaServer(batch_positions=batch_positions)
+        with java.patch(), MetaMapServer(spawn=False) as server:
+            with server.connection() as connection:
+                batched = connection.process_batch(descriptions)
+                n_requests = len(java.requests)
+                single = [connection.process(description)
+                          for description in descriptions]
+
+        return batched, single, n_requests
+
+    def test_batch_positions_are_rebased(self):
+        batched, single, n_requests = self.annotate(
+            self.DESCRIPTIONS, batch_positions=True)
+
+        # the rebased strings keep MetaMap's formatting
+        self.assertEqual(batched, single)
+        self.assertIn('"position": [', batched[6][1])
+        self.assertIn("β-hemolytic", batched[6][1])
+        # one batch, plus the blank description and the one with a blank line
+        self.assertEqual(n_requests, 3)
+
+    def test_citation_positions_are_kept(self):
+        batched, single, n_requests = self.annotate(
+            self.DESCRIPTIONS, batch_positions=False)
+
+        self.assertEqual(batched, single)
+        self.assertEqual(n_requests, 3)
+
+    def test_ambiguous_positions_are_processed_alone(self):
+        # "influenza" starts at 5 in the second description, and at 9 in the
+        # request, which is also inside the second description
+        descriptions = ["ab", "xxxx influenza"]
+
+        batched, single, n_requests = self.annotate(
+            descriptions, batch_positions=True)
+
+        self.assertEqual(batched, single)
+        self.assertEqual(n_requests, 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
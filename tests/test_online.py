@@ -0,0 +1,120 @@
+import os
+import random
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy as np
+import pandas as pd
+
+from modules.level_1_ml_module import Level1MLModule
+from modules.test_outcome_module import TestOutcomeModule
+from modules.test_performed_module import TestPerformedModule
+from util.artifact import read_attributes
+
+# the label column and the two labels of each module
+MODULES = [
+    (TestPerformedModule, "test_performed", ["PERFORMED", "NOT PERFORMED"]),
+    (TestOutcomeModule, "test_outcome", ["positive", "negative"]),
+    (Level1MLModule, "level_1", ["influenza", "*not found"])
+]
+
+WORDS = [["detected", "positive", "isolated", "growth"],
+         ["not", "performed", "cancelled", "received"]]
+NEW_WORDS = [["alpha", "beta", "gamma", "delta"],
+             ["zeta", "theta", "iota", "kappa"]]
+
+
+def make_df(n_rows, column, labels, words=WORDS, seed=0):
+    """
+    Returns labelled rows whose descriptions are made of the words of their
+    label.
+    """
+    rng = random.Random(seed)
+    return pd.DataFrame({
+        "test_key": range(n_rows),
+        "result_key": range(n_rows),
+        "result_full_description": [" ".join(rng.choices(words[i % 2], k=4))
+                                    for i in range(n_rows)],
+        "candidates": "{}",
+        column: [labels[i % 2] for i in range(n_rows)]
+    })
+
+
+class UpdateTest(unittest.TestCase):
+    def setUp(self):
+        self.dirpath = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dirpath)
+
+    def retrain(self, module_class, column, labels):
+        module = module_class(online=True)
+        module.retrain(make_df(40, column, labels))
+        return module
+
+    def test_online_state_round_trips(self):
+        for module_class, column, labels in MODULES:
+            with self.subTest(module_class.__name__):
+                module = self.retrain(module_class, column, labels)
+                self.assertFalse(
+                    module.update(make_df(10, column, labels, seed=1)))
+
+                filepath = os.path.join(self.dirpath, column + ".pkl")
+                module.save_to_file(filepath)
+                loaded = module_class.load_from_file(filepath)
+
+                self.assertTrue(loaded.online)
+                self.assertEqual(loaded.online_state, module.online_state)
+                np.testing.assert_array_equal(loaded.classifier.coef_,
+                                              module.classifier.coef_)
+
+                # the loaded module goes on updating like the saved one
+                df = make_df(10, column, labels, seed=2)
+                self.assertEqual(loaded.update(df), module.update(df))
+                np.testing.assert_array_equal(loaded.classifier.coef_,
+                                              module.classifier.coef_)
+
+    @mock.patch("util.online.DRIFT_THRESHOLD", 1.0)
+    @mock.patch("util.online.FEATURE_GROWTH_THRESHOLD", 1.0)
+    def test_unseen_labels_recommend_retrain(self):
+        for module_class, column, labels in MODULES:
+            with self.subTest(module_class.__name__):
+                module = self.retrain(module_class, column, labels)
+
+                self.assertFalse(
+                    module.update(make_df(10, column, labels, seed=1)))
+                self.assertTrue(module.update(
+                    make_df(10, column, [labels[0], "unseen"], seed=2)))
+                # the rows with the unseen label are left out
+                self.assertEqual(len(module.classifier.classes_), 2)
+
+    @mock.patch("util.online.DRIFT_THRESHOLD", 1.0)
+    def test_feature_growth_recommends_retrain(self):
+        for module_class, column, labels in MODULES:
+            with self.subTest(module_class.__name__):
+                module = self.retrain(module_class, column, labels)
+                df = make_df(10, column, labels, words=NEW_WORDS, seed=1)
+
+                self.assertTrue(module.update(df))
+                self.assertGreater(module.online_state["new_features"], 0)
+
+    def test_saving_updated_module_rewrites_artifact(self):
+        for module_class, column, labels in MODULES:
+            with self.subTest(module_class.__name__):
+                filepath = os.path.join(self.dirpath, column + ".pkl")
+                dirpath = os.path.join(self.dirpath, column)
+
+                module = self.retrain(module_class, column, labels)
+                module.save_to_file(filepath, artifact_dirpath=dirpath)
+                module.update(make_df(10, column, labels, seed=1))
+                module.save_to_file(filepath, artifact_dirpath=dirpath)
+
+                self.assertEqual(read_attributes(dirpath)["fingerprint"],
+                                 module.fingerprint)
+                np.testing.assert_array_equal(
+                    module_class.load_from_artifact(dirpath).classifier.coef_,
+                    module.classifier.coef_)
+
+
+if __name__ == "__main__":
+    unittest.main()
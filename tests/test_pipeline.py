@@ -0,0 +1,59 @@
+import time
+import unittest
+
+from util.pipeline import Pipeline
+
+
+def record(name, *upstream):
+    """
+    A Pipeline task that takes a while, and returns its name, start and end
+    times and the results it was given.
+    """
+    start = time.time()
+    time.sleep(0.3)
+    return name, start, time.time(), upstream
+
+
+class PipelineTest(unittest.TestCase):
+    def test_tasks_run_after_their_dependencies(self):
+        results = Pipeline()\
+            .add("a", record, "a")\
+            .add("b", record, "b")\
+            .add("c", record, "c", depends_on=["b", "a"])\
+            .run(max_workers=2)
+
+        _, a_start, a_end, a_upstream = results["a"]
+        _, b_start, b_end, _ = results["b"]
+        _, c_start, _, c_upstream = results["c"]
+
+        self.assertEqual(a_upstream, ())
+        self.assertEqual(c_upstream, (results["b"], results["a"]))
+        self.assertGreaterEqual(c_start, max(a_end, b_end))
+        # the independent tasks run concurrently
+        self.assertLess(a_start, b_end)
+        self.assertLess(b_start, a_end)
+
+    def test_cyclic_dependencies_raise(self):
+        pipeline = Pipeline()\
+            .add("a", record, "a")\
+            .add("b", record, "b", depends_on=["c"])\
+            .add("c", record, "c", depends_on=["b"])
+
+        with self.assertRaisesRegex(ValueError, "cyclic"):
+            pipeline.run(max_workers=2)
+
+    def test_unknown_dependencies_raise(self):
+        pipeline = Pipeline().add("a", record, "a", depends_on=["b"])
+
+        with self.assertRaisesRegex(ValueError, "unknown task b"):
+            pipeline.run(max_workers=2)
+
+    def test_duplicate_names_raise(self):
+        pipeline = Pipeline().add("a", record, "a")
+
+        with self.assertRaises(ValueError):
+            pipeline.add("a", record, "a")
+
+
+if __name__ == "__main__":
+    unittest.main()
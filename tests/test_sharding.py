@@ -0,0 +1,60 @@
+import unittest
+from unittest import mock
+
+import pandas as pd
+
+from util.sharding import classify_sharded
+
+
+class StubModule:
+    def __init__(self, source="pickled", artifact_dirpath=None):
+        """
+        Returns a stand-in for a trained module, whose results record how the
+        worker process that classified them got the module.
+        :param source: the value of the "source" column of the results
+        :param artifact_dirpath: the module's artifact directory, or None
+        """
+        self.source = source
+        self.artifact_dirpath = artifact_dirpath
+
+    @staticmethod
+    def load_from_artifact(dirpath):
+        return StubModule("artifact " + dirpath, dirpath)
+
+    def _classify(self, raw_df, observations):
+        result = raw_df.loc[:, ["test_key"]]
+        result["pred"] = raw_df["description"].str.upper()
+        result["source"] = self.source
+        return result
+
+
+class ClassifyShardedTest(unittest.TestCase):
+    def setUp(self):
+        patcher = mock.patch("util.sharding.MIN_SHARD_ROWS", 10)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.df = pd.DataFrame({
+            "test_key": range(100),
+            "description": [f"description {i}" for i in range(100)]
+        })
+
+    def test_module_is_loaded_from_artifact(self):
+        module = StubModule(artifact_dirpath="artifacts")
+
+        result = classify_sharded(module, self.df, False, 2)
+
+        expected = module._classify(self.df, False)
+        expected["source"] = "artifact artifacts"
+        pd.testing.assert_frame_equal(result, expected)
+
+    def test_module_without_artifact_is_pickled(self):
+        module = StubModule()
+
+        result = classify_sharded(module, self.df, False, 2)
+
+        pd.testing.assert_frame_equal(result, module._classify(self.df, False))
+
+
+if __name__ == "__main__":
+    unittest.main()
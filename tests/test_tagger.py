@@ -0,0 +1,68 @@
+import json
+import unittest
+
+from tests.stub_metamap import StubJavaServer
+from util.metamap_server import MetaMapServer
+from util.tagger import annotate_descriptions, CONNECTION_ERROR, MEMORY_ERROR,\
+    OTHER_ERROR
+
+
+class AnnotateDescriptionsTest(unittest.TestCase):
+    def setUp(self):
+        self.java = StubJavaServer()
+        patcher = self.java.patch()
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.server = MetaMapServer(pool_size=2, spawn=False)
+        self.server.start()
+        self.addCleanup(self.server.close)
+
+    def test_annotates_in_batches(self):
+        descriptions = [f"culture {i} mycobacteria" for i in range(5)]
+
+        annotations = annotate_descriptions(
+            descriptions, server=self.server, batch_size=2)
+
+        self.assertEqual(len(annotations), 5)
+        self.assertEqual(len(self.java.requests), 3)
+        for tags, candidates in annotations:
+            self.assertIn("Genus Mycobacterium", json.loads(candidates))
+
+    def test_failed_rows_are_labelled(self):
+        self.java.fail("memory", "Index 0 out-of-bounds for length 0")
+        self.java.fail("refused", "java.net.ConnectException: "
+                                  "Connection refused")
+        self.java.fail("other", "java.lang.NullPointerException")
+
+        descriptions = ["memory", "refused", "influenza", "other"]
+        annotations = annotate_descriptions(
+            descriptions, server=self.server, batch_size=4)
+
+        self.assertEqual(annotations[0], (MEMORY_ERROR, MEMORY_ERROR))
+        self.assertEqual(annotations[1], (CONNECTION_ERROR, CONNECTION_ERROR))
+        self.assertIn("Influenza virus", json.loads(annotations[2][1]))
+        self.assertEqual(annotations[3], (OTHER_ERROR, OTHER_ERROR))
+
+    def test_network_error_is_labelled_and_reconnected(self):
+        self.java.fail("unreachable")
+
+        annotations = annotate_descriptions(
+            ["unreachable", "staphylococcus"], server=self.server,
+            batch_size=2)
+
+        self.assertEqual(annotations[0], (CONNECTION_ERROR, CONNECTION_ERROR))
+        self.assertIn("Genus staphylococcus", json.loads(annotations[1][1]))
+
+    def test_dead_jvm_is_replaced(self):
+        self.java.gateways[0].kill()
+
+        annotations = annotate_descriptions(
+            ["influenza a"], server=self.server)
+
+        self.assertIn("Influenza virus", json.loads(annotations[0][1]))
+        self.assertEqual(len(self.java.gateways), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,100 @@
+import hashlib
+import os
+import sqlite3
+
+
+# SQLite limits the number of parameters in a single statement
+_MAX_PARAMETERS = 900
+
+
+class AnnotationCache:
+    def __init__(self, filepath):
+        """
+        Opens the persistent MetaMap annotation cache stored in the SQLite
+        database at the given path, creating the database if it does not exist.
+        Annotations are keyed by a hash of the MetaMap options and the exact
+        result_full_description text, as MetaMap's positional information
+        depends on every character of the text.
+        :param filepath: the absolute path to the SQLite database file
+        """
+        os.makedirs(os.path.dirname(filepath), exist_ok=True)
+
+        self._connection = sqlite3.connect(filepath)
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS annotations ("
+            "key TEXT PRIMARY KEY, tags TEXT NOT NULL, "
+            "candidates TEXT NOT NULL)"
+        )
+        self._connection.commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def get(self, descriptions, options=""):
+        """
+        Returns the cached annotations of the given descriptions.
+        :param descriptions: an Iterable of distinct result_full_descriptions
+        :param options: the MetaMap options the descriptions were annotated
+        with
+        :return: a Dict mapping each cached description to its (tags JSON
+        string, candidates JSON string) Tuple; uncached descriptions are
+        missing from the Dict
+        """
+        keys = {_get_key(description, options): description
+                for description in descriptions}
+        key_list = list(keys)
+
+        annotations = {}
+        for start in range(0, len(key_list), _MAX_PARAMETERS):
+            chunk = key_list[start:start + _MAX_PARAMETERS]
+            rows = self._connection.execute(
+                "SELECT key, tags, candidates FROM annotations "
+                f"WHERE key IN ({', '.join('?' * len(chunk))})",
+                chunk
+            )
+            for key, tags, candidates in rows:
+                annotations[keys[key]] = (tags, candidates)
+
+        return annotations
+
+    def put(self, annotations, options=""):
+        """
+        Saves the given annotations to the cache, overwriting the cached
+        annotations of the same descriptions.
+        :param annotations: an Iterable of (description, tags JSON string,
+        candidates JSON string) Tuples
+        :param options: the MetaMap options the descriptions were annotated
+        with
+        :return: None
+        """
+        self._connection.executemany(
+            "INSERT OR REPLACE INTO annotations (key, tags, candidates) "
+            "VALUES (?, ?, ?)",
+            (
+                (_get_key(description, options), tags, candidates)
+                for description, tags, candidates in annotations
+            )
+        )
+        self._connection.commit()
+
+    def close(self):
+        """
+        Closes the SQLite database.
+        :return: None
+        """
+        self._connection.close()
+
+
+def _get_key(description, options):
+    """
+    Returns the cache key of the given description annotated with the given
+    MetaMap options.
+    :param description: a result_full_description
+    :param options: MetaMap options; input string of form "-y -D" or "-yD"
+    :return: the hex digest of the SHA-256 hash of the options and description
+    """
+    text = f"{options.strip()}\0{description}"
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
@@ -0,0 +1,199 @@
+import json
+import os
+
+import joblib
+import numpy as np
+
+from sklearn.feature_extraction.text import CountVectorizer
+from sklearn.linear_model import LogisticRegression, SGDClassifier
+from sklearn.svm import LinearSVC
+
+from io_.fs import read_json, write_json
+from util.vectorizer import MappedVectorizer
+
+
+FORMAT_VERSION = 1
+
+# linear classifiers that are saved as raw coefficient arrays; any other
+# classifier is saved with joblib
+LINEAR_CLASSIFIERS = {
+    classifier.__name__: classifier
+    for classifier in [LogisticRegression, LinearSVC, SGDClassifier]
+}
+
+
+def save_artifact(dirpath, vectorizer, classifier, attributes):
+    """
+    Saves the given fitted vectorizer and classifier to an artifact directory
+    at the given path, overwriting the files of any existing artifact there.
+    - The vocabulary of a CountVectorizer (or MappedVectorizer) is saved as a
+      sorted array of its terms and an array of their columns (terms.npy,
+      columns.npy)
+    - The coefficients, intercepts and classes of a linear classifier (see
+      LINEAR_CLASSIFIERS) are saved as raw arrays (coef.npy, intercept.npy,
+      classes.npy)
+    - Anything else is saved with joblib (vectorizer.joblib, classifier.joblib)
+    - The parameters of both and the given attributes are saved in meta.json
+    :param dirpath: the absolute path to the artifact directory
+    :param vectorizer: a fitted vectorizer
+    :param classifier: a fitted classifier
+    :param attributes: a Dict of JSON-serializable module attributes to save
+    along with the vectorizer and classifier (e.g.: {"scale": 1.5})
+    :return: None
+    """
+    os.makedirs(dirpath, exist_ok=True)
+
+    meta = {
+        "format": FORMAT_VERSION,
+        "vectorizer": _save_vectorizer(dirpath, vectorizer),
+        "classifier": _save_classifier(dirpath, classifier),
+        "attributes": attributes
+    }
+    write_json(os.path.join(dirpath, "meta.json"), meta)
+
+
+def load_artifact(dirpath, mmap=True):
+    """
+    Loads the vectorizer, classifier and attributes saved by save_artifact.
+    The arrays are memory-mapped, so processes loading the same artifact share
+    one copy of them in the page cache. A saved CountVectorizer is loaded as a
+    MappedVectorizer, which looks its terms up in the mapped array directly
+    instead of copying the vocabulary into a Dict (see util.vectorizer).
+    :param dirpath: the absolute path to the artifact directory
+    :param mmap: whether to memory-map the arrays instead of reading them
+    :return: the vectorizer; the classifier; the Dict of attributes
+    """
+    meta = read_json(os.path.join(dirpath, "meta.json"))
+    if meta["format"] != FORMAT_VERSION:
+        raise ValueError(f"Unsupported artifact format {meta['format']}.")
+
+    mmap_mode = "r" if mmap else None
+    vectorizer = _load_vectorizer(dirpath, meta["vectorizer"], mmap_mode)
+    classifier = _load_classifier(dirpath, meta["classifier"], mmap_mode)
+    return vectorizer, classifier, meta["attributes"]
+
+
+def read_attributes(dirpath):
+    """
+    Returns the attributes saved by save_artifact, without loading the
+    vectorizer or classifier.
+    :param dirpath: the absolute path to the artifact directory
+    :return: the Dict of attributes, or None if there is no artifact at the
+    given path
+    """
+    meta_filepath = os.path.join(dirpath, "meta.json")
+    if not os.path.exists(meta_filepath):
+        return None
+    return read_json(meta_filepath)["attributes"]
+
+
+def _save_vectorizer(dirpath, vectorizer):
+    """
+    Saves the given fitted vectorizer to the given artifact directory.
+    :param dirpath: the absolute path to the artifact directory
+    :param vectorizer: a fitted vectorizer
+    :return: the vectorizer's entry in meta.json
+    """
+    if type(vectorizer) is CountVectorizer:
+        vectorizer = MappedVectorizer.from_count_vectorizer(vectorizer)
+
+    if type(vectorizer) is MappedVectorizer:
+        params = dict(vectorizer.params)
+        params["dtype"] = np.dtype(params["dtype"]).name
+
+        if _is_serializable(params):
+            np.save(os.path.join(dirpath, "terms.npy"),
+                    np.ascontiguousarray(vectorizer.terms))
+            np.save(os.path.join(dirpath, "columns.npy"),
+                    np.ascontiguousarray(vectorizer.columns))
+            return {"type": "MappedVectorizer", "params": params}
+
+    joblib.dump(vectorizer, os.path.join(dirpath, "vectorizer.joblib"))
+    return {"type": None}
+
+
+def _load_vectorizer(dirpath, entry, mmap_mode):
+    """
+    Loads the vectorizer saved by _save_vectorizer.
+    :param dirpath: the absolute path to the artifact directory
+    :param entry: the vectorizer's entry in meta.json
+    :param mmap_mode: the numpy memory-mapping mode, or None
+    :return: the fitted vectorizer
+    """
+    if entry["type"] is None:
+        return joblib.load(os.path.join(dirpath, "vectorizer.joblib"))
+
+    params = dict(entry["params"])
+    params["dtype"] = np.dtype(params["dtype"]).type
+    params["ngram_range"] = tuple(params["ngram_range"])
+
+    if entry["type"] == "CountVectorizer":
+        # saved before MappedVectorizer, with the terms in column order
+        terms = np.load(os.path.join(dirpath, "vocabulary.npy"))
+        return CountVectorizer(vocabulary=terms.tolist(), **params)
+
+    terms = np.load(os.path.join(dirpath, "terms.npy"), mmap_mode=mmap_mode)
+    columns = np.load(os.path.join(dirpath, "columns.npy"),
+                      mmap_mode=mmap_mode)
+    return MappedVectorizer(terms, columns, params)
+
+
+def _save_classifier(dirpath, classifier):
+    """
+    Saves the given fitted classifier to the given artifact directory.
+    :param dirpath: the absolute path to the artifact directory
+    :param classifier: a fitted classifier
+    :return: the classifier's entry in meta.json
+    """
+    name = classifier.__class__.__name__
+    params = classifier.get_params()
+
+    if LINEAR_CLASSIFIERS.get(name) is type(classifier)\
+            and _is_serializable(params)\
+            and all(isinstance(label, str) for label in classifier.classes_):
+        np.save(os.path.join(dirpath, "coef.npy"),
+                np.ascontiguousarray(classifier.coef_))
+        np.save(os.path.join(dirpath, "intercept.npy"),
+                np.ascontiguousarray(classifier.intercept_))
+        np.save(os.path.join(dirpath, "classes.npy"),
+                np.array(classifier.classes_, dtype=str))
+        return {"type": name, "params": params}
+
+    joblib.dump(classifier, os.path.join(dirpath, "classifier.joblib"))
+    return {"type": None}
+
+
+def _load_classifier(dirpath, entry, mmap_mode):
+    """
+    Loads the classifier saved by _save_classifier.
+    :param dirpath: the absolute path to the artifact directory
+    :param entry: the classifier's entry in meta.json
+    :param mmap_mode: the numpy memory-mapping mode, or None
+    :return: the fitted classifier
+    """
+    if entry["type"] is None:
+        return joblib.load(os.path.join(dirpath, "classifier.joblib"),
+                           mmap_mode=mmap_mode)
+
+    classifier = LINEAR_CLASSIFIERS[entry["type"]](**entry["params"])
+    classifier.coef_ = np.load(os.path.join(dirpath, "coef.npy"),
+                               mmap_mode=mmap_mode)
+    classifier.intercept_ = np.load(os.path.join(dirpath, "intercept.npy"),
+                                    mmap_mode=mmap_mode)
+    classifier.classes_ = np.load(os.path.join(dirpath, "classes.npy"))\
+        .astype(object)
+    classifier.n_features_in_ = classifier.coef_.shape[1]
+    return classifier
+
+
+def _is_serializable(params):
+    """
+    Returns True iff the given parameters can be saved in meta.json.
+    :param params: a Dict of estimator parameters
+    :return: whether the parameters are JSON-serializable
+    """
+    try:
+        json.dumps(params)
+        return True
+    except TypeError:
+        return False
@@ -0,0 +1,109 @@
+import json
+from collections import namedtuple
+
+from util.classifier import get_candidates
+
+
+# The decoded form of one row's MetaMap candidates JSON string.
+# - names: a Tuple of the lowercase preferred organism names, in the order
+#   get_candidates returns them
+# - matchings: a Tuple of the lowercase text fragments MetaMap matched to
+#   organisms, sorted from longest to shortest
+Candidates = namedtuple("Candidates", ["names", "matchings"])
+
+DECODED = "candidates_decoded"
+
+
+def decode_candidates(df):
+    """
+    Parses the candidates JSON string of each row in the given DataFrame once,
+    attaching the result as a "candidates_decoded" column that all modules read
+    from instead of parsing the JSON again. Rows with the same JSON string share
+    a single Candidates object. Returns the given DataFrame unchanged if it
+    already has a "candidates_decoded" column.
+    :param df: the DataFrame to decode the candidates of
+    - required columns: {"candidates"}
+    :return: the DataFrame with the decoded candidates
+    - columns: the columns of the given DataFrame, plus "candidates_decoded"
+    """
+    if DECODED in df.columns:
+        return df
+
+    df = df.copy()   # don't mutate the original DataFrame
+    df[DECODED] = decode_all(df["candidates"])
+    return df
+
+
+def decode_all(candidates_strs):
+    """
+    Decodes the given candidates JSON strings, parsing each distinct string only
+    once.
+    :param candidates_strs: an Iterable of JSON strings containing MetaMap
+    candidates information
+    :return: a List whose ith element is the Candidates object decoded from the
+    ith string
+    """
+    cache = {}
+
+    decoded = []
+    for candidates_str in candidates_strs:
+        candidates = cache.get(candidates_str)
+        if candidates is None:
+            candidates = decode(candidates_str)
+            cache[candidates_str] = candidates
+        decoded.append(candidates)
+
+    return decoded
+
+
+def decode(candidates_str):
+    """
+    Decodes the given candidates JSON string.
+    :param candidates_str: a JSON string containing MetaMap candidates
+    information
+    :return: a Candidates object
+    """
+    candidates_dict = json.loads(candidates_str)
+    names = tuple(candidate.lower()
+                  for candidate in get_candidates(candidates_dict))
+    return Candidates(names, tuple(get_matchings(candidates_dict)))
+
+
+def get_decoded(df):
+    """
+    Returns the decoded candidates of each row in the given DataFrame, reusing
+    its "candidates_decoded" column if it has one.
+    :param df: the DataFrame to get the decoded candidates of
+    - required columns: {"candidates" or "candidates_decoded"}
+    :return: an Iterable whose ith element is the ith row's Candidates object
+    """
+    if DECODED in df.columns:
+        return df[DECODED]
+    return decode_all(df["candidates"])
+
+
+def load_matchings(candidates_str):
+    """
+    Deserializes a JSON string containing MetaMap candidates information into
+    the List of lowercase text fragments MetaMap matched to organisms, sorted
+    from longest to shortest.
+    :param candidates_str: a JSON string containing MetaMap candidates
+    information
+    :return: the List of matched text fragments
+    """
+    return get_matchings(json.loads(candidates_str))
+
+
+def get_matchings(candidates_dict):
+    """
+    Returns the List of lowercase text fragments MetaMap matched to organisms
+    in the given deserialized MetaMap candidates information, sorted from
+    longest to shortest, like load_matchings.
+    :param candidates_dict: a Dict deserialized from a JSON string containing
+    MetaMap candidates information
+    :return: the List of matched text fragments
+    """
+    matchings = [text.lower() for _, value in candidates_dict.items()
+                 for text in value["matched"]]
+    matchings.sort(key=len, reverse=True)
+    return matchings
@@ -1,20 +1,26 @@
 import json
-from math import inf
+from math import ceil, inf
 
 import numpy as np
+from joblib import Parallel, delayed
 from numpy import nan
 from sklearn.model_selection import KFold
 from sklearn.svm import LinearSVC
 
 from util.extrema import ind_max
-from util.vectorizer import vectorize
+from util.vectorizer import transform, vectorize
 
 
-def best_classifier(df, output, vectorizer_factory, classifier_factories):
+def best_classifier(df, output, vectorizer_factory, classifier_factories,
+                    n_jobs=1, strategy="exhaustive", feature_cache=None):
     """
     Evaluates the expected performance of each classifier on the given data
     using 5-fold cross-validation. The given vectorizer is used to convert the
     data into features. Returns an instance of the best classifier.
+    - strategy "exhaustive" trains every classifier on all 5 full folds
+    - strategy "halving" runs successive halving: classifiers are trained on
+      growing subsamples of the folds, and the worst are dropped after each
+      round (see successive_halving)
     :param df: the preprocessed DataFrame containing the data to run
     cross-validation with
     - required columns: {"result_full_description", output}
@@ -23,23 +29,42 @@ def best_classifier(df, output, vectorizer_factory, classifier_factories):
     returns a new, fitted instance of the vectorizer to use
     :param classifier_factories: an Iterable of 0-argument lambdas that return
     new, untrained instances of the classifiers to evaluate
+    :param n_jobs: the number of worker processes to evaluate the folds and
+    classifiers with; 1 evaluates them sequentially in this process, -1 uses
+    one worker per CPU
+    :param strategy: "exhaustive" or "halving"
+    :param feature_cache: a FeatureCache to tokenize the folds with, or None
     :return: a new, untrained instance of the best classifier
     """
-    accuracies = [[] for _ in classifier_factories]
-
     N_SPLITS = 5
     kf = KFold(n_splits=N_SPLITS, shuffle=True)
-    for fold, (train_indices, test_indices) in enumerate(kf.split(df)):
-        print(f"Started evaluating fold {fold + 1} of {N_SPLITS}")
+    splits = list(kf.split(df))
+
+    if strategy == "halving":
+        return successive_halving(
+            df, splits, output, vectorizer_factory, classifier_factories,
+            n_jobs, feature_cache=feature_cache)
+    elif strategy != "exhaustive":
+        raise ValueError(f"Unknown model selection strategy {strategy}.")
+
+    if n_jobs == 1:
+        accuracies = [[] for _ in classifier_factories]
 
-        fold_accuracies = _evaluate_fold(
-            df, train_indices, test_indices, output,
-            vectorizer_factory, classifier_factories)
+        for fold, (train_indices, test_indices) in enumerate(splits):
+            print(f"Started evaluating fold {fold + 1} of {N_SPLITS}")
 
-        for index, accuracy in enumerate(fold_accuracies):
-            accuracies[index].append(accuracy)
+            fold_accuracies = _evaluate_fold(
+                df, train_indices, test_indices, output,
+                vectorizer_factory, classifier_factories, feature_cache)
 
-        print(f"Finished evaluating fold {fold + 1} of {N_SPLITS}")
+            for index, accuracy in enumerate(fold_accuracies):
+                accuracies[index].append(accuracy)
+
+            print(f"Finished evaluating fold {fold + 1} of {N_SPLITS}")
+    else:
+        accuracies = _evaluate_parallel(
+            df, splits, output, vectorizer_factory, classifier_factories,
+            n_jobs, feature_cache)
 
     mean_accuracies = [
         np.mean(accuracies[i]) for i in range(len(classifier_factories))
@@ -49,7 +74,7 @@ def best_classifier(df, output, vectorizer_factory, classifier_factories):
 
 def _evaluate_fold(
         df, train_indices, test_indices, output,
-        vectorizer_factory, classifier_factories
+        vectorizer_factory, classifier_factories, feature_cache=None
 ):
     """
     Evaluates the performance of the given classifiers on the given training and
@@ -63,14 +88,12 @@ def _evaluate_fold(
     returns a new, fitted instance of the vectorizer to use
     :param classifier_factories: an Iterable of 0-argument lambdas that return
     new, untrained instances of the classifiers to evaluate
+    :param feature_cache: a FeatureCache to tokenize the fold with, or None
     :return: a List whose ith element is the ith classifier's accuracy
     """
-    df_train = df.iloc[train_indices, :]
-    df_test = df.iloc[test_indices, :]
-
-    vectorizer = vectorizer_factory(df_train)
-    X_train, _, _ = vectorize(vectorizer, df_train["result_full_description"])
-    y_train = df_train[output]
+    X_train, y_train, X_test, y_true = _vectorize_fold(
+        df, train_indices, test_indices, output, vectorizer_factory,
+        feature_cache)
 
     accuracies = []
 
@@ -79,14 +102,8 @@ def _evaluate_fold(
         print(f"Evaluating classifier {index + 1} out of {n}... ",
               end="", flush=True)
 
-        classifier = classifier_factory()
-        classifier.fit(X_train, y_train)
-
-        X_test = vectorizer.transform(df_test["result_full_description"])
-        y_true = df_test[output]
-        y_pred = classifier.predict(X_test)
-
-        accuracy = np.mean(y_true == y_pred)
+        accuracy = _evaluate_classifier(
+            classifier_factory, X_train, y_train, X_test, y_true)
         accuracies.append(accuracy)
 
         print("Finished")
@@ -94,6 +111,212 @@ def _evaluate_fold(
     return accuracies
 
 
+def _evaluate_parallel(
+        df, splits, output, vectorizer_factory, classifier_factories, n_jobs,
+        feature_cache=None
+):
+    """
+    Evaluates the performance of the given classifiers on each of the given
+    folds in a pool of worker processes. Each fold is vectorized by one job;
+    each (fold, classifier) pair is then evaluated by its own job. The fold's
+    sparse matrices are memory-mapped into the workers rather than copied
+    into each job.
+    :param df: the preprocessed DataFrame containing the training and test data
+    - required columns: {"result_full_description", output}
+    :param splits: a List of (train_indices, test_indices) Tuples
+    :param output: the name of the DataFrame column containing the true labels
+    :param vectorizer_factory: a lambda that takes in a training DataFrame and
+    returns a new, fitted instance of the vectorizer to use
+    :param classifier_factories: an Iterable of 0-argument lambdas that return
+    new, untrained instances of the classifiers to evaluate
+    :param n_jobs: the number of worker processes
+    :param feature_cache: a FeatureCache to tokenize the folds with, or None.
+    Each worker tokenizes its fold in its own copy of the cache.
+    :return: a List whose ith element is the List of the ith classifier's
+    accuracies on each fold
+    """
+    print(f"Started vectorizing {len(splits)} folds")
+    with Parallel(n_jobs=n_jobs) as parallel:
+        folds = parallel(
+            delayed(_vectorize_fold)(
+                df, train_indices, test_indices, output, vectorizer_factory,
+                feature_cache)
+            for train_indices, test_indices in splits
+        )
+
+    print(f"Started evaluating {len(classifier_factories)} classifiers "
+          f"on {len(splits)} folds")
+    with Parallel(n_jobs=n_jobs, max_nbytes="1M", mmap_mode="r") as parallel:
+        fold_accuracies = parallel(
+            delayed(_evaluate_classifier)(classifier_factory, *fold)
+            for fold in folds
+            for classifier_factory in classifier_factories
+        )
+    print("Finished evaluating classifiers")
+
+    n = len(classifier_factories)
+    return [fold_accuracies[index::n] for index in range(n)]
+
+
+def successive_halving(
+        df, splits, output, vectorizer_factory, classifier_factories,
+        n_jobs=1, eta=3, min_fraction=1 / 9, feature_cache=None
+):
+    """
+    Selects the best classifier by successive halving. In the first round,
+    every classifier is trained on a min_fraction subsample of each fold's
+    training rows and evaluated on the fold's full test rows. After each
+    round, only the best 1/eta of the classifiers are kept, and the subsample
+    grows by a factor of eta, until one classifier is left or the survivors
+    have been evaluated on the full training rows. Prints how much training
+    compute this saved compared to exhaustive cross-validation, in training
+    rows fitted.
+    :param df: the preprocessed DataFrame containing the data to run
+    cross-validation with
+    - required columns: {"result_full_description", output}
+    :param splits: a List of (train_indices, test_indices) Tuples
+    :param output: the name of the DataFrame column containing the true labels
+    :param vectorizer_factory: a lambda that takes in a training DataFrame and
+    returns a new, fitted instance of the vectorizer to use
+    :param classifier_factories: an Iterable of 0-argument lambdas that return
+    new, untrained instances of the classifiers to evaluate
+    :param n_jobs: the number of worker processes to evaluate the folds and
+    classifiers with; 1 evaluates them sequentially in this process
+    :param eta: the factor by which the classifiers are cut and the
+    subsamples grow after each round
+    :param min_fraction: the fraction of the training rows used in the first
+    round
+    :param feature_cache: a FeatureCache to tokenize the folds with, or None
+    :return: a new, untrained instance of the best classifier
+    """
+    if n_jobs == 1:
+        folds = [
+            _vectorize_fold(df, train_indices, test_indices, output,
+                            vectorizer_factory, feature_cache)
+            for train_indices, test_indices in splits
+        ]
+    else:
+        with Parallel(n_jobs=n_jobs) as parallel:
+            folds = parallel(
+                delayed(_vectorize_fold)(
+                    df, train_indices, test_indices, output,
+                    vectorizer_factory, feature_cache)
+                for train_indices, test_indices in splits
+            )
+
+    # each round's subsample is a prefix of a fixed shuffle of the fold, so
+    # later rounds extend the earlier rounds' training rows
+    orders = [np.random.permutation(X_train.shape[0])
+              for X_train, _, _, _ in folds]
+
+    survivors = list(range(len(classifier_factories)))
+    fraction = min_fraction
+    rows_fitted = 0
+
+    while True:
+        fraction = min(fraction, 1)
+        print(f"Started evaluating {len(survivors)} classifiers "
+              f"on {fraction:.0%} of the training rows")
+
+        subsamples = []
+        for (X_train, y_train, X_test, y_true), order in zip(folds, orders):
+            rows = order[:max(1, int(ceil(fraction * len(order))))]
+            if len(np.unique(y_train[rows])) < 2:
+                rows = order
+            subsamples.append((X_train[rows], y_train[rows], X_test, y_true))
+            rows_fitted += len(rows) * len(survivors)
+
+        jobs = [
+            (classifier_factories[index], subsample)
+            for subsample in subsamples
+            for index in survivors
+        ]
+        if n_jobs == 1:
+            fold_accuracies = [
+                _evaluate_classifier(classifier_factory, *subsample)
+                for classifier_factory, subsample in jobs
+            ]
+        else:
+            with Parallel(n_jobs=n_jobs, max_nbytes="1M",
+                          mmap_mode="r") as parallel:
+                fold_accuracies = parallel(
+                    delayed(_evaluate_classifier)(
+                        classifier_factory, *subsample)
+                    for classifier_factory, subsample in jobs
+                )
+
+        n = len(survivors)
+        mean_accuracies = [
+            np.mean(fold_accuracies[index::n]) for index in range(n)
+        ]
+
+        if fraction >= 1:
+            best = survivors[ind_max(mean_accuracies)]
+            break
+
+        ranking = sorted(range(n), key=lambda i: -mean_accuracies[i])
+        survivors = sorted(survivors[i]
+                           for i in ranking[:max(1, int(ceil(n / eta)))])
+        if len(survivors) == 1:
+            best = survivors[0]
+            break
+        fraction *= eta
+
+    exhaustive_rows = len(classifier_factories)\
+        * sum(X_train.shape[0] for X_train, _, _, _ in folds)
+    print(f"Successive halving fitted {rows_fitted} training rows instead of "
+          f"{exhaustive_rows} ({1 - rows_fitted / exhaustive_rows:.0%} saved)")
+
+    return classifier_factories[best]
+
+
+def _vectorize_fold(df, train_indices, test_indices, output,
+                    vectorizer_factory, feature_cache=None):
+    """
+    Fits a new vectorizer on the training rows of the given fold and transforms
+    the fold's training and test rows.
+    :param df: the preprocessed DataFrame containing the training and test data
+    - required columns: {"result_full_description", output}
+    :param train_indices: the indices of the training rows
+    :param test_indices: the indices of the test rows
+    :param output: the name of the DataFrame column containing the true labels
+    :param vectorizer_factory: a lambda that takes in a training DataFrame and
+    returns a new, fitted instance of the vectorizer to use
+    :param feature_cache: a FeatureCache to tokenize the fold with, or None
+    :return: the training feature matrix; the training labels;
+             the test feature matrix; the test labels
+    """
+    df_train = df.iloc[train_indices, :]
+    df_test = df.iloc[test_indices, :]
+
+    vectorizer = vectorizer_factory(df_train)
+    X_train, _, _ = vectorize(
+        vectorizer, df_train["result_full_description"], feature_cache)
+    X_test = transform(
+        vectorizer, df_test["result_full_description"], feature_cache)
+
+    return X_train, df_train[output].values, X_test, df_test[output].values
+
+
+def _evaluate_classifier(classifier_factory, X_train, y_train, X_test, y_true):
+    """
+    Trains a new instance of a classifier and returns its accuracy on the given
+    test set.
+    :param classifier_factory: a 0-argument lambda that returns a new,
+    untrained instance of the classifier to evaluate
+    :param X_train: the training feature matrix
+    :param y_train: the training labels
+    :param X_test: the test feature matrix
+    :param y_true: the test labels
+    :return: the classifier's accuracy
+    """
+    classifier = classifier_factory()
+    classifier.fit(X_train, y_train)
+
+    y_pred = classifier.predict(X_test)
+    return np.mean(y_true == y_pred)
+
+
 def get_confidences(classifier, X, scale):
     """
     Computes the given classifier's prediction confidences on the given data.
@@ -151,8 +374,17 @@ def load_candidates(candidates_str):
     information
     :return: a Set containing the preferred organism names
     """
-    candidates_str = candidates_str
-    candidates_dict = json.loads(candidates_str)
+    return get_candidates(json.loads(candidates_str))
+
+
+def get_candidates(candidates_dict):
+    """
+    Returns the Set of preferred organism names in the given deserialized
+    MetaMap candidates information, like load_candidates.
+    :param candidates_dict: a Dict deserialized from a JSON string containing
+    MetaMap candidates information
+    :return: a Set containing the preferred organism names
+    """
     candidates = set(candidates_dict.keys())
 
     banned = {"Bacteria", "Virus"}
@@ -0,0 +1,47 @@
+import numpy as np
+import pandas as pd
+
+
+def factorize(*columns):
+    """
+    Groups the rows of the given columns by their combination of values, so
+    that work that only depends on these values can be done once per distinct
+    combination and broadcast back to every row.
+    :param columns: one or more array-likes of hashable values (e.g.: strings,
+    or the Candidates objects of util.candidates), all of the same length.
+    Missing values (None or NaN) are grouped like any other value.
+    :return: an array whose ith element is the index of the ith row's distinct
+    combination (distinct combinations are numbered from 0 in order of first
+    occurrence); an array whose kth element is the index of the first row with
+    the kth distinct combination
+    """
+    codes = None
+    for column in columns:
+        # missing values get a code of their own rather than -1, which would
+        # not index the distinct combinations
+        column_codes, uniques = pd.factorize(
+            np.asarray(column, dtype=object), use_na_sentinel=False)
+        if codes is None:
+            codes = column_codes
+        else:
+            codes, _ = pd.factorize(codes * len(uniques) + column_codes)
+
+    # the codes are 0, 1, ... in order of first occurrence, so sorting the
+    # distinct codes keeps the first rows in the same order
+    _, first_rows = np.unique(codes, return_index=True)
+    return codes, first_rows
+
+
+def print_dedup(name, n_rows, n_unique, unit="rows"):
+    """
+    Prints how many distinct inputs the given rows were classified with, and
+    the resulting dedup ratio.
+    :param name: the name of the classifying module, for logging
+    :param n_rows: the number of rows classified
+    :param n_unique: the number of distinct inputs among them
+    :param unit: what the distinct inputs are, for logging (e.g.:
+    "descriptions")
+    :return: None
+    """
+    print(f"{name}: Classified {n_rows} rows with {n_unique} distinct {unit} "
+          f"(dedup ratio {n_rows / max(n_unique, 1):.1f}x)")
@@ -0,0 +1,93 @@
+import hashlib
+import os
+from datetime import datetime
+
+from io_.fs import read_json, write_json
+
+
+def get_manifest_filepath(filepath):
+    """
+    Returns the path to the manifest of the saved module at the given path:
+    a JSON sidecar file next to it (e.g.: "pkl\\test_outcome_module.pkl" has
+    the manifest "pkl\\test_outcome_module.manifest.json").
+    :param filepath: the absolute path to the saved module
+    :return: the absolute path to its manifest
+    """
+    return os.path.splitext(filepath)[0] + ".manifest.json"
+
+
+def write_manifest(filepath, module, train_size=None, classifier=None,
+                   vocabulary_size=None):
+    """
+    Writes the manifest of the module that was just saved to the given path,
+    overwriting the manifest if it already exists.
+    :param filepath: the absolute path the module was saved to
+    :param module: the saved module
+    :param train_size: the number of rows the module was trained on, or None
+    if unknown
+    :param classifier: the class name of the module's selected classifier, or
+    None if the module has no classifier
+    :param vocabulary_size: the number of features or dictionary entries the
+    module was trained with, or None if unknown
+    :return: the manifest
+    - keys: {"module", "sha256", "size", "mtime_ns", "train_size",
+      "classifier", "vocabulary_size", "created"}
+    """
+    stat = os.stat(filepath)
+    manifest = {
+        "module": module.__class__.__name__,
+        "sha256": hash_file(filepath),
+        "size": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+        "train_size": train_size,
+        "classifier": classifier,
+        "vocabulary_size": vocabulary_size,
+        "created": datetime.now().isoformat(timespec="seconds")
+    }
+    write_json(get_manifest_filepath(filepath), manifest)
+    return manifest
+
+
+def read_manifest(filepath):
+    """
+    Returns the manifest of the saved module at the given path, without
+    loading the module itself.
+    :param filepath: the absolute path to the saved module
+    :return: the manifest written by write_manifest, or None if the module has
+    no manifest (e.g.: it was saved before manifests were introduced)
+    """
+    manifest_filepath = get_manifest_filepath(filepath)
+    if not os.path.exists(manifest_filepath):
+        return None
+    return read_json(manifest_filepath)
+
+
+def get_fingerprint(filepath):
+    """
+    Returns the content hash of the saved module at the given path. The hash
+    is taken from the module's manifest if the manifest matches the file's
+    size and modification time; otherwise (no manifest, or the file was
+    replaced without one) the file is hashed.
+    :param filepath: the absolute path to the saved module
+    :return: the hex digest of the SHA-256 hash of the saved module
+    """
+    manifest = read_manifest(filepath)
+    if manifest is not None:
+        stat = os.stat(filepath)
+        if manifest.get("size") == stat.st_size\
+                and manifest.get("mtime_ns") == stat.st_mtime_ns:
+            return manifest["sha256"]
+    return hash_file(filepath)
+
+
+def hash_file(filepath):
+    """
+    Returns the content hash of the file at the given path.
+    :param filepath: the absolute path to the file to hash
+    :return: the hex digest of the SHA-256 hash of the file's contents
+    """
+    digest = hashlib.sha256()
+    with open(filepath, "rb") as file:
+        for block in iter(lambda: file.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
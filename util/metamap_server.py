@@ -0,0 +1,479 @@
+import json
+import queue
+import re
+import subprocess
+import threading
+import time
+from contextlib import contextmanager
+
+from py4j.java_gateway import GatewayParameters, JavaGateway
+from py4j.protocol import Py4JError
+
+from root import from_root
+
+
+DEFAULT_PORT = 25333
+
+# MetaMap splits its input into citations at blank lines
+_CITATION_BREAK = "\n\n"
+_BLANK_LINE = re.compile(r"\n\s*\n")
+
+# a "position" key of MetaMap's JSON, and the start positions in its value
+_POSITION_KEY = re.compile(r'"position"\s*:\s*')
+_START = re.compile(r"()(-?\d+)")
+_START_IN_OBJECT = re.compile(r'("x"\s*:\s*)(-?\d+)')
+
+
+class MetaMapServer:
+    def __init__(self, pool_size=1, port=DEFAULT_PORT, spawn=True,
+                 attempts=5):
+        """
+        Returns a new, unstarted MetaMapServer: a handle on a MetaMapBuild.jar
+        JVM and a pool of MetaMap API connections inside it. Call start (or use
+        the MetaMapServer in a with statement) before using it.
+        :param pool_size: the number of MetaMap API connections to open
+        :param port: the port of the JVM's py4j gateway
+        :param spawn: whether to start a new JVM if none is running on the
+        given port. The MetaMapServer owns the JVMs it starts, and shuts them
+        down when it is closed; JVMs started by someone else (e.g.:
+        driver/metamap_server.py) are left running.
+        :param attempts: the number of times to try connecting to a newly
+        started JVM, 1 second apart
+        """
+        self.pool_size = pool_size
+        self.port = port
+        self.spawn = spawn
+        self.attempts = attempts
+
+        self._proc = None
+        self._gateway = None
+        self._connections = queue.Queue()
+        self._all_connections = []
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def start(self):
+        """
+        Attaches to the JVM running on this MetaMapServer's port, starting a
+        new JVM if there is none, and opens the pool of MetaMap API
+        connections. Raises an Exception if no JVM can be connected to.
+        :return: None
+        """
+        with self._lock:
+            if not self._connect(attempts=1):
+                self._spawn()
+
+        for i in range(self.pool_size):
+            connection = MetaMapConnection()
+            connection.open(self._gateway)
+            self._all_connections.append(connection)
+            self._connections.put(connection)
+
+    def close(self):
+        """
+        Disconnects all MetaMap API connections, and shuts down the JVM if this
+        MetaMapServer started it.
+        :return: None
+        """
+        for connection in self._all_connections:
+            connection.close()
+        self._all_connections = []
+        self._connections = queue.Queue()
+
+        with self._lock:
+            self._disconnect()
+
+    @contextmanager
+    def connection(self):
+        """
+        Returns a context manager that takes a MetaMap API connection out of
+        the pool, and puts it back when the with block exits. Blocks until a
+        connection is available. The connection is health-checked first, and
+        reopened (restarting the JVM, if necessary) if it is broken.
+        :return: a context manager yielding a MetaMapConnection
+        """
+        connection = self._connections.get()
+        try:
+            if connection.gateway is not self._gateway\
+                    or not connection.is_healthy():
+                self.reconnect(connection)
+            yield connection
+        finally:
+            self._connections.put(connection)
+
+    def reconnect(self, connection):
+        """
+        Reopens the given MetaMap API connection, restarting the JVM first if
+        it is no longer reachable. Raises an Exception if no JVM can be
+        connected to.
+        :param connection: the broken MetaMapConnection
+        :return: None
+        """
+        self.check()
+        connection.open(self._gateway)
+
+    def check(self):
+        """
+        Checks that the JVM is reachable, restarting it if it is not. Raises an
+        Exception if no JVM can be connected to.
+        :return: None
+        """
+        with self._lock:
+            if self._is_alive():
+                return
+
+            print("Lost connection to Java server; reconnecting")
+            self._disconnect()
+            if not self._connect(attempts=1):
+                self._spawn()
+
+    def _spawn(self):
+        """
+        Starts a new MetaMapBuild.jar JVM and connects to it. Raises an
+        Exception if the JVM cannot be started or connected to.
+        Precondition: self._lock is held.
+        :return: None
+        """
+        if not self.spawn:
+            raise Exception(f"No Java server is running on port {self.port}")
+
+        self._proc = subprocess.Popen(
+            ["java", "-jar", from_root("libs\\MetaMapBuild.jar")],
+            shell=False
+        )
+
+        if not self._connect(self.attempts):
+            self._disconnect()
+            raise Exception("Error connecting to Java server")
+
+    def _connect(self, attempts):
+        """
+        Connects to the JVM running on this MetaMapServer's port.
+        Precondition: self._lock is held.
+        :param attempts: the number of times to try connecting, 1 second apart
+        :return: True iff the connection succeeded
+        """
+        for i in range(attempts):
+            if i > 0:
+                time.sleep(1)
+
+            self._gateway = JavaGateway(
+                gateway_parameters=GatewayParameters(port=self.port))
+            if self._is_alive():
+                print(f"Connected to Java server on attempt {i + 1}")
+                return True
+
+            self._gateway.close()
+            self._gateway = None
+
+        return False
+
+    def _disconnect(self):
+        """
+        Closes the connection to the JVM, shutting the JVM down if this
+        MetaMapServer started it.
+        Precondition: self._lock is held.
+        :return: None
+        """
+        if self._gateway is not None:
+            if self._proc is not None:
+                try:
+                    self._gateway.shutdown()
+                except Py4JError:
+                    pass
+            self._gateway.close()
+            self._gateway = None
+
+        if self._proc is not None:
+            self._proc.terminate()
+            self._proc = None
+
+    def _is_alive(self):
+        """
+        Returns True iff the JVM answers a request.
+        :return: whether the JVM is reachable
+        """
+        if self._gateway is None:
+            return False
+
+        try:
+            self._gateway.jvm.System.currentTimeMillis()
+            return True
+        except Py4JError:
+            return False
+
+
+class MetaMapConnection:
+    def __init__(self):
+        """
+        Returns a new, unopened MetaMapConnection: a MetaMap API session held
+        by a connect.MetamapMain object inside the JVM.
+        """
+        self.gateway = None
+        self.metamap = None
+        self.api = None
+        self.options = None
+
+    def open(self, gateway):
+        """
+        Opens a new MetaMap API session in the JVM behind the given gateway,
+        replacing this MetaMapConnection's current session. The current
+        MetaMap options are set on the new session.
+        :param gateway: a connected JavaGateway
+        :return: None
+        """
+        self.close()
+
+        self.gateway = gateway
+        self.metamap = gateway.jvm.connect.MetamapMain()
+        self.api = self.metamap.getApi()
+
+        if self.options is not None:
+            self.api.setOptions(self.options)
+
+    def close(self):
+        """
+        Disconnects this MetaMapConnection's MetaMap API session, if it is
+        still reachable.
+        :return: None
+        """
+        if self.api is not None:
+            try:
+                self.api.disconnect()
+            except Py4JError:
+                pass
+
+        self.gateway = None
+        self.metamap = None
+        self.api = None
+
+    def set_options(self, options):
+        """
+        Sets the MetaMap options of this MetaMapConnection's session. "-c" is
+        always added to the options.
+        :param options: MetaMap options; input string of form "-y -D" or "-yD"
+        :return: None
+        """
+        if options.strip():
+            # Process a string with additional options string
+            options = options + " -c"
+        else:
+            # Process a string without additional options string
+            options = "-c"
+
+        if options != self.options:
+            self.api.setOptions(options)
+            self.options = options
+
+    def process(self, description):
+        """
+        Returns the MetaMap annotations of the given description.
+        :param description: the result_full_description to annotate
+        :return: the tags JSON string; the candidates JSON string
+        """
+        result = self.api.processCitationsFromString(description).get(0)
+
+        # parse result from MetaMap to tags and candidates
+        tags = self.metamap.formatOneResultToString(result, "tags")
+        candidates = self.metamap.formatOneResultToString(result, "candidates")
+        return tags, candidates
+
+    def process_batch(self, descriptions):
+        """
+        Returns the MetaMap annotations of the given descriptions, sending them
+        to MetaMap as blank-line-separated citations in a single request. The
+        positions in each description's annotations are rebased to count from
+        the start of the description, as if it had been processed on its own
+        (see _rebase_positions).
+        Descriptions that are blank or contain blank lines themselves (which
+        MetaMap would not split on correctly) are processed one at a time, as
+        is the whole batch if MetaMap returns the wrong number of results, and
+        any description whose positions cannot be rebased unambiguously.
+        :param descriptions: a List of result_full_descriptions to annotate
+        :return: a List whose ith element is the (tags JSON string, candidates
+        JSON string) Tuple of the ith description
+        """
+        annotations = [None] * len(descriptions)
+
+        batch = []
+        for index, description in enumerate(descriptions):
+            if not description.strip() or _BLANK_LINE.search(description):
+                annotations[index] = self.process(description)
+            else:
+                batch.append(index)
+
+        if len(batch) == 1:
+            annotations[batch[0]] = self.process(descriptions[batch[0]])
+        elif batch:
+            results = self.api.processCitationsFromString(
+                _CITATION_BREAK.join(descriptions[index] for index in batch))
+
+            if results.size() == len(batch):
+                offset = 0
+                for i, index in enumerate(batch):
+                    result = results.get(i)
+                    annotations[index] = _rebase_positions((
+                        self.metamap.formatOneResultToString(result, "tags"),
+                        self.metamap.formatOneResultToString(
+                            result, "candidates")
+                    ), descriptions[index], offset)
+                    offset += len(descriptions[index]) + len(_CITATION_BREAK)
+
+            for index in batch:
+                if annotations[index] is None:
+                    annotations[index] = self.process(descriptions[index])
+
+        return annotations
+
+    def is_healthy(self):
+        """
+        Returns True iff this MetaMapConnection's session is connected to the
+        MetaMap server.
+        :return: whether the session is usable
+        """
+        try:
+            return str(self.metamap.isConnectAPI()).lower() == "true"
+        except Py4JError:
+            return False
+
+
+def _rebase_positions(annotation, description, offset):
+    """
+    Returns the given annotations of a description that was sent to MetaMap at
+    the given offset of a batched request, with the positions in its tags and
+    candidates counted from the start of the description. MetaMap may count
+    positions from the start of the whole request or of each citation, so the
+    positions are only shifted if they all fall inside the description's part
+    of the request and not all inside the description itself; they are kept if
+    the reverse holds.
+    :param annotation: the (tags JSON string, candidates JSON string) Tuple
+    :param description: the result_full_description that was annotated
+    :param offset: the position of the description's first character in the
+    request
+    :return: the rebased (tags JSON string, candidates JSON string) Tuple, or
+    None if it cannot be told how the positions were counted (e.g.: they fit
+    both ways, or they are in an unknown format)
+    """
+    if offset == 0:
+        return annotation
+
+    positions = []
+
+    def collect(x):
+        positions.append(x)
+        return x
+
+    documents = []
+    for string in annotation:
+        try:
+            document = json.loads(string)
+        except ValueError:
+            # not JSON (e.g.: an empty string), so it has no positions
+            document = None
+        documents.append(document)
+
+    try:
+        for document in documents:
+            _map_positions(document, collect)
+    except ValueError:
+        return None
+
+    in_request = all(offset <= x < offset + len(description) for x in positions)
+    in_description = all(0 <= x < len(description) for x in positions)
+
+    if not positions or (in_description and not in_request):
+        return annotation
+    if in_request and not in_description:
+        rebased = tuple(
+            string if document is None
+            else _shift_positions(string, document, lambda x: x - offset)
+            for string, document in zip(annotation, documents)
+        )
+        if None not in rebased:
+            return rebased
+    return None
+
+
+def _shift_positions(string, document, function):
+    """
+    Returns the given MetaMap JSON string with the given function applied to
+    every start position in a "position" value, rewriting only the position
+    numbers so that the string keeps the formatting MetaMapBuild.jar gave it.
+    :param string: a tags or candidates JSON string
+    :param document: the decoded JSON of the string
+    :param function: a function from a start position to a start position
+    :return: the rewritten JSON string, or None if the rewritten positions do
+    not decode to those _map_positions gives
+    """
+    decoder = json.JSONDecoder()
+
+    parts = []
+    end = 0
+    for match in _POSITION_KEY.finditer(string):
+        if match.start() < end:
+            continue
+
+        start = match.end()
+        try:
+            _, stop = decoder.raw_decode(string, start)
+        except ValueError:
+            return None
+
+        text = string[start:stop]
+        number = _START_IN_OBJECT if "{" in text else _START
+        parts.append(string[end:start])
+        parts.append(number.sub(
+            lambda m: m.group(1) + str(function(int(m.group(2)))), text))
+        end = stop
+    parts.append(string[end:])
+
+    shifted = "".join(parts)
+    if json.loads(shifted) != _map_positions(document, function):
+        return None
+    return shifted
+
+
+def _map_positions(node, function):
+    """
+    Returns a copy of the given decoded MetaMap JSON in which the given
+    function has been applied to every start position in a "position" value.
+    A position value is a start position, a {"x": start, "y": length} object,
+    or a List of either. Raises a ValueError for any other position value.
+    :param node: the decoded JSON of a tags or candidates string
+    :param function: a function from a start position to a start position
+    :return: the decoded JSON with the mapped positions
+    """
+    if isinstance(node, dict):
+        return {
+            key: _map_position(value, function, nested=False)
+            if key == "position" else _map_positions(value, function)
+            for key, value in node.items()
+        }
+    if isinstance(node, list):
+        return [_map_positions(value, function) for value in node]
+    return node
+
+
+def _map_position(position, function, nested):
+    """
+    Applies the given function to the start positions in the given position
+    value (see _map_positions).
+    :param position: a "position" value, or an element of one
+    :param function: a function from a start position to a start position
+    :param nested: whether the position value is an element of a List
+    :return: the position value with the mapped start positions
+    """
+    if isinstance(position, list) and not nested:
+        return [_map_position(value, function, nested=True)
+                for value in position]
+    if isinstance(position, dict) and type(position.get("x")) is int:
+        return dict(position, x=function(position["x"]))
+    if type(position) is int:
+        return function(position)
+    raise ValueError(f"Unknown MetaMap position format: {position!r}")
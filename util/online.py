@@ -0,0 +1,99 @@
+import numpy as np
+from sklearn.linear_model import SGDClassifier
+from sklearn.model_selection import cross_val_score
+
+
+# a full retrain is recommended once the accuracy on a batch of newly labelled
+# rows is this far below the cross-validated accuracy of the last full retrain
+DRIFT_THRESHOLD = 0.05
+
+# a full retrain is recommended once the updates have introduced this many new
+# hashed columns, as a fraction of the columns seen by the last full retrain
+FEATURE_GROWTH_THRESHOLD = 0.2
+
+
+def get_online_classifier():
+    """
+    Returns a new classifier that can be updated incrementally with
+    partial_fit: a linear model trained by stochastic gradient descent, with
+    the modified Huber loss so that it has a predict_proba method.
+    :return: a new, untrained SGDClassifier
+    """
+    return SGDClassifier(loss="modified_huber", random_state=0)
+
+
+def start_online(classifier, X, y):
+    """
+    Trains the given online classifier from scratch on the given data, and
+    returns the state that update_online compares newly labelled rows
+    against.
+    :param classifier: a new classifier returned by get_online_classifier
+    :param X: the training feature matrix, in a fixed feature space (e.g.:
+    hashed columns)
+    :param y: the training labels
+    :return: a Dict with keys "baseline_accuracy" (the 5-fold cross-validated
+    accuracy of the classifier), "baseline_features" (the number of columns
+    used by the training data), "seen_features" (a sorted List of those
+    columns) and "new_features" (the number of columns first seen by updates)
+    """
+    accuracy = cross_val_score(get_online_classifier(), X, y, cv=5).mean()
+    classifier.fit(X, y)
+
+    seen_features = np.unique(X.indices)
+    return {
+        "baseline_accuracy": float(accuracy),
+        "baseline_features": len(seen_features),
+        "seen_features": seen_features.tolist(),
+        "new_features": 0
+    }
+
+
+def update_online(classifier, state, X, y, name):
+    """
+    Folds the given newly labelled rows into the given online classifier with
+    one pass of partial_fit, updating the given state. Returns True iff a full
+    retrain is recommended, because:
+    - the classifier's accuracy on the new rows (measured before updating) is
+      more than DRIFT_THRESHOLD below the baseline accuracy
+    - the columns first seen since the last full retrain exceed
+      FEATURE_GROWTH_THRESHOLD of the columns seen by it
+    - some of the new rows have labels the classifier has never seen; these
+      rows are left out of the update, since partial_fit cannot add classes
+    :param classifier: a classifier trained by start_online
+    :param state: the state returned by start_online, or updated by previous
+    calls to update_online
+    :param X: the feature matrix of the new rows, in the classifier's feature
+    space
+    :param y: the labels of the new rows
+    :param name: the name of the module being updated, for logging
+    :return: whether a full retrain is recommended
+    """
+    y = np.asarray(y)
+    accuracy = np.mean(classifier.predict(X) == y)
+
+    seen_features = np.array(state["seen_features"], dtype=np.int64)
+    new_features = np.setdiff1d(np.unique(X.indices), seen_features)
+    state["seen_features"] = np.union1d(seen_features, new_features).tolist()
+    state["new_features"] += len(new_features)
+
+    known = np.isin(y, classifier.classes_)
+    if known.any():
+        classifier.partial_fit(X[known], y[known])
+
+    growth = state["new_features"] / max(state["baseline_features"], 1)
+    print(f"{name}: Updated on {known.sum()} rows "
+          f"(accuracy before update {accuracy:.4f}, "
+          f"baseline {state['baseline_accuracy']:.4f}; "
+          f"feature growth {growth:.1%})")
+
+    reasons = []
+    if state["baseline_accuracy"] - accuracy > DRIFT_THRESHOLD:
+        reasons.append("accuracy drifted")
+    if growth > FEATURE_GROWTH_THRESHOLD:
+        reasons.append("too many new features")
+    if not known.all():
+        reasons.append(f"{(~known).sum()} rows have unseen labels")
+
+    if reasons:
+        print(f"{name}: Full retrain recommended ({', '.join(reasons)})")
+    return bool(reasons)
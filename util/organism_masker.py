@@ -0,0 +1,230 @@
+import json
+from collections import deque
+
+
+# below this many organism names, calling str.replace once per name is cheaper
+# than scanning the description character by character in Python
+DIRECT_REPLACE_LIMIT = 8
+
+
+class OrganismMasker:
+    def __init__(self, lexicon=()):
+        """
+        Returns a new OrganismMasker, which replaces organism names in
+        result_full_descriptions with "_ORGANISM_" using an Aho-Corasick
+        automaton, so that each description is scanned once no matter how many
+        organism names are searched for.
+        :param lexicon: an Iterable of lowercase organism names to always search
+        for, e.g.: the result of build_lexicon
+        """
+        self.patterns = []     # the ith element is the text of pattern i
+        self._ids = {}         # maps pattern text to pattern id
+        self._lexicon = []     # ids of the global lexicon's patterns
+
+        self._goto = [{}]      # the ith element maps characters to states
+        self._fail = [0]
+        self._ends = [()]      # ids of the patterns ending exactly here
+        self._outputs = [()]   # ids of all patterns ending here
+        self._built = True
+
+        for pattern in lexicon:
+            self._lexicon.append(self.add(pattern))
+
+        # longest organism names first, like replace_organisms
+        self._lexicon = sorted(set(self._lexicon),
+                               key=lambda pid: -len(self.patterns[pid]))
+        self._lexicon_ranks = {
+            pid: (-len(self.patterns[pid]), 1, index)
+            for index, pid in enumerate(self._lexicon)
+        }
+        self._lexicon_unsafe = any(
+            _is_unsafe(self.patterns[pid]) for pid in self._lexicon)
+
+    @staticmethod
+    def from_candidates(candidates_strs):
+        """
+        Returns a new OrganismMasker whose lexicon contains every organism name
+        matched by MetaMap in the given candidates.
+        :param candidates_strs: an Iterable of JSON strings containing MetaMap
+        candidates information, e.g.: the candidates column of dbo.metamap
+        :return: a new OrganismMasker
+        """
+        return OrganismMasker(build_lexicon(candidates_strs))
+
+    def add(self, pattern):
+        """
+        Adds the given pattern to this OrganismMasker's automaton, if it is not
+        already there. Does not add it to the global lexicon.
+        :param pattern: the lowercase text to search for
+        :return: the id of the pattern
+        """
+        pid = self._ids.get(pattern)
+        if pid is not None:
+            return pid
+
+        pid = len(self.patterns)
+        self.patterns.append(pattern)
+        self._ids[pattern] = pid
+
+        state = 0
+        for char in pattern:
+            next_state = self._goto[state].get(char)
+            if next_state is None:
+                next_state = len(self._goto)
+                self._goto.append({})
+                self._fail.append(0)
+                self._ends.append(())
+                self._outputs.append(())
+                self._goto[state][char] = next_state
+            state = next_state
+        self._ends[state] += (pid,)
+
+        self._built = False
+        return pid
+
+    def _build(self):
+        """
+        Computes the failure links of the automaton with a breadth-first
+        traversal, merging each state's outputs with its failure state's.
+        :return: None
+        """
+        queue = deque()
+        for state in self._goto[0].values():
+            self._fail[state] = 0
+            self._outputs[state] = self._ends[state]
+            queue.append(state)
+
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self._goto[state].items():
+                fail = self._fail[state]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                fail = self._goto[fail].get(char, 0)
+
+                self._fail[next_state] = fail
+                self._outputs[next_state]\
+                    = self._ends[next_state] + self._outputs[fail]
+                queue.append(next_state)
+
+        self._built = True
+
+    def _occurrences(self, text, *ranks):
+        """
+        Finds every occurrence of the ranked patterns in the given text in a
+        single pass.
+        :param text: the string to search
+        :param ranks: Dicts mapping the ids of the patterns to search for to
+        their priorities (lower ranks are replaced first); the first Dict
+        containing a pattern determines its priority
+        :return: a List of (rank, start, end) Tuples
+        """
+        if not self._built:
+            self._build()
+
+        goto = self._goto
+        fail = self._fail
+        outputs = self._outputs
+        patterns = self.patterns
+
+        occurrences = []
+        state = 0
+        for index, char in enumerate(text):
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+
+            for pid in outputs[state]:
+                for _ranks in ranks:
+                    rank = _ranks.get(pid)
+                    if rank is not None:
+                        end = index + 1
+                        occurrences.append(
+                            (rank, end - len(patterns[pid]), end))
+                        break
+
+        return occurrences
+
+    def mask(self, result_full_description, matchings=None):
+        """
+        Replaces organism names in the given string with "_ORGANISM_".
+        Longer names are replaced first; a name is not replaced where it
+        overlaps a longer name that has already been replaced. The result is
+        identical to calling str.replace once per name, from longest to
+        shortest.
+        :param result_full_description: the string to replace organism names in
+        :param matchings: a List of lowercase text fragments MetaMap matched to
+        organisms in this string, sorted from longest to shortest, to replace
+        in addition to this OrganismMasker's lexicon
+        :return: the string after replacing organism names
+        """
+        matchings = list(matchings or [])
+        if not matchings and not self._lexicon:
+            return result_full_description
+
+        # fragments containing "_" could match text that an earlier
+        # replacement introduced, which a single pass cannot reproduce
+        if len(matchings) + len(self._lexicon) < DIRECT_REPLACE_LIMIT\
+                or self._lexicon_unsafe\
+                or any(_is_unsafe(text) for text in matchings):
+            ranked = matchings + [self.patterns[pid] for pid in self._lexicon]
+            if matchings and self._lexicon:
+                ranked.sort(key=len, reverse=True)
+
+            for text in ranked:
+                result_full_description = result_full_description.replace(
+                    text, "_ORGANISM_")
+            return result_full_description
+
+        # among fragments of equal length, the row's own matchings come first
+        ranks = {}
+        for index, text in enumerate(matchings):
+            ranks.setdefault(self.add(text), (-len(text), 0, index))
+
+        occurrences = self._occurrences(
+            result_full_description, ranks, self._lexicon_ranks)
+        occurrences.sort()
+
+        covered = bytearray(len(result_full_description))
+        spans = []
+        for _, start, end in occurrences:
+            if not any(covered[start:end]):
+                covered[start:end] = b"\x01" * (end - start)
+                spans.append((start, end))
+        spans.sort()
+
+        pieces = []
+        position = 0
+        for start, end in spans:
+            pieces.append(result_full_description[position:start])
+            pieces.append("_ORGANISM_")
+            position = end
+        pieces.append(result_full_description[position:])
+
+        return "".join(pieces)
+
+
+def _is_unsafe(text):
+    """
+    Returns True iff the given text fragment cannot be replaced in a single
+    pass, because it is empty or could match part of "_ORGANISM_".
+    :param text: a lowercase text fragment
+    :return: whether the text fragment is unsafe to replace in a single pass
+    """
+    return not text or "_" in text
+
+
+def build_lexicon(candidates_strs):
+    """
+    Collects every organism name matched by MetaMap in the given candidates
+    into a lexicon for OrganismMasker.
+    :param candidates_strs: an Iterable of JSON strings containing MetaMap
+    candidates information
+    :return: a Set of lowercase matched text fragments
+    """
+    lexicon = set()
+    for candidates_str in set(candidates_strs):
+        candidates_dict = json.loads(candidates_str)
+        lexicon.update(text.lower() for value in candidates_dict.values()
+                       for text in value["matched"])
+    return lexicon
@@ -0,0 +1,71 @@
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+
+class Pipeline:
+    def __init__(self):
+        """
+        Returns a new, empty Pipeline. A Pipeline runs tasks in a process pool,
+        starting each task as soon as the tasks it depends on have finished,
+        so that independent branches run concurrently.
+        """
+        self._tasks = {}   # maps task names to (function, args, dependencies)
+
+    def add(self, name, function, *args, depends_on=()):
+        """
+        Adds a task to this Pipeline. The task calls the given function with
+        the given arguments, followed by the results of the tasks it depends on
+        in the given order.
+        :param name: the unique name of the task
+        :param function: a picklable (top-level) function
+        :param args: the arguments to pass to the function
+        :param depends_on: the names of the tasks whose results to pass to the
+        function
+        :return: this Pipeline
+        """
+        if name in self._tasks:
+            raise ValueError(f"Pipeline already has a task named {name}.")
+
+        self._tasks[name] = (function, args, tuple(depends_on))
+        return self
+
+    def run(self, max_workers=None):
+        """
+        Runs all tasks in this Pipeline. Raises a ValueError if a task depends
+        on a task that does not exist, or if the dependencies form a cycle.
+        :param max_workers: the maximum number of worker processes; leave this
+        parameter default to use one per CPU
+        :return: a Dict mapping task names to their results
+        """
+        for name, (_, _, depends_on) in self._tasks.items():
+            for dependency in depends_on:
+                if dependency not in self._tasks:
+                    raise ValueError(
+                        f"Task {name} depends on unknown task {dependency}.")
+
+        results = {}
+        pending = dict(self._tasks)
+        running = {}   # maps futures to task names
+
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            while pending or running:
+                for name, (function, args, depends_on) in list(pending.items()):
+                    if all(dependency in results for dependency in depends_on):
+                        dependency_results = [results[dependency]
+                                              for dependency in depends_on]
+                        future = executor.submit(
+                            function, *args, *dependency_results)
+                        running[future] = name
+                        del pending[name]
+
+                if not running:
+                    raise ValueError(
+                        "Pipeline tasks have cyclic dependencies: "
+                        + ", ".join(pending))
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    results[name] = future.result()
+                    print(f"Pipeline: Finished task {name}")
+
+        return results
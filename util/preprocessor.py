@@ -1,8 +1,16 @@
-import json
 import re
+from itertools import chain
 
+from util.candidates import DECODED, load_matchings
+from util.organism_masker import OrganismMasker
 
-def preprocess(df, organisms=False):
+
+_SYMBOLS = re.compile(r"[^a-zA-Z0-9 |]")
+_SPACES = re.compile(r" +")
+_NUMBERS = re.compile(r"(?<![^ ])[0-9]+(?![^ ])")
+
+
+def preprocess(df, organisms=False, masker=None):
     """
     Preprocesses the data in the given DataFrame.
     Preprocesses result_full_descriptions:
@@ -15,33 +23,59 @@ def preprocess(df, organisms=False):
       "test_outcome", "level_1", "level_2"} in the given DataFrame to lowercase.
       Skips a label column if it does not exist in the DataFrame.
     :param df: the DataFrame to preprocess
-    - required columns: {"result_full_description", "candidates" (if organisms
-      is True)}
+    - required columns: {"result_full_description", "candidates" or
+      "candidates_decoded" (if organisms is True)}
     - optional columns: {"test_performed", "test_outcome", "level_1", "level_2"}
     :param organisms: whether to replace organism names in the
     result_full_descriptions with "_ORGANISM_"
+    :param masker: an OrganismMasker whose lexicon is also replaced in every
+    row if organisms is True; leave this parameter default to only replace the
+    organism names MetaMap matched in each row
     :return: the preprocessed DataFrame
     - columns: the same as the columns of the given DataFrame
     """
     df = df.copy()   # don't mutate the original DataFrame
 
-    df["result_full_description"] = df["result_full_description"].apply(
-        lambda rfd: replace_numbers(remove_symbols(rfd.lower()))
-    )
+    df["result_full_description"] = normalize_descriptions(
+        df["result_full_description"])
 
     if organisms:
-        def helper(row):
-            return replace_organisms(
-                row["result_full_description"],
-                row["candidates"]
+        if DECODED in df.columns:
+            df["result_full_description"] = mask_organisms_batch(
+                df["result_full_description"],
+                [candidates.matchings for candidates in df[DECODED]],
+                masker
+            )
+        else:
+            df["result_full_description"] = replace_organisms_batch(
+                df["result_full_description"],
+                df["candidates"],
+                masker
             )
-
-        df["result_full_description"] = df.apply(helper, axis=1)
 
     df = labels_to_lowercase(df)
     return df
 
 
+def normalize_descriptions(result_full_descriptions):
+    """
+    Converts the given result_full_descriptions to lowercase, removes symbols
+    from them and replaces their purely-numeric words with "_NUMBER_", using
+    vectorized string operations over the whole Series. The output is identical
+    to calling replace_numbers(remove_symbols(rfd.lower())) on each element.
+    :param result_full_descriptions: a Series of result_full_description strings
+    :return: a Series containing the normalized strings
+    """
+    # after remove_symbols, spaces are the only whitespace left; collapsing and
+    # stripping them is equivalent to the split/join in replace_numbers
+    return result_full_descriptions\
+        .str.lower()\
+        .str.replace(_SYMBOLS, "", regex=True)\
+        .str.replace(_SPACES, " ", regex=True)\
+        .str.strip(" ")\
+        .str.replace(_NUMBERS, "_NUMBER_", regex=True)
+
+
 def remove_symbols(result_full_description):
     """
     Removes all characters that are not letters, numbers, spaces, or pipes from
@@ -49,7 +83,7 @@ def remove_symbols(result_full_description):
     :param result_full_description: the string to remove symbols from
     :return: the string after removing symbols
     """
-    return re.sub(r"[^a-zA-Z0-9 |]", "", result_full_description)
+    return _SYMBOLS.sub("", result_full_description)
 
 
 def replace_numbers(result_full_description):
@@ -75,16 +109,82 @@ def replace_organisms(result_full_description, candidates_str):
     information
     :return: the result_full_description string after replacing organism names
     """
-    result = result_full_description
+    return _mask_organisms(
+        result_full_description, load_matchings(candidates_str))
 
-    candidates_dict = json.loads(candidates_str)
-    matchings = [text.lower() for _, value in candidates_dict.items()
-                 for text in value["matched"]]
-    matchings.sort(key=len, reverse=True)
 
-    for text in matchings:
-        result = result.replace(text.lower(), "_ORGANISM_")
+def replace_organisms_batch(result_full_descriptions, candidates_strs,
+                            masker=None):
+    """
+    Replaces all organism names in the given result_full_description strings
+    with "_ORGANISM_". Each distinct candidates JSON string is only decoded
+    once, no matter how many rows share it, and all matched organism names are
+    searched for with one OrganismMasker automaton.
+    :param result_full_descriptions: an Iterable of result_full_description
+    strings to replace organism names in
+    :param candidates_strs: an Iterable of JSON strings containing MetaMap
+    candidates information; the ith string belongs to the ith description
+    :param masker: an OrganismMasker whose lexicon is also replaced in every
+    string; leave this parameter default to only replace the organism names
+    MetaMap matched in each string
+    :return: a List of result_full_description strings after replacing organism
+    names
+    """
+    matchings_cache = {}
+    all_matchings = []
+    for candidates_str in candidates_strs:
+        matchings = matchings_cache.get(candidates_str)
+        if matchings is None:
+            matchings = load_matchings(candidates_str)
+            matchings_cache[candidates_str] = matchings
+        all_matchings.append(matchings)
+
+    return mask_organisms_batch(
+        result_full_descriptions, all_matchings, masker)
 
+
+def mask_organisms_batch(result_full_descriptions, all_matchings,
+                         masker=None):
+    """
+    Replaces the given matched text fragments in the given
+    result_full_description strings with "_ORGANISM_", searching for all of
+    them with one OrganismMasker automaton.
+    :param result_full_descriptions: an Iterable of result_full_description
+    strings to replace organism names in
+    :param all_matchings: an Iterable whose ith element is the sequence of
+    lowercase text fragments MetaMap matched to organisms in the ith string,
+    sorted from longest to shortest
+    :param masker: an OrganismMasker whose lexicon is also replaced in every
+    string; leave this parameter default to only replace the given fragments
+    :return: a List of result_full_description strings after replacing organism
+    names
+    """
+    if masker is None:
+        masker = OrganismMasker()
+
+    all_matchings = list(all_matchings)
+    for text in set(chain.from_iterable(all_matchings)):
+        masker.add(text)
+
+    return [
+        masker.mask(result_full_description, matchings)
+        for result_full_description, matchings
+        in zip(result_full_descriptions, all_matchings)
+    ]
+
+
+def _mask_organisms(result_full_description, matchings):
+    """
+    Replaces every occurrence of each of the given text fragments in the given
+    string with "_ORGANISM_", in the given order.
+    :param result_full_description: the string to replace organism names in
+    :param matchings: a List of lowercase text fragments, sorted from longest to
+    shortest
+    :return: the string after replacing organism names
+    """
+    result = result_full_description
+    for text in matchings:
+        result = result.replace(text, "_ORGANISM_")
     return result
 
 
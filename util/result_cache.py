@@ -0,0 +1,125 @@
+import weakref
+
+import pandas as pd
+
+from util.get_keys import get_keys
+
+
+class ResultCache:
+    # every live ResultCache, so that retraining a module can invalidate its
+    # results wherever they are cached
+    _instances = weakref.WeakSet()
+
+    def __init__(self):
+        """
+        Returns a new, empty ResultCache. A ResultCache holds the
+        classification results of each module it is passed to, keyed by
+        (test_key, result_key[, obs_seq_nbr]), so that modules classifying the
+        same rows during one run (e.g.: a Level1SymbolicModule and the
+        TestOutcomeModule it refers to) only compute each prediction once.
+        Create one ResultCache per run; it assumes that rows with the same keys
+        have the same data.
+        """
+        # maps (module id, observations, variant) to (module, results); the
+        # module is kept so that its id is not reused while the entry exists
+        self._entries = {}
+        ResultCache._instances.add(self)
+
+    def get(self, module, raw_df, observations, classify, variant=()):
+        """
+        Returns the given module's classification results for the given data,
+        only classifying the rows whose results are not cached yet.
+        :param module: the module classifying the data
+        :param raw_df: the DataFrame to classify
+        - required columns: {"test_key", "result_key", "obs_seq_nbr" (if
+          observations is True)}, plus the columns required by classify
+        :param observations: True if the data is given at the observation level,
+        False if the data is given at the test level
+        :param classify: a 1-argument lambda that takes in a DataFrame and
+        returns the module's uncached classification results for it
+        :param variant: a hashable value identifying any other classification
+        options that change the results (e.g.: return_all)
+        :return: a DataFrame containing the classification results
+        - columns: the columns returned by classify
+        """
+        keys = get_keys(observations)
+        entry_key = (id(module), observations, variant)
+
+        entry = self._entries.get(entry_key)
+        if entry is None:
+            results = classify(raw_df)
+            self._entries[entry_key]\
+                = (module, results.drop_duplicates(subset=keys))
+            return results
+
+        _, cached = entry
+
+        is_cached = _key_index(raw_df, keys).isin(_key_index(cached, keys))
+        if not is_cached.all():
+            results = classify(raw_df[~is_cached])
+            cached = pd.concat([cached, results], ignore_index=True)\
+                .drop_duplicates(subset=keys)
+            self._entries[entry_key] = (module, cached)
+
+        return pd.merge(raw_df.loc[:, keys], cached, how="inner", on=keys)
+
+    def put(self, module, results, observations=False, variant=()):
+        """
+        Adds the given classification results of the given module to this
+        ResultCache, e.g.: results computed in another process.
+        :param module: the module that computed the results
+        :param results: a DataFrame containing the module's classification
+        results
+        - required columns: {"test_key", "result_key", "obs_seq_nbr" (if
+          observations is True)}
+        :param observations: True if the results are at the observation level,
+        False if they are at the test level
+        :param variant: a hashable value identifying any other classification
+        options that changed the results (e.g.: return_all)
+        :return: None
+        """
+        keys = get_keys(observations)
+        entry_key = (id(module), observations, variant)
+
+        entry = self._entries.get(entry_key)
+        if entry is not None:
+            results = pd.concat([entry[1], results], ignore_index=True)
+
+        self._entries[entry_key]\
+            = (module, results.drop_duplicates(subset=keys))
+
+    def invalidate(self, module=None):
+        """
+        Removes the cached results of the given module from this ResultCache.
+        :param module: the module whose results to remove; leave this parameter
+        default to remove all cached results
+        :return: None
+        """
+        if module is None:
+            self._entries.clear()
+            return
+
+        for entry_key in list(self._entries):
+            if entry_key[0] == id(module):
+                del self._entries[entry_key]
+
+
+def invalidate(module):
+    """
+    Removes the cached results of the given module from every ResultCache.
+    Modules call this when they are retrained or their state is reloaded.
+    :param module: the module whose results to remove
+    :return: None
+    """
+    for cache in list(ResultCache._instances):
+        cache.invalidate(module)
+
+
+def _key_index(df, keys):
+    """
+    Returns an Index of the key tuples of the given DataFrame's rows.
+    :param df: the DataFrame to index
+    :param keys: the names of the key columns
+    :return: a MultiIndex whose ith element is the ith row's key tuple
+    """
+    return pd.MultiIndex.from_arrays([df[key] for key in keys])
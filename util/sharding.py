@@ -0,0 +1,117 @@
+import os
+from multiprocessing import Pool
+
+import joblib
+import numpy as np
+import pandas as pd
+
+
+# the number of shards per worker process; more shards than workers balance
+# the load when some shards take longer than others
+SHARDS_PER_WORKER = 4
+
+# the minimum number of rows per shard, below which the cost of sending a
+# shard to a worker outweighs the cost of classifying it
+MIN_SHARD_ROWS = 2000
+
+
+# the module classifying shards in this worker process, set by _init_worker
+_module = None
+
+
+def classify_sharded(module, raw_df, observations, n_jobs):
+    """
+    Classifies the given data with the given trained module in a pool of
+    worker processes. The rows are split into contiguous shards, each worker
+    loads the module once when it starts and classifies whole shards with it,
+    and the shards' results are concatenated in input order. A module loaded
+    from or saved to an artifact directory (see util.artifact) is loaded from
+    it in each worker, so the workers memory-map the same vocabulary and
+    coefficients instead of each receiving a pickled copy of them; any other
+    module is pickled to each worker. Every row is classified independently
+    of the other rows in its shard, so the results are identical to
+    classifying the data in this process, for any n_jobs.
+    Classifies the data in this process if it is too small to shard (see
+    MIN_SHARD_ROWS).
+    :param module: a trained TestPerformedModule, TestOutcomeModule or
+    Level1MLModule
+    :param raw_df: a DataFrame containing the raw test data
+    :param observations: True if the data is given at the observation level,
+    False if the data is given at the test level
+    :param n_jobs: the number of worker processes; negative values count back
+    from the number of CPUs, like joblib (e.g.: -1 uses one per CPU)
+    :return: a DataFrame containing the classification results, in the order
+    of the given rows
+    """
+    n_workers = get_n_workers(n_jobs)
+    n_shards = min(n_workers * SHARDS_PER_WORKER,
+                   raw_df.shape[0] // MIN_SHARD_ROWS)
+
+    if n_workers == 1 or n_shards <= 1:
+        return module._classify(raw_df, observations)
+
+    bounds = np.linspace(0, raw_df.shape[0], n_shards + 1).astype(int)
+    shards = [raw_df.iloc[start:stop]
+              for start, stop in zip(bounds[:-1], bounds[1:])]
+
+    n_workers = min(n_workers, n_shards)
+    print(f"{module.__class__.__name__}: Classifying {raw_df.shape[0]} rows "
+          f"in {n_shards} shards on {n_workers} workers")
+
+    if module.artifact_dirpath is not None:
+        initargs = (module.__class__, module.artifact_dirpath, None)
+    else:
+        initargs = (None, None, module)
+
+    with Pool(n_workers, initializer=_init_worker, initargs=initargs) as pool:
+        # map returns the results in the order of the shards
+        results = pool.map(
+            _classify_shard, [(shard, observations) for shard in shards],
+            chunksize=1)
+
+    return pd.concat(results)
+
+
+def get_n_workers(n_jobs):
+    """
+    Returns the number of worker processes that the given n_jobs stands for.
+    :param n_jobs: a positive number of worker processes, or a negative number
+    counting back from the number of CPUs (-1 for all of them)
+    :return: the number of worker processes
+    """
+    if n_jobs == 0:
+        raise ValueError("n_jobs must not be 0.")
+    if n_jobs < 0:
+        return max(1, os.cpu_count() + 1 + n_jobs)
+    return n_jobs
+
+
+def _init_worker(module_class, dirpath, module):
+    """
+    Loads or stores the module the shards are classified with in this worker
+    process.
+    :param module_class: the class of the module to load from its artifact
+    directory, or None
+    :param dirpath: the path to the module's artifact directory, or None
+    :param module: the trained module passed to classify_sharded, if it has no
+    artifact directory; None otherwise
+    :return: None
+    """
+    global _module
+    if dirpath is not None:
+        _module = module_class.load_from_artifact(dirpath)
+    else:
+        _module = module
+
+
+def _classify_shard(args):
+    """
+    Classifies one shard in a worker process. Classifiers that parallelize
+    their own predictions (e.g.: a RandomForestClassifier with n_jobs=-1) run
+    sequentially, since the workers already use every CPU they were given.
+    :param args: the shard's raw test data; the observations flag
+    :return: a DataFrame containing the shard's classification results
+    """
+    shard, observations = args
+    with joblib.parallel_backend("sequential"):
+        return _module._classify(shard, observations)
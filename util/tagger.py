@@ -1,78 +1,167 @@
-import subprocess
-import time
+from concurrent.futures import ThreadPoolExecutor
+from itertools import chain
 
-from py4j.java_gateway import JavaGateway
+import pandas as pd
+from py4j.protocol import Py4JJavaError, Py4JNetworkError
 
-from root import from_root
 from util.get_keys import get_keys
+from util.metamap_server import MetaMapServer
 
 
-def annotate(df, observations=False, options=""):
+# number of descriptions sent to MetaMap per request
+BATCH_SIZE = 20
+
+# the tags and candidates of rows that MetaMap failed to annotate
+MEMORY_ERROR = "Memory Error"
+CONNECTION_ERROR = "MetaMap Connection Error"
+OTHER_ERROR = "Other Errors"
+ERRORS = {MEMORY_ERROR, CONNECTION_ERROR, OTHER_ERROR}
+
+
+def annotate(df, observations=False, options="", server=None,
+             batch_size=BATCH_SIZE, cache=None):
     """
-    Returns MetaMap annotations for the given DataFrame.
+    Returns MetaMap annotations for the given DataFrame. Only the distinct
+    descriptions that are not in the given cache are sent to MetaMap; their
+    annotations are then copied to every row with the same description. Rows
+    that MetaMap fails to annotate get one of the labels in ERRORS as their
+    tags and candidates, and are not cached.
     :param df: the DataFrame containing the result_full_descriptions to annotate
     - required columns: {"test_key", "result_key", "obs_seq_nbr" (if
       observations is True), "result_full_description"}
     :param observations: True if the data is given at the observation level,
     False if the data is given at the test level
     :param options: MetaMap options; input string of form "-y -D" or "-yD"
+    :param server: a started MetaMapServer to annotate with, or None to attach
+    to (or start) a Java server for this call only
+    :param batch_size: the number of descriptions to send to MetaMap per
+    request
+    :param cache: an AnnotationCache to look up and save annotations in, or
+    None
     :return: a DataFrame containing the MetaMap annotations
     - columns: {"test_key", "result_key", "obs_seq_nbr" (if observations is
       True), "tags", "candidates"}
     """
-    proc = subprocess.Popen(
-        ["java", "-jar", from_root("libs\\MetaMapBuild.jar")],
-        shell=False
-    )
+    descriptions = df["result_full_description"]
+    unique = list(pd.unique(descriptions))
 
-    # initialize variables to suppress PyCharm warnings
-    gateway = None
-    metamap = None
-    api = None
+    annotations = {} if cache is None else cache.get(unique, options)
+    missing = [
+        description for description in unique
+        if description not in annotations
+    ]
 
-    try:
-        connected = False
-        for i in range(5):
-            try:
-                gateway = JavaGateway()
-                metamap = gateway.entry_point
-                api = metamap.getApi()
+    print(f"Annotating {len(missing)} new descriptions "
+          f"({len(unique)} distinct descriptions in {len(descriptions)} rows)")
 
-                connected = True
-                print(f"Connected to Java server on attempt {i + 1}")
-                break
-            except:
-                time.sleep(1)
+    if missing:
+        new_annotations = annotate_descriptions(
+            missing, options, server, batch_size)
+        annotations.update(zip(missing, new_annotations))
 
-        if not connected:
-            raise Exception("Error connecting to Java server")
+        if cache is not None:
+            cache.put(
+                (description, tags, candidates)
+                for description, (tags, candidates)
+                in zip(missing, new_annotations)
+                if tags not in ERRORS
+            )
 
-        tags = []
-        candidates = []
+    keys = get_keys(observations)
 
-        if options.strip():
-            # Process a string with additional options string
-            api.setOptions(options + " -c")
-        else:
-            # Process a string without additional options string
-            api.setOptions("-c")
+    return_value = df.loc[:, keys]
+    return_value["tags"] = [
+        annotations[description][0] for description in descriptions
+    ]
+    return_value["candidates"] = [
+        annotations[description][1] for description in descriptions
+    ]
+
+    return return_value
+
+
+def annotate_descriptions(descriptions, options="", server=None,
+                          batch_size=BATCH_SIZE):
+    """
+    Returns MetaMap annotations for the given descriptions. The descriptions
+    are sent to MetaMap in batches, which are spread across the server's pool
+    of MetaMap API connections by a thread pool. If a batch fails, its
+    descriptions are sent one at a time, and the descriptions that still fail
+    are labelled with an error from ERRORS, as in tagger_no_observations.
+    :param descriptions: a List of result_full_descriptions to annotate
+    :param options: MetaMap options; input string of form "-y -D" or "-yD"
+    :param server: a started MetaMapServer to annotate with, or None to attach
+    to (or start) a Java server for this call only
+    :param batch_size: the number of descriptions to send to MetaMap per
+    request
+    :return: a List whose ith element is the (tags JSON string, candidates
+    JSON string) Tuple of the ith description, or (error, error) if the ith
+    description failed
+    """
+    if server is None:
+        with MetaMapServer() as server:
+            return annotate_descriptions(
+                descriptions, options, server, batch_size)
+
+    def annotate_batch(batch):
+        with server.connection() as connection:
+            connection.set_options(options)
+
+            try:
+                return connection.process_batch(batch)
+            except Py4JNetworkError:
+                # the Java server went away; retry once on a new connection
+                try:
+                    server.reconnect(connection)
+                    return connection.process_batch(batch)
+                except Exception:
+                    pass
+            except Py4JJavaError:
+                pass
 
-        for description in df["result_full_description"]:
-            result = api.processCitationsFromString(description).get(0)
+            # one request per row, so that a failing description only fails
+            # its own row
+            return [
+                _annotate_row(server, connection, description)
+                for description in batch
+            ]
 
-            # parse result from MetaMap to tags and candidates
-            tags.append(metamap.formatOneResultToString(result, "tags"))
-            candidates.append(
-                metamap.formatOneResultToString(result, "candidates"))
+    batches = [
+        descriptions[start:start + batch_size]
+        for start in range(0, len(descriptions), batch_size)
+    ]
 
-        keys = get_keys(observations)
+    with ThreadPoolExecutor(max_workers=server.pool_size) as executor:
+        return list(chain.from_iterable(executor.map(annotate_batch, batches)))
 
-        return_value = df.loc[:, keys]
-        return_value["tags"] = tags
-        return_value["candidates"] = candidates
 
-        return return_value
-    finally:
-        if gateway is not None:
-            gateway.shutdown()
-        proc.terminate()
+def _annotate_row(server, connection, description):
+    """
+    Returns the MetaMap annotations of the given description, or an error
+    label from ERRORS if MetaMap fails to annotate it.
+    :param server: the MetaMapServer the connection belongs to
+    :param connection: the MetaMapConnection to annotate with
+    :param description: the result_full_description to annotate
+    :return: the (tags JSON string, candidates JSON string) Tuple, or
+    (error, error)
+    """
+    try:
+        return connection.process(description)
+    except Py4JJavaError as e:
+        error_msg = str(e.java_exception.getMessage())
+        if "Index 0 out-of-bounds for length 0" in error_msg:
+            error = MEMORY_ERROR
+        elif "Connection refused" in error_msg:
+            error = CONNECTION_ERROR
+        else:
+            error = OTHER_ERROR
+    except Py4JNetworkError:
+        error = CONNECTION_ERROR
+        try:
+            server.reconnect(connection)
+        except Exception:
+            pass
+    except Exception:
+        error = OTHER_ERROR
+
+    return error, error
@@ -44,3 +44,21 @@ def _timer_helper(module_factory, df):
     module.retrain(df)
 
     return (datetime.now() - start_time).total_seconds()
+
+
+def time_call(function, repeats=3):
+    """
+    Returns the best runtime of calling the given function, out of the given
+    number of repeats.
+    :param function: the 0-argument function to benchmark
+    :param repeats: the number of times to call the function
+    :return: the shortest of the measured runtimes, in seconds
+    """
+    times = []
+
+    for _ in range(repeats):
+        start_time = datetime.now()
+        function()
+        times.append((datetime.now() - start_time).total_seconds())
+
+    return min(times)
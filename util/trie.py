@@ -0,0 +1,59 @@
+class WordTrie:
+    def __init__(self, phrases=()):
+        """
+        Returns a new WordTrie, a set of phrases indexed word by word so that
+        the longest phrase prefixing a sequence of words can be found in a
+        single walk.
+        :param phrases: an Iterable of phrases to add to the WordTrie
+        """
+        self._phrases = set()
+        self._root = {}
+
+        for phrase in phrases:
+            self.add(phrase)
+
+    def add(self, phrase):
+        """
+        Adds the given phrase to this WordTrie.
+        :param phrase: the phrase to add
+        :return: None
+        """
+        self._phrases.add(phrase)
+
+        words = phrase.split()
+        if not words or " ".join(words) != phrase:
+            # such a phrase never equals a prefix of words joined by single
+            # spaces, so it is kept for membership tests only
+            return
+
+        node = self._root
+        for word in words:
+            node = node.setdefault(word, {})
+        node[None] = phrase
+
+    def longest_prefix(self, words):
+        """
+        Returns the longest phrase in this WordTrie that is equal to
+        " ".join(words[:i]) for some i >= 1, or None if there is no such phrase.
+        :param words: a List of words, e.g.: from str.split
+        :return: the longest phrase prefixing the given words, or None
+        """
+        longest = None
+
+        node = self._root
+        for word in words:
+            node = node.get(word)
+            if node is None:
+                break
+            longest = node.get(None, longest)
+
+        return longest
+
+    def __contains__(self, phrase):
+        return phrase in self._phrases
+
+    def __iter__(self):
+        return iter(self._phrases)
+
+    def __len__(self):
+        return len(self._phrases)
@@ -1,4 +1,22 @@
-def vectorize(vectorizer, documents):
+from collections import Counter
+from numbers import Integral
+
+import numpy as np
+import scipy.sparse as sp
+from joblib import Parallel, delayed
+
+from sklearn.feature_extraction.text import CountVectorizer, HashingVectorizer
+
+
+# the number of columns of the vectorizers returned by get_hashing_vectorizer
+HASH_FEATURES = 2 ** 16
+
+# the number of documents per chunk when a stateless vectorizer transforms
+# documents in parallel
+TRANSFORM_CHUNKSIZE = 10000
+
+
+def vectorize(vectorizer, documents, cache=None):
     """
     Fits the given vectorizer on the given documents. bi/tri/n-grams that span
     across a pipe character (e.g.: the trigram "not performed | Accession") will
@@ -7,19 +25,548 @@ def vectorize(vectorizer, documents):
     vocabulary.
     :param vectorizer: the vectorizer to fit and transform the documents
     :param documents: an Iterable of result_full_description strings
+    :param cache: a FeatureCache to reuse the tokenized documents from, or None
+    to tokenize the documents with the vectorizer
     :return: the sparse matrix feature representation of the documents;
              a List whose jth element is the feature represented by the jth
-             column of the sparse matrix;
-             a Dict mapping feature names to column indices
+             column of the sparse matrix (None for a HashingVectorizer);
+             a Dict mapping feature names to column indices (None for a
+             HashingVectorizer)
     """
-    phrases = []
-    for document in documents:
-        phrases.extend(document.split("|"))
+    if isinstance(vectorizer, HashingVectorizer):
+        # a HashingVectorizer is stateless, so there is no vocabulary to fit;
+        # see get_hashing_vectorizer for how it respects pipe characters
+        return vectorizer.transform(documents), None, None
+
+    if cache is not None and cache.supports(vectorizer):
+        X = cache.fit_transform(vectorizer, documents)
+    else:
+        phrases = []
+        for document in documents:
+            phrases.extend(document.split("|"))
+
+        vectorizer.fit(phrases)
 
-    vectorizer.fit(phrases)
+        X = vectorizer.transform(documents)
 
-    X = vectorizer.transform(documents)
     feature_names = vectorizer.get_feature_names()
     vocabulary = vectorizer.vocabulary_
 
     return X, feature_names, vocabulary
+
+
+def transform(vectorizer, documents, cache=None, n_jobs=1):
+    """
+    Transforms the given documents into a sparse matrix feature representation
+    based on the given vectorizer's vocabulary.
+    :param vectorizer: the fitted vectorizer (or vectorizer with a fixed
+    vocabulary) to transform the documents with
+    :param documents: an Iterable of result_full_description strings
+    :param cache: a FeatureCache to reuse the tokenized documents from, or None
+    to tokenize the documents with the vectorizer
+    :param n_jobs: the number of worker processes to transform chunks of
+    TRANSFORM_CHUNKSIZE documents with, if the vectorizer is a stateless
+    HashingVectorizer; -1 uses one worker per CPU
+    :return: the sparse matrix feature representation of the documents
+    """
+    if cache is not None and cache.supports(vectorizer):
+        return cache.transform(vectorizer, documents)
+
+    if n_jobs != 1 and isinstance(vectorizer, HashingVectorizer):
+        documents = list(documents)
+        if len(documents) > TRANSFORM_CHUNKSIZE:
+            with Parallel(n_jobs=n_jobs) as parallel:
+                chunks = parallel(
+                    delayed(vectorizer.transform)(
+                        documents[start:start + TRANSFORM_CHUNKSIZE])
+                    for start in range(
+                        0, len(documents), TRANSFORM_CHUNKSIZE)
+                )
+            return sp.vstack(chunks, format="csr")
+
+    return vectorizer.transform(documents)
+
+
+def get_hashing_vectorizer(ngram_range=(1, 1), n_features=HASH_FEATURES):
+    """
+    Returns a new HashingVectorizer that counts the word n-grams of
+    result_full_descriptions in hashed columns. Like vectorize, it does not
+    count n-grams that span across a pipe character (a CountVectorizer fitted
+    by vectorize still counts them if they also occur within a phrase). It
+    needs no fitting, and pickles to a few hundred bytes.
+    :param ngram_range: the (min_n, max_n) range of n-gram lengths to count
+    :param n_features: the number of columns to hash the n-grams into
+    :return: a new HashingVectorizer
+    """
+    return HashingVectorizer(analyzer=PipeAnalyzer(ngram_range),
+                             n_features=n_features, alternate_sign=False,
+                             norm=None)
+
+
+def get_n_features(vectorizer):
+    """
+    Returns the number of columns of the given fitted vectorizer's features.
+    :param vectorizer: a fitted CountVectorizer, HashingVectorizer or
+    MappedVectorizer
+    :return: the vocabulary size, or the number of hashed columns
+    """
+    if isinstance(vectorizer, (HashingVectorizer, MappedVectorizer)):
+        return vectorizer.n_features
+    return len(vectorizer.vocabulary_)
+
+
+class PipeAnalyzer:
+    """
+    A picklable analyzer (see CountVectorizer's analyzer parameter) that
+    splits a document into its pipe-separated phrases, and extracts the word
+    n-grams of each phrase with CountVectorizer's default preprocessing and
+    tokenization.
+    """
+    def __init__(self, ngram_range=(1, 1)):
+        """
+        Returns a new PipeAnalyzer.
+        :param ngram_range: the (min_n, max_n) range of n-gram lengths to
+        extract
+        """
+        self.ngram_range = tuple(ngram_range)
+        self._analyzer = None
+
+    def __call__(self, document):
+        """
+        Returns the n-grams of the given document.
+        :param document: a result_full_description string
+        :return: a List of the n-grams of the document's phrases, in order
+        """
+        if self._analyzer is None:
+            self._analyzer = CountVectorizer(
+                ngram_range=self.ngram_range).build_analyzer()
+
+        ngrams = []
+        for phrase in document.split("|"):
+            ngrams.extend(self._analyzer(phrase))
+        return ngrams
+
+    def __getstate__(self):
+        # the built analyzer is a closure, which cannot be pickled
+        return {"ngram_range": self.ngram_range}
+
+    def __setstate__(self, state):
+        self.ngram_range = state["ngram_range"]
+        self._analyzer = None
+
+    def __repr__(self):
+        return f"PipeAnalyzer(ngram_range={self.ngram_range})"
+
+
+class MappedVectorizer:
+    """
+    A stand-in for a fitted CountVectorizer that looks its vocabulary up with a
+    binary search over a sorted array of terms, instead of a Dict. The arrays
+    can be memory-mapped (see util.artifact), so that processes loading the
+    same vocabulary share one copy of it in the page cache rather than each
+    building its own Dict. transform returns the same matrix as the
+    CountVectorizer it was made from.
+    """
+    def __init__(self, terms, columns, params):
+        """
+        Returns a new MappedVectorizer.
+        :param terms: an array of the vocabulary's terms, in sorted order
+        :param columns: an array whose ith element is the column of the ith
+        term
+        :param params: the parameters of the CountVectorizer, without its
+        vocabulary
+        """
+        self.terms = terms
+        self.columns = columns
+        self.params = params
+        self.n_features = len(terms)
+        self._analyzer = None
+
+    @staticmethod
+    def from_count_vectorizer(vectorizer):
+        """
+        Returns a new MappedVectorizer with the vocabulary and parameters of
+        the given fitted CountVectorizer.
+        :param vectorizer: a fitted CountVectorizer
+        :return: a new MappedVectorizer
+        """
+        params = vectorizer.get_params()
+        del params["vocabulary"]
+
+        features = np.array(vectorizer.get_feature_names(), dtype=str)
+        order = np.argsort(features, kind="stable")
+        return MappedVectorizer(features[order], order, params)
+
+    def transform(self, documents):
+        """
+        Transforms the given documents into the sparse matrix feature
+        representation of the CountVectorizer this MappedVectorizer was made
+        from.
+        :param documents: an Iterable of result_full_description strings
+        :return: a sparse matrix with one row per document and n_features
+        columns
+        """
+        if self._analyzer is None:
+            self._analyzer = CountVectorizer(**self.params).build_analyzer()
+
+        tokens = []
+        lengths = []
+        for document in documents:
+            document_tokens = self._analyzer(document)
+            tokens.extend(document_tokens)
+            lengths.append(len(document_tokens))
+
+        # tokens keep their own width, so that a token longer than every
+        # term is not truncated into a match
+        tokens = np.array(tokens, dtype=str)
+        rows = np.repeat(np.arange(len(lengths)), lengths)
+
+        positions = np.searchsorted(self.terms, tokens)
+        found = positions < len(self.terms)
+        found[found] = self.terms[positions[found]] == tokens[found]
+
+        dtype = self.params.get("dtype", np.int64)
+        X = sp.csr_matrix(
+            (np.ones(found.sum(), dtype=dtype),
+             (rows[found], self.columns[positions[found]])),
+            shape=(len(lengths), self.n_features), dtype=dtype)
+
+        if self.params.get("binary"):
+            X.data.fill(1)
+        X.sort_indices()
+        return X
+
+    def get_feature_names(self):
+        """
+        Returns the vocabulary's terms in column order.
+        :return: a List whose jth element is the term of the jth column
+        """
+        features = np.empty(self.n_features, dtype=self.terms.dtype)
+        features[self.columns] = self.terms
+        return features.tolist()
+
+    def __getstate__(self):
+        # the built analyzer is a closure, which cannot be pickled
+        state = dict(self.__dict__)
+        state["_analyzer"] = None
+        return state
+
+
+class FeatureCache:
+    """
+    Caches the n-gram counts of result_full_descriptions, so that each distinct
+    description is tokenized once, instead of once per cross-validation fold
+    and vectorizer. Fitting a vectorizer through the cache only computes
+    document frequencies from the cached counts, and transforming documents
+    only selects the cached rows and the columns of the vectorizer's
+    vocabulary.
+    Only plain word CountVectorizers (no custom analyzer, tokenizer,
+    preprocessor, stop words, binary counts or max_features) are supported;
+    see supports.
+    """
+    def __init__(self):
+        """
+        Returns a new, empty FeatureCache.
+        """
+        self._tables = []
+
+    @staticmethod
+    def supports(vectorizer):
+        """
+        Returns True iff the given vectorizer's features can be computed from
+        the cache.
+        :param vectorizer: a vectorizer
+        :return: whether the vectorizer is supported
+        """
+        return type(vectorizer) is CountVectorizer\
+            and vectorizer.input == "content"\
+            and vectorizer.analyzer == "word"\
+            and vectorizer.preprocessor is None\
+            and vectorizer.tokenizer is None\
+            and vectorizer.stop_words is None\
+            and vectorizer.max_features is None\
+            and not vectorizer.binary
+
+    def fit_transform(self, vectorizer, documents):
+        """
+        Fits the given vectorizer on the pipe-separated phrases of the given
+        documents, like vectorize, then transforms the documents.
+        Precondition: supports(vectorizer) is True.
+        :param vectorizer: the CountVectorizer to fit
+        :param documents: an Iterable of result_full_description strings
+        :return: the sparse matrix feature representation of the documents
+        """
+        documents = list(documents)
+
+        if vectorizer.vocabulary is not None:
+            # fitting with a fixed vocabulary only validates the vocabulary
+            vectorizer.fit([])
+            return self.transform(vectorizer, documents)
+
+        table = self._get_table(vectorizer)
+        rows = table.lookup(documents)
+        _, phrase_frequencies, phrase_counts = table.get_matrices()
+
+        # document frequencies over the phrases, as CountVectorizer.fit
+        # computes them on the split documents
+        weights = np.bincount(rows, minlength=phrase_frequencies.shape[0])
+        dfs = phrase_frequencies.T.dot(weights)
+        n_doc = phrase_counts[rows].sum()
+
+        low, high = vectorizer.min_df, vectorizer.max_df
+        min_doc_count = low if isinstance(low, Integral) else low * n_doc
+        max_doc_count = high if isinstance(high, Integral) else high * n_doc
+        if max_doc_count < min_doc_count:
+            raise ValueError(
+                "max_df corresponds to < documents than min_df")
+
+        present = (dfs > 0) & table.length_mask(vectorizer.ngram_range)
+        if not present.any():
+            raise ValueError(
+                "empty vocabulary; perhaps the documents only contain stop "
+                "words")
+
+        kept = present & (dfs >= min_doc_count) & (dfs <= max_doc_count)
+        if not kept.any():
+            raise ValueError(
+                "After pruning, no terms remain. Try a lower min_df or a "
+                "higher max_df.")
+
+        terms = sorted(table.terms[index] for index in np.flatnonzero(kept))
+        vectorizer.vocabulary_ = {term: i for i, term in enumerate(terms)}
+        vectorizer.fixed_vocabulary_ = False
+        vectorizer.stop_words_ = {
+            table.terms[index] for index in np.flatnonzero(present & ~kept)
+        }
+
+        return self.transform(vectorizer, documents)
+
+    def transform(self, vectorizer, documents):
+        """
+        Transforms the given documents with the given vectorizer's vocabulary.
+        n-grams in the vocabulary that are outside the vectorizer's
+        ngram_range get all-zero columns, as they do in
+        CountVectorizer.transform.
+        Precondition: supports(vectorizer) is True.
+        :param vectorizer: the fitted CountVectorizer (or CountVectorizer with
+        a fixed vocabulary)
+        :param documents: an Iterable of result_full_description strings
+        :return: the sparse matrix feature representation of the documents
+        """
+        if not hasattr(vectorizer, "vocabulary_"):
+            if vectorizer.vocabulary is None:
+                # raises NotFittedError
+                return vectorizer.transform(documents)
+            vectorizer.fit([])
+
+        table = self._get_table(vectorizer)
+        rows = table.lookup(documents)
+        counts, _, _ = table.get_matrices()
+        columns = table.get_columns(
+            vectorizer.vocabulary_, vectorizer.ngram_range)
+
+        X = counts[rows][:, columns].astype(vectorizer.dtype)
+        X.sort_indices()
+        return X
+
+    def _get_table(self, vectorizer):
+        """
+        Returns the cached _NgramTable that covers the given vectorizer's
+        tokenization and ngram_range, creating a new one if there is none.
+        :param vectorizer: a supported CountVectorizer
+        :return: the _NgramTable
+        """
+        for table in self._tables:
+            if table.covers(vectorizer):
+                return table
+
+        table = _NgramTable(vectorizer)
+        self._tables.append(table)
+        return table
+
+
+class _NgramTable:
+    """
+    The n-gram counts of every document seen so far, for one tokenization and
+    ngram_range. Row i holds the counts of the ith distinct document; column j
+    holds the counts of the jth distinct n-gram. The last column is always
+    zero, for vocabulary terms that are not in the table.
+    """
+    def __init__(self, vectorizer):
+        """
+        Returns a new, empty _NgramTable.
+        :param vectorizer: the supported CountVectorizer whose tokenization and
+        ngram_range to use
+        """
+        self.params = _tokenization_params(vectorizer)
+        self.ngram_range = vectorizer.ngram_range
+        self.terms = []
+
+        self._analyzer = vectorizer.build_analyzer()
+        self._term_ids = {}
+        self._term_lengths = []
+        self._rows = {}
+        self._counts = _SparseRows()
+        self._phrase_frequencies = _SparseRows()
+        self._phrase_counts = []
+        self._matrices = None
+
+    def covers(self, vectorizer):
+        """
+        Returns True iff the given vectorizer's n-grams are a subset of this
+        _NgramTable's n-grams.
+        :param vectorizer: a supported CountVectorizer
+        :return: whether this _NgramTable covers the vectorizer
+        """
+        min_n, max_n = vectorizer.ngram_range
+        return self.params == _tokenization_params(vectorizer)\
+            and self.ngram_range[0] <= min_n and max_n <= self.ngram_range[1]
+
+    def lookup(self, documents):
+        """
+        Returns the rows of the given documents, tokenizing the documents that
+        have not been seen before.
+        :param documents: an Iterable of result_full_description strings
+        :return: an array whose ith element is the row of the ith document
+        """
+        rows = np.empty(len(documents), dtype=np.intp)
+        for i, document in enumerate(documents):
+            row = self._rows.get(document)
+            if row is None:
+                row = self._add(document)
+            rows[i] = row
+        return rows
+
+    def get_matrices(self):
+        """
+        Returns the cached counts as sparse matrices.
+        :return: the n-gram counts of the documents;
+                 the number of pipe-separated phrases of each document that
+                 contain each n-gram;
+                 an array whose ith element is the number of phrases in the
+                 ith document
+        """
+        if self._matrices is None:
+            shape = (len(self._rows), len(self.terms) + 1)
+            self._matrices = (
+                self._counts.to_csr(shape),
+                self._phrase_frequencies.to_csr(shape),
+                np.array(self._phrase_counts, dtype=np.int64)
+            )
+        return self._matrices
+
+    def get_columns(self, vocabulary, ngram_range):
+        """
+        Returns the columns of the given vocabulary's terms.
+        :param vocabulary: a Dict mapping terms to feature indices
+        :param ngram_range: the (min_n, max_n) of the vectorizer; n-grams
+        outside this range are mapped to the zero column
+        :return: an array whose jth element is the column of the jth feature
+        """
+        min_n, max_n = ngram_range
+        zero = len(self.terms)
+
+        columns = np.full(len(vocabulary), zero, dtype=np.intp)
+        for term, index in vocabulary.items():
+            term_id = self._term_ids.get(term)
+            if term_id is not None\
+                    and min_n <= self._term_lengths[term_id] <= max_n:
+                columns[index] = term_id
+        return columns
+
+    def length_mask(self, ngram_range):
+        """
+        Returns a mask of the columns whose n-grams are within the given
+        ngram_range.
+        :param ngram_range: a (min_n, max_n) Tuple
+        :return: a boolean array with one element per column
+        """
+        min_n, max_n = ngram_range
+        lengths = np.array(self._term_lengths + [0], dtype=np.intp)
+        return (min_n <= lengths) & (lengths <= max_n)
+
+    def _add(self, document):
+        """
+        Tokenizes the given document and appends its row to this _NgramTable.
+        :param document: a result_full_description string
+        :return: the document's row
+        """
+        counts = Counter(map(self._get_term_id, self._analyzer(document)))
+
+        phrases = document.split("|")
+        phrase_frequencies = Counter()
+        for phrase in phrases:
+            phrase_frequencies.update(
+                set(map(self._get_term_id, self._analyzer(phrase))))
+
+        self._counts.append(counts)
+        self._phrase_frequencies.append(phrase_frequencies)
+        self._phrase_counts.append(len(phrases))
+        self._matrices = None
+
+        row = len(self._rows)
+        self._rows[document] = row
+        return row
+
+    def _get_term_id(self, term):
+        """
+        Returns the column of the given n-gram, adding a column if the n-gram
+        has not been seen before.
+        :param term: an n-gram produced by the analyzer
+        :return: the n-gram's column
+        """
+        term_id = self._term_ids.get(term)
+        if term_id is None:
+            term_id = len(self.terms)
+            self._term_ids[term] = term_id
+            self.terms.append(term)
+            self._term_lengths.append(term.count(" ") + 1)
+        return term_id
+
+
+class _SparseRows:
+    """
+    A growable list of sparse rows, convertible to a CSR matrix.
+    """
+    def __init__(self):
+        """
+        Returns a new, empty _SparseRows.
+        """
+        self._indices = []
+        self._data = []
+        self._indptr = [0]
+
+    def append(self, row):
+        """
+        Appends a row.
+        :param row: a Dict mapping columns to nonzero values
+        :return: None
+        """
+        self._indices.extend(row.keys())
+        self._data.extend(row.values())
+        self._indptr.append(len(self._indices))
+
+    def to_csr(self, shape):
+        """
+        Returns the rows as a CSR matrix.
+        :param shape: the shape of the matrix
+        :return: the CSR matrix
+        """
+        return sp.csr_matrix(
+            (np.array(self._data, dtype=np.int64),
+             np.array(self._indices, dtype=np.intp),
+             np.array(self._indptr, dtype=np.intp)),
+            shape=shape
+        )
+
+
+def _tokenization_params(vectorizer):
+    """
+    Returns the parameters that determine how the given vectorizer tokenizes a
+    document, other than its ngram_range.
+    :param vectorizer: a supported CountVectorizer
+    :return: a Tuple of parameters
+    """
+    return (vectorizer.encoding, vectorizer.decode_error,
+            vectorizer.strip_accents, vectorizer.lowercase,
+            vectorizer.token_pattern)